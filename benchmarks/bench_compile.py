@@ -0,0 +1,36 @@
+"""Size of compiled (binary) models compared with the ascii source.
+
+Compiles a 10k vertex / 20k face tile with 10 animations and a model with
+300 mesh nodes and 100 animations (few keys each):
+
+    python benchmarks/bench_compile.py [--package /path/to/checkout]
+"""
+
+import os
+import tempfile
+
+import common
+
+
+def main():
+    parser = common.get_parser(__doc__.split('\n')[0])
+    args = parser.parse_args()
+    common.import_package(args)
+    from neverblender import nvb_mdl
+
+    models = [('tile', common.write_tile),
+              ('animations', common.write_anim_model)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, write_model in models:
+            filepath = os.path.join(tmpdir, name + '.mdl')
+            write_model(filepath)
+            with open(filepath, 'rb') as f:
+                ascii_data = f.read()
+            binary_data = nvb_mdl.Mdl.compile_ascii(ascii_data)
+            print('%-10s ascii %.2f MB, binary %.2f MB (%.2f)' %
+                  (name, len(ascii_data) / 2**20, len(binary_data) / 2**20,
+                   len(binary_data) / len(ascii_data)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Memory and time used to generate exported ascii lines.
+
+Compares collecting all lines in a list with streaming them through a
+LineWriter (2000 nodes x 500 rows) and formatting rows with str.format
+with the vectorized nvb_format.format_rows (300k rows):
+
+    python benchmarks/bench_export.py [--package /path/to/checkout]
+"""
+
+import os
+import tempfile
+import tracemalloc
+
+import numpy
+
+import common
+
+vertex_format = '    {: 8.5f} {: 8.5f} {: 8.5f}'
+key_format = '      {:> 6.3f} {:> 6.5f} {:> 6.5f} {:> 6.5f} {:> 6.5f}'
+
+
+def generate_lines(ascii_lines, node_count=2000, row_count=500):
+    """Append lines of a synthetic model with many vertex lists."""
+    rows = ['    {: 8.5f} {: 8.5f} {: 8.5f}'.format(i * 0.1, i * 0.2, i * 0.3)
+            for i in range(row_count)]
+    for i in range(node_count):
+        ascii_lines.append('node trimesh n' + str(i))
+        ascii_lines.append('  verts ' + str(row_count))
+        for row in rows:
+            ascii_lines.append(row + ' ')  # New string for every row
+        ascii_lines.append('endnode')
+
+
+def peak_memory(func):
+    """Return the peak memory allocated while running func in bytes."""
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = common.get_parser(__doc__.split('\n')[0])
+    args = parser.parse_args()
+    common.import_package(args)
+    from neverblender import nvb_export
+    from neverblender import nvb_format
+
+    def write_list():
+        ascii_lines = []
+        generate_lines(ascii_lines)
+        with open(filepath, 'w') as f:
+            f.write('\n'.join(ascii_lines))
+
+    def write_stream():
+        with nvb_export.LineWriter(filepath) as ascii_lines:
+            generate_lines(ascii_lines)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'export.mdl')
+        print('list + join   peak %6.1f MB' %
+              (peak_memory(write_list) / 2**20))
+        print('LineWriter    peak %6.1f MB' %
+              (peak_memory(write_stream) / 2**20))
+        print('file size          %6.1f MB' %
+              (os.path.getsize(filepath) / 2**20))
+
+    rng = numpy.random.RandomState(1)
+    verts = rng.uniform(-50, 50, (300000, 3)).astype(numpy.float32)
+    keys = rng.uniform(-1, 1, (300000, 5))
+    keys[:, 0] = numpy.arange(len(keys)) / 30
+    for name, fmt, values in [('vertex rows', vertex_format, verts),
+                              ('orientation keys', key_format, keys)]:
+        def format_each():
+            return [fmt.format(*row) for row in values.tolist()]
+
+        def format_all():
+            return nvb_format.format_rows(fmt, values)
+
+        assert format_each() == format_all()
+        print('300k %-16s str.format %.3fs, format_rows %.3fs' %
+              (name, common.best_time(format_each),
+               common.best_time(format_all)))
+
+
+if __name__ == '__main__':
+    main()
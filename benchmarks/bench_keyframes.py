@@ -0,0 +1,115 @@
+"""Time to collect animation keys from fcurves on export.
+
+Three fcurves with 3000 keys each are shared by 100 animations of 30
+frames. Compares scanning all keyframe points per animation and
+evaluating the fcurves at every key with the KeyframeIndex of the export
+plan. Plain python objects stand in for blender's fcurves:
+
+    python benchmarks/bench_keyframes.py [--package /path/to/checkout]
+"""
+
+import types
+import bisect
+
+import numpy
+
+import common
+
+
+class KeyframePoints():
+    """Stand-in for the keyframe points of an fcurve."""
+
+    def __init__(self, points):
+        """TODO: DOC."""
+        self.points = points
+
+    def __len__(self):
+        """TODO: DOC."""
+        return len(self.points)
+
+    def __iter__(self):
+        """TODO: DOC."""
+        return (types.SimpleNamespace(co=p) for p in self.points)
+
+    def foreach_get(self, attr, values):
+        """TODO: DOC."""
+        values[:] = numpy.ravel(self.points)
+
+
+class FCurve():
+    """Stand-in for an fcurve with linear interpolation."""
+
+    def __init__(self, points):
+        """TODO: DOC."""
+        self.keyframe_points = KeyframePoints(points)
+        self.frames = [p[0] for p in points]
+        self.modifiers = []
+        self.evaluate_count = 0
+
+    def as_pointer(self):
+        """TODO: DOC."""
+        return id(self)
+
+    def evaluate(self, frame):
+        """Return the value at a frame."""
+        self.evaluate_count += 1
+        points = self.keyframe_points.points
+        i = bisect.bisect_left(self.frames, frame)
+        if i < len(points) and points[i][0] == frame:
+            return points[i][1]
+        return float(numpy.interp(frame, self.frames, [p[1] for p in points]))
+
+
+def get_keyed_values_scan(fcurves, defaults, anim, fps):
+    """Get keys by scanning all keyframe points (code before the index)."""
+    keyed_frames = list(set().union(
+        *[[k.co[0] for k in fcu.keyframe_points
+           if anim.frameStart <= k.co[0] <= anim.frameEnd]
+          for fcu in fcurves if fcu]))
+    keyed_frames.sort()
+    values = [[fcu.evaluate(f) if fcu else d
+               for fcu, d in zip(fcurves, defaults)] for f in keyed_frames]
+    times = [(f - anim.frameStart) / fps for f in keyed_frames]
+    return times, values
+
+
+def main():
+    parser = common.get_parser(__doc__.split('\n')[0])
+    args = parser.parse_args()
+    common.import_package(args)
+    from neverblender import nvb_export
+    from neverblender import nvb_animnode
+
+    rng = numpy.random.RandomState(1)
+    points = [[(float(f), float(v)) for f, v in
+               enumerate(rng.random_sample(3000).astype(numpy.float32))]
+              for _ in range(3)]
+    fcurves = [FCurve(p) for p in points]
+    defaults = [0.0, 0.0, 0.0]
+    anims = [types.SimpleNamespace(frameStart=i * 30, frameEnd=i * 30 + 29)
+             for i in range(100)]
+    options = types.SimpleNamespace(
+        scene=types.SimpleNamespace(render=types.SimpleNamespace(fps=30)),
+        export_plan=None)
+
+    def scan():
+        return [get_keyed_values_scan(fcurves, defaults, a, 30)
+                for a in anims]
+
+    def index():
+        options.export_plan = types.SimpleNamespace(
+            keyframes=nvb_export.KeyframeIndex())
+        return [nvb_animnode.Animnode.get_keyed_values(
+                fcurves, defaults, a, options) for a in anims]
+
+    for name, func in [('scan ', scan), ('index', index)]:
+        for fcu in fcurves:
+            fcu.evaluate_count = 0
+        keys = func()
+        evaluate_count = sum(fcu.evaluate_count for fcu in fcurves)
+        print('%s %.3fs, %d evaluate calls' %
+              (name, common.best_time(func), evaluate_count))
+    assert keys == scan()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Memory retained by a read model.
+
+Writes a model with 300 mesh nodes and 100 animations (30000 animation
+nodes) and measures the memory held by the read Mdl with tracemalloc.
+To compare with another revision, pass the path of its checkout:
+
+    python benchmarks/bench_memory.py [--package /path/to/checkout]
+"""
+
+import os
+import gc
+import tempfile
+import tracemalloc
+
+import common
+
+
+def main():
+    parser = common.get_parser(__doc__.split('\n')[0])
+    args = parser.parse_args()
+    common.import_package(args)
+    from neverblender import nvb_def
+    from neverblender import nvb_mdl
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'big.mdl')
+        common.write_anim_model(filepath)
+        gc.collect()
+        tracemalloc.start()
+        mdl = nvb_mdl.Mdl()
+        mdl.read_mdl(filepath, nvb_def.ImportOptions())
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print('nodes %d, animation nodes %d' %
+          (len(mdl.mdlnodes), sum(len(a.nodes) for a in mdl.animations)))
+    print('retained %.1f MB, peak %.1f MB' % (retained / 2**20, peak / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Time to build uv layers, vertex colors and sharp edges on import.
+
+Also times the check for degenerated uvs (100k faces, 60k tverts).
+
+Uses a grid mesh of 50k vertices and 100k faces and compares the array
+based code with the per-loop (or per-edge) code it replaced. Plain python
+objects stand in for blender's mesh data, so the per-loop timings are
+lower bounds, blender's data access is slower still:
+
+    python benchmarks/bench_mesh.py [--package /path/to/checkout]
+"""
+
+import math
+import types
+import itertools
+import collections
+
+import numpy
+
+import common
+
+
+class Collection(list):
+    """Stand-in for a collection of blender data with foreach access.
+
+    Like blender, foreach_get and foreach_set copy whole arrays at once.
+    """
+
+    def foreach_get(self, attr, values):
+        """TODO: DOC."""
+        values[:] = self.arrays[attr]
+
+    def foreach_set(self, attr, values):
+        """TODO: DOC."""
+        self.arrays[attr] = values
+
+
+def make_grid(size):
+    """Return vertex indices, edge index per loop and edge count."""
+    idx = numpy.arange((size + 1) ** 2).reshape(size + 1, size + 1)
+    a, b = idx[:-1, :-1].ravel(), idx[:-1, 1:].ravel()
+    c, d = idx[1:, 1:].ravel(), idx[1:, :-1].ravel()
+    faces = numpy.concatenate([numpy.stack([a, b, c], 1),
+                               numpy.stack([a, c, d], 1)])
+    # Edges of every loop (from a corner to the next one)
+    pairs = numpy.stack([faces, numpy.roll(faces, -1, 1)], 2).reshape(-1, 2)
+    pairs.sort(1)
+    edges, loop_edges = numpy.unique(pairs, axis=0, return_inverse=True)
+    return faces.astype(numpy.int32), \
+        loop_edges.ravel().astype(numpy.int32), len(edges)
+
+
+def make_collection(count, arrays, **attrs):
+    """Return a collection of count items with the given attributes."""
+    items = Collection(types.SimpleNamespace(index=i, **attrs)
+                       for i in range(count))
+    items.arrays = arrays
+    for attr, values in arrays.items():
+        for item, value in zip(items, values.tolist()):
+            setattr(item, attr, value)
+    return items
+
+
+def make_mesh(faces):
+    """Return a stand-in for a blender mesh with triangle faces.
+
+    Uv and color layers are created once, new() returns the same data.
+    """
+    loop_cnt = faces.size
+    loops = make_collection(loop_cnt, {'vertex_index': faces.ravel()})
+    mesh = types.SimpleNamespace(polygons=range(len(faces)), loops=loops)
+    uv_data = make_collection(loop_cnt, dict(), uv=None)
+    color_data = make_collection(loop_cnt, dict(), color=(0.0, 0.0, 0.0))
+    mesh.uv_layers = dict()
+    mesh.uv_textures = types.SimpleNamespace(new=None, active=None)
+    mesh.vertex_colors = types.SimpleNamespace(new=None)
+
+    def new_uv_texture(name):
+        mesh.uv_layers[name] = types.SimpleNamespace(data=uv_data)
+        return types.SimpleNamespace(name=name, data=[])
+
+    def new_vertex_colors(name):
+        return types.SimpleNamespace(name=name, data=color_data)
+
+    mesh.uv_textures.new = new_uv_texture
+    mesh.vertex_colors.new = new_vertex_colors
+    return mesh
+
+
+def create_uv_layer_loop(mesh, tverts, faceuvs, uvname):
+    """Set uvs one loop at a time (code before foreach_set)."""
+    uvmap = mesh.uv_textures.new(uvname)
+    uvlayer = mesh.uv_layers[uvmap.name]
+    for i in range(len(faceuvs)):
+        uvlayer.data[3*i].uv = tverts[faceuvs[i][0]]
+        uvlayer.data[3*i+1].uv = tverts[faceuvs[i][1]]
+        uvlayer.data[3*i+2].uv = tverts[faceuvs[i][2]]
+    return uvlayer
+
+
+def create_vcolors_loop(mesh, vcolors, vcname):
+    """Set colors one loop at a time (code before foreach_set)."""
+    cmap = mesh.vertex_colors.new(vcname)
+    vert_loop_map = {}
+    for l in mesh.loops:
+        if l.vertex_index in vert_loop_map:
+            vert_loop_map[l.vertex_index].append(l.index)
+        else:
+            vert_loop_map[l.vertex_index] = [l.index]
+    for vidx in vert_loop_map:
+        for lidx in vert_loop_map[vidx]:
+            cmap.data[lidx].color = vcolors[vidx]
+    return cmap
+
+
+def set_sharp_edges_loop(edges, facedef):
+    """Compare the groups of the first two faces of every edge."""
+    for e in edges:
+        f = e.link_faces
+        if (len(f) > 1) and (facedef[f[0]][3] != facedef[f[1]][3]):
+            edges[e.index].use_edge_sharp = True
+
+
+def get_sharp_edges(loop_edges, face_groups, edge_cnt):
+    """Mark edges between groups, the same way as Trimesh.createMesh."""
+    loop_groups = numpy.repeat(face_groups, 3)
+    group_min = numpy.full(edge_cnt, numpy.iinfo(numpy.int32).max,
+                           numpy.int32)
+    group_max = numpy.full(edge_cnt, numpy.iinfo(numpy.int32).min,
+                           numpy.int32)
+    numpy.minimum.at(group_min, loop_edges, loop_groups)
+    numpy.maximum.at(group_max, loop_edges, loop_groups)
+    return group_min < group_max
+
+
+def fix_degenerated_uvs_loop(tverts, facedef):
+    """Check the uvs one face at a time (code before the array version)."""
+    def distance(p0, p1):
+        return math.sqrt(sum([(a - b)**2 for a, b in list(zip(p0, p1))]))
+
+    tvert_cnt = len(tverts)
+    add_dummy_uvs = False
+    for f in facedef:
+        uvs = tverts[f[4]], tverts[f[5]], tverts[f[6]]
+        min_distance = distance(uvs[0], uvs[1])
+        for p0, p1 in itertools.combinations(uvs, 2):
+            min_distance = min(min_distance, distance(p0, p1))
+        if min_distance <= 0.001:
+            add_dummy_uvs = True
+            f[4], f[5], f[6] = tvert_cnt, tvert_cnt + 1, tvert_cnt + 2
+    if add_dummy_uvs:
+        tverts = numpy.concatenate((tverts, [(0, 0), (0, 1), (1, 1)]))
+    return tverts, facedef
+
+
+def main():
+    parser = common.get_parser(__doc__.split('\n')[0])
+    args = parser.parse_args()
+    common.import_package(args)
+    from neverblender import nvb_node
+
+    faces, loop_edges, edge_cnt = make_grid(223)
+    vert_cnt = faces.max() + 1
+    rng = numpy.random.RandomState(1)
+    tverts = rng.random_sample((vert_cnt, 2)).astype(numpy.float32)
+    vcolors = rng.random_sample((vert_cnt, 3)).astype(numpy.float32)
+    mesh = make_mesh(faces)
+    print('%d vertices, %d faces, %d edges' %
+          (vert_cnt, len(faces), edge_cnt))
+
+    create_uv_layer_loop(mesh, tverts, faces, 'loop')
+    uv_loop = numpy.ravel([d.uv for d in mesh.uv_layers['loop'].data])
+    nvb_node.Trimesh.createUVlayer(mesh, tverts, faces, 'array')
+    assert numpy.array_equal(
+        uv_loop, mesh.uv_layers['array'].data.arrays['uv'])
+    print('uv layer       per loop %.3fs, foreach_set %.4fs' % (
+        common.best_time(
+            lambda: create_uv_layer_loop(mesh, tverts, faces, 'loop')),
+        common.best_time(lambda: nvb_node.Trimesh.createUVlayer(
+            mesh, tverts, faces, 'array'))))
+
+    cmap = create_vcolors_loop(mesh, vcolors, 'loop')
+    colors_loop = numpy.ravel([d.color for d in cmap.data])
+    cmap = nvb_node.Trimesh.createVColors(mesh, vcolors, 'array')
+    assert numpy.array_equal(colors_loop, cmap.data.arrays['color'])
+    print('vertex colors  per loop %.3fs, foreach_set %.4fs' % (
+        common.best_time(
+            lambda: create_vcolors_loop(mesh, vcolors, 'loop')),
+        common.best_time(lambda: nvb_node.Trimesh.createVColors(
+            mesh, vcolors, 'array'))))
+
+    # Random smooth groups in blocks of faces, faces linked to every edge
+    facedef = numpy.zeros((len(faces), 8), numpy.int32)
+    facedef[:, 3] = numpy.repeat(rng.randint(0, 8, len(faces) // 64 + 1),
+                                 64)[:len(faces)]
+    link_faces = collections.defaultdict(list)
+    for loop_idx, edge_idx in enumerate(loop_edges.tolist()):
+        link_faces[edge_idx].append(loop_idx // 3)
+    edges = make_collection(edge_cnt, dict(), use_edge_sharp=False)
+    for e in edges:
+        e.link_faces = link_faces[e.index]
+    facedef_list = facedef.tolist()
+    set_sharp_edges_loop(edges, facedef_list)
+    assert [e.use_edge_sharp for e in edges] == \
+        get_sharp_edges(loop_edges, facedef[:, 3], edge_cnt).tolist()
+    print('sharp edges    per edge %.3fs, arrays      %.4fs' % (
+        common.best_time(lambda: set_sharp_edges_loop(edges, facedef_list)),
+        common.best_time(
+            lambda: get_sharp_edges(loop_edges, facedef[:, 3], edge_cnt))))
+
+    # Random uvs in pairs, half of the pairs within 0.001 of each other.
+    # Every third face uses both uvs of a pair
+    tverts = rng.random_sample((60000, 2)).astype(numpy.float32)
+    tverts[1::2] = tverts[::2] + rng.choice(
+        [0, 0.0007, 0.0011, 0.1], (30000, 1)).astype(numpy.float32)
+    facedef = numpy.zeros((100000, 8), numpy.int32)
+    facedef[:, 4:7] = rng.randint(0, len(tverts), (len(facedef), 3))
+    facedef[::3, 4] &= ~1
+    facedef[::3, 5] = facedef[::3, 4] + 1
+    node = nvb_node.Trimesh()
+
+    def fix_degenerated_uvs():
+        node.tverts = [tverts]
+        node.facedef = facedef.copy()
+        node.fix_degenerated_uvs()
+
+    fix_degenerated_uvs()
+    tverts_loop, facedef_loop = fix_degenerated_uvs_loop(tverts,
+                                                         facedef.copy())
+    assert numpy.array_equal(facedef_loop, node.facedef)
+    assert numpy.array_equal(tverts_loop, node.tverts[0])
+    print('degenerated uvs per face %.3fs, arrays      %.4fs (%d faces)' % (
+        common.best_time(
+            lambda: fix_degenerated_uvs_loop(tverts, facedef.copy())),
+        common.best_time(fix_degenerated_uvs),
+        numpy.count_nonzero(node.facedef[:, 4] == len(tverts))))
+
+
+if __name__ == '__main__':
+    main()
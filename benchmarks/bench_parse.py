@@ -0,0 +1,42 @@
+"""Time to tokenize and to read a key heavy ascii model.
+
+Uses a model with 300 mesh nodes and 100 animations (30000 key lists)
+with 2 and with 30 keys per list.
+To compare with another revision, pass the path of its checkout:
+
+    python benchmarks/bench_parse.py [--package /path/to/checkout]
+"""
+
+import os
+import tempfile
+
+import common
+
+
+def main():
+    parser = common.get_parser(__doc__.split('\n')[0])
+    args = parser.parse_args()
+    common.import_package(args)
+    from neverblender import nvb_def
+    from neverblender import nvb_mdl
+    from neverblender import nvb_parse
+
+    def tokenize():
+        with nvb_parse.map_file(filepath) as data:
+            for _ in nvb_parse.Tokenizer(data):
+                pass
+
+    def read():
+        nvb_mdl.Mdl().read_mdl(filepath, nvb_def.ImportOptions())
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'big.mdl')
+        for key_count in (2, 30):
+            common.write_anim_model(filepath, key_count=key_count)
+            print('%d keys per list: tokenize %.3fs, read %.3fs' %
+                  (key_count, common.best_time(tokenize),
+                   common.best_time(read)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Helpers shared by the benchmarks: package import and synthetic models.
+
+The benchmarks run without blender. Where blender data would be accessed,
+plain python objects stand in for it, so the timings are lower bounds for
+the per-element code they replace.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy
+
+
+def get_parser(description):
+    """Return an argument parser with the --package option."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--package', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), os.pardir),
+        help='directory containing the neverblender package, e.g. a '
+             'checkout of another revision to compare with')
+    return parser
+
+
+def import_package(args):
+    """Make the neverblender package given by the arguments importable."""
+    sys.path.insert(0, os.path.abspath(args.package))
+
+
+def best_time(func, repeat=5):
+    """Return the CPU time of the fastest of several runs of func."""
+    times = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        times.append(time.process_time() - start)
+    return min(times)
+
+
+def write_anim_model(filepath, node_count=300, anim_count=100, key_count=2):
+    """Write a model with many nodes and keyed animations."""
+    lines = ['newmodel big', 'setsupermodel big null', 'beginmodelgeom big',
+             'node dummy big', '  parent null', 'endnode']
+    for i in range(node_count):
+        lines += ['node trimesh n%d' % i, '  parent big',
+                  '  position 0 0 0', '  bitmap tex', '  verts 3',
+                  '    0 0 0', '    1 0 0', '    0 1 0', '  faces 1',
+                  '    0 1 2 1 0 1 2 1', 'endnode']
+    lines.append('endmodelgeom big')
+    for a in range(anim_count):
+        lines += ['newanim a%d big' % a, '  length 1.0', '  transtime 0.25',
+                  '  animroot big']
+        for i in range(node_count):
+            lines += ['  node dummy n%d' % i, '    parent big',
+                      '    positionkey']
+            lines += ['      %.5f 0 0 %d' % (k / max(key_count - 1, 1), k)
+                      for k in range(key_count)]
+            lines.append('  endnode')
+        lines.append('doneanim a%d big' % a)
+    lines.append('donemodel big')
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def write_tile(filepath, size=100, anim_count=10):
+    """Write a tile with a single grid mesh of size x size quads."""
+    xs, ys = numpy.meshgrid(numpy.arange(size + 1), numpy.arange(size + 1))
+    xs = xs.ravel()
+    ys = ys.ravel()
+    verts = numpy.stack([xs * 0.37, ys * 0.21, numpy.sin(xs * 0.3)], 1)
+    uvs = numpy.stack([xs / size, ys / size], 1)
+    idx = numpy.arange((size + 1) ** 2).reshape(size + 1, size + 1)
+    a, b = idx[:-1, :-1].ravel(), idx[:-1, 1:].ravel()
+    c, d = idx[1:, 1:].ravel(), idx[1:, :-1].ravel()
+    faces = numpy.concatenate([numpy.stack([a, b, c], 1),
+                               numpy.stack([a, c, d], 1)])
+    rng = numpy.random.RandomState(1)
+    lines = ['newmodel grid', 'setsupermodel grid null',
+             'classification tile', 'setanimationscale 1.0',
+             'beginmodelgeom grid', 'node dummy grid', '  parent null',
+             'endnode', 'node trimesh mesh', '  parent grid',
+             '  position 0 0 0', '  orientation 0 0 0 0', '  bitmap tex01',
+             '  verts ' + str(len(verts))]
+    lines += ['    {: 8.5f} {: 8.5f} {: 8.5f}'.format(*v) for v in verts]
+    lines += ['  faces ' + str(len(faces))]
+    lines += ['    {:d} {:d} {:d}  1  {:d} {:d} {:d}  1'.format(*(f + f))
+              for f in faces.tolist()]
+    lines += ['  tverts ' + str(len(uvs))]
+    lines += ['    {: 6.3f} {: 6.3f}'.format(*t) for t in uvs]
+    lines += ['endnode', 'endmodelgeom grid']
+    for k in range(anim_count):
+        lines += ['newanim a%d grid' % k, '  length 1.0', '  transtime 0.25',
+                  '  animroot grid', '  node dummy grid', '    parent null',
+                  '  endnode', '  node trimesh mesh', '    parent grid',
+                  '    positionkey 31']
+        lines += ['      {: 6.5f} {: 6.5f} {: 6.5f} {: 6.5f}'.format(
+                  t / 30, *rng.random_sample(3)) for t in range(31)]
+        lines += ['    orientationkey 31']
+        lines += ['      {: 6.5f} 0 0 1 {: 6.5f}'.format(t / 30, t / 30)
+                  for t in range(31)]
+        lines += ['  endnode', 'doneanim a%d grid' % k]
+    lines += ['donemodel grid', '']
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(lines))
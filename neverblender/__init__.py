@@ -21,37 +21,53 @@
 """TODO: DOC."""
 
 
-import bpy
+try:
+    import bpy
+except ImportError:  # Not running inside blender, parsing modules only
+    bpy = None
 
 from . import nvb_def
 from . import nvb_utils
+from . import nvb_parse
+from . import nvb_format
+from . import nvb_binary
 from . import nvb_mdl
 from . import nvb_node
 from . import nvb_anim
 from . import nvb_animnode
 from . import nvb_mtr
-from . import nvb_props
+from . import nvb_catalog
+from . import nvb_cache
+from . import nvb_export
 
-from . import nvb_ops
-from . import nvb_ops_io
-from . import nvb_ops_mtr
-from . import nvb_ops_anim
-from . import nvb_ops_set
-from . import nvb_ops_amt
-from . import nvb_ops_node
+if bpy is not None:
+    from . import nvb_props
 
-from . import nvb_ui
+    from . import nvb_ops
+    from . import nvb_ops_io
+    from . import nvb_ops_mtr
+    from . import nvb_ops_anim
+    from . import nvb_ops_set
+    from . import nvb_ops_amt
+    from . import nvb_ops_node
+
+    from . import nvb_ui
 
-if 'bpy' in locals():
     import importlib
     if 'nvb_def' in locals():
         importlib.reload(nvb_def)
         importlib.reload(nvb_utils)
-        importlib.reload(nvb_mdl)
+        importlib.reload(nvb_parse)
+        importlib.reload(nvb_format)
         importlib.reload(nvb_node)
-        importlib.reload(nvb_anim)
         importlib.reload(nvb_animnode)
+        importlib.reload(nvb_anim)
+        importlib.reload(nvb_binary)
+        importlib.reload(nvb_mdl)  # after nvb_node, keeps node classes
         importlib.reload(nvb_mtr)
+        importlib.reload(nvb_catalog)
+        importlib.reload(nvb_cache)
+        importlib.reload(nvb_export)
         importlib.reload(nvb_props)
 
         importlib.reload(nvb_ops)
@@ -79,32 +95,33 @@ bl_info = {
     "category": "Import-Export"}
 
 
-classes = (
-    nvb_props.NVB_PG_animevent,
-    nvb_props.NVB_PG_anim,
-    nvb_props.NVB_PG_material,
-    nvb_props.NVB_PG_flare,
-    nvb_props.NVB_PG_lamp,
-    nvb_props.NVB_PG_object,
-    nvb_props.NVB_PG_bone,
-    nvb_ui.NVB_UL_lensflares,
-    nvb_ui.NVB_UL_anims,
-    nvb_ui.NVB_UL_anim_events,
-    nvb_ui.NVB_UL_set_element,
-    nvb_ui.NVB_PT_aurorabase,
-    nvb_ui.NVB_PT_dummy,
-    nvb_ui.NVB_PT_armature,
-    nvb_ui.NVB_PT_material,
-    nvb_ui.NVB_PT_set,
-    nvb_ui.NVB_PT_mtr,
-    nvb_ui.NVB_PT_lamp_data,
-    nvb_ui.NVB_PT_lamp_object,
-    nvb_ui.NVB_PT_lamp_lensflares,
-    nvb_ui.NVB_PT_mesh_object,
-    nvb_ui.NVB_MT_animlist_specials,
-    nvb_ui.NVB_PT_animlist,
-    nvb_ui.NVB_PT_utils,
-)
+if bpy is not None:
+    classes = (
+        nvb_props.NVB_PG_animevent,
+        nvb_props.NVB_PG_anim,
+        nvb_props.NVB_PG_material,
+        nvb_props.NVB_PG_flare,
+        nvb_props.NVB_PG_lamp,
+        nvb_props.NVB_PG_object,
+        nvb_props.NVB_PG_bone,
+        nvb_ui.NVB_UL_lensflares,
+        nvb_ui.NVB_UL_anims,
+        nvb_ui.NVB_UL_anim_events,
+        nvb_ui.NVB_UL_set_element,
+        nvb_ui.NVB_PT_aurorabase,
+        nvb_ui.NVB_PT_dummy,
+        nvb_ui.NVB_PT_armature,
+        nvb_ui.NVB_PT_material,
+        nvb_ui.NVB_PT_set,
+        nvb_ui.NVB_PT_mtr,
+        nvb_ui.NVB_PT_lamp_data,
+        nvb_ui.NVB_PT_lamp_object,
+        nvb_ui.NVB_PT_lamp_lensflares,
+        nvb_ui.NVB_PT_mesh_object,
+        nvb_ui.NVB_MT_animlist_specials,
+        nvb_ui.NVB_PT_animlist,
+        nvb_ui.NVB_PT_utils,
+    )
 
 
 def menu_func_export(self, context):
@@ -1,6 +1,9 @@
 """TODO: DOC."""
 
-import mathutils
+try:
+    import mathutils
+except ImportError:  # Not running inside blender, parsing only
+    pass
 
 
 def generate_tree(aabb_tree, face_list, rlevel=0):
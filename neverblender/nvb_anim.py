@@ -2,6 +2,7 @@
 
 from . import nvb_utils
 from . import nvb_animnode
+from . import nvb_export
 
 
 class Animation():
@@ -49,59 +50,52 @@ class Animation():
                 if options.anim_restpose:
                     Animation.createRestPose(obj, new_anim.frameStart-5)
 
-    def loadAsciiAnimHeader(self, ascii_data):
-        """TODO: DOC."""
-        ascii_lines = [l.strip().split() for l in ascii_data.splitlines()]
-        for line in ascii_lines:
+    def loadAsciiLine(self, label, line, block, count):
+        """Read a single line from the header of an ascii animation."""
+        if (label == 'newanim'):
+            self.name = nvb_utils.str2identifier(line[1])
+        elif (label == 'length'):
+            self.length = float(line[1])
+        elif (label == 'transtime'):
+            self.transtime = float(line[1])
+        elif (label == 'animroot'):
             try:
-                label = line[0].lower()
-            except (IndexError, AttributeError):
-                continue  # Probably empty line, skip it
-            if (label == 'newanim'):
-                self.name = nvb_utils.str2identifier(line[1])
-            elif (label == 'length'):
-                self.length = float(line[1])
-            elif (label == 'transtime'):
-                self.transtime = float(line[1])
-            elif (label == 'animroot'):
-                try:
-                    self.animroot = line[1].lower()
-                except (ValueError, IndexError):
-                    self.animroot = ''
-            elif (label == 'event'):
-                self.events.append((float(line[1]), line[2]))
+                self.animroot = line[1].lower()
+            except (ValueError, IndexError):
+                self.animroot = ''
+        elif (label == 'event'):
+            self.events.append((float(line[1]), line[2]))
 
-    def loadAsciiAnimNodes(self, ascii_data):
-        """TODO: DOC."""
-        dlm = 'node '
-        node_list = [dlm + s for s in ascii_data.split(dlm) if s != '']
-        for idx, ascii_node in enumerate(node_list):
-            ascii_lines = [l.strip().split() for l in ascii_node.splitlines()]
-            node = nvb_animnode.Animnode()
-            node.load_ascii(ascii_lines, idx)
-            self.nodes.append(node)
+    def loadAscii(self, records):
+        """Load an animation from the records of an ascii mdl file.
 
-    def loadAscii(self, ascii_data):
-        """Load an animation from a block from an ascii mdl file."""
-        animNodesStart = ascii_data.find('node ')
-        if (animNodesStart > -1):
-            self.loadAsciiAnimHeader(ascii_data[:animNodesStart-1])
-            self.loadAsciiAnimNodes(ascii_data[animNodesStart:])
-        else:
+        Reads until the end of the animation ('doneanim') is reached.
+        """
+        node = None
+        for label, line, block, count in records:
+            if label == 'node':
+                node = nvb_animnode.Animnode()
+                node.nodeidx = len(self.nodes)
+                node.load_ascii_line(label, line, block, count)
+                self.nodes.append(node)
+            elif label == 'endnode':
+                node = None
+            elif label == 'doneanim':
+                break
+            elif node is not None:
+                node.load_ascii_line(label, line, block, count)
+            else:
+                self.loadAsciiLine(label, line, block, count)
+        if not self.nodes:
             print('Neverblender - WARNING: Failed to load an animation.')
 
     @staticmethod
-    def generateAsciiNodes(obj, anim, ascii_lines, options):
+    def generateAsciiNodes(mdl_base, anim, ascii_lines, options):
         """TODO: Doc."""
-        nvb_animnode.Animnode.generate_ascii(obj, anim, ascii_lines, options)
-
-        # Sort children to restore original order before import
-        # (important for supermodels/animations to work)
-        children = [c for c in obj.children]
-        children.sort(key=lambda c: c.name)
-        children.sort(key=lambda c: c.nvb.imporder)
-        for c in children:
-            Animation.generateAsciiNodes(c, anim, ascii_lines, options)
+        plan = nvb_export.get_plan(mdl_base, options)
+        for plan_node in plan.nodes:
+            nvb_animnode.Animnode.generate_ascii(plan_node, anim,
+                                                 ascii_lines, options)
 
     @staticmethod
     def generateAscii(mdl_base, anim, ascii_lines, options):
@@ -121,16 +115,13 @@ class Animation():
             ascii_lines.append('  transtime ' +
                                str(round(anim.ttime, 3)))
         # Get anim root
+        plan = nvb_export.get_plan(mdl_base, options)
         if anim.root_obj:
-            root_obj_name = nvb_utils.generate_node_name(
-                anim.root_obj,
-                options.strip_trailing)
+            root_obj_name, _ = plan.get_names(anim.root_obj)
             ascii_lines.append('  animroot ' + root_obj_name)
         elif anim.root:
             # Legacy support: Use old param as not to break old blend files
-            node_list = [mdl_base]
-            nvb_utils.get_children_recursive(mdl_base, node_list)
-            if anim.root and anim.root in [n.name for n in node_list]:
+            if anim.root in plan.lookup:
                 ascii_lines.append('  animroot ' + anim.root)
             else:
                 print('Neverblender - WARNING: Invalid Animation Root for ' +
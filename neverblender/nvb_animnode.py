@@ -1,13 +1,23 @@
 """TODO: DOC."""
 
-import mathutils
+import sys
+import types
 import collections
 import copy
-import bpy
+
+import numpy
+
+try:
+    import mathutils
+    import bpy
+except ImportError:  # Not running inside blender, parsing only
+    pass
 
 from . import nvb_def
 from . import nvb_utils
 from . import nvb_node
+from . import nvb_parse
+from . import nvb_format
 
 
 class Animnode():
@@ -34,6 +44,15 @@ class Animnode():
     material_properties = {'alpha': ('', 1, float,  # Needs conversion
                                      ' {:>4.2f}')}
 
+    # Shared by all nodes until their first key of a kind is added
+    empty_key_data = types.MappingProxyType(dict())
+    key_data_names = ('emitter_data', 'material_data', 'object_data')
+
+    # One instance per node and animation, slots keep them small
+    __slots__ = ('nodeidx', 'nodetype', 'name', 'parent', 'emitter_data',
+                 'material_data', 'object_data', 'sampleperiod', 'animtverts',
+                 'animverts', 'uvdata', 'shapedata')
+
     def __init__(self, name='UNNAMED'):
         """TODO: DOC."""
         self.nodeidx = -1
@@ -41,18 +60,30 @@ class Animnode():
         self.name = name
         self.parent = nvb_def.null
 
-        self.emitter_data = dict()
-        self.material_data = dict()
-        self.object_data = dict()
+        self.emitter_data = Animnode.empty_key_data
+        self.material_data = Animnode.empty_key_data
+        self.object_data = Animnode.empty_key_data
 
         # Animesh Data
         self.sampleperiod = 0.0
-        self.animtverts = []
-        self.animverts = []
+        self.animtverts = nvb_parse.empty_array(2)
+        self.animverts = nvb_parse.empty_array(3)
 
         self.uvdata = False  # Animmesh, uv animations present
         self.shapedata = False  # Animmesh, vertex animations present
 
+    def __getstate__(self):
+        """Return the attributes to pickle, without shared empty key data."""
+        return {name: getattr(self, name) for name in Animnode.__slots__
+                if getattr(self, name) is not Animnode.empty_key_data}
+
+    def __setstate__(self, state):
+        """Restore pickled attributes."""
+        for name in Animnode.key_data_names:
+            setattr(self, name, Animnode.empty_key_data)
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __bool__(self):
         """Return false if the node is empty, i.e. no anims attached."""
         return self.object_data or self.material_data or self.emitter_data
@@ -60,7 +91,7 @@ class Animnode():
     @staticmethod
     def insert_kfp(frames, values, action, dp, dp_dim, action_group=None):
         """TODO: DOC."""
-        if frames and values:
+        if len(frames) and len(values):
             fcu = [nvb_utils.get_fcurve(action, dp, i, action_group)
                    for i in range(dp_dim)]
             kfp_list = [fcu[i].keyframe_points for i in range(dp_dim)]
@@ -73,77 +104,68 @@ class Animnode():
                     p.interpolation = 'LINEAR'
             list(map(lambda c: c.update(), fcu))
 
-    def load_ascii(self, ascii_lines, nodeidx=-1):
-        """TODO: DOC."""
-        def find_end(ascii_lines):
-            """Find the end of a key list.
-
-            We don't know when a list of keys of keys will end. We'll have to
-            search for the first non-numeric value
-            """
-            l_isNumber = nvb_utils.isNumber
-            return next((i for i, v in enumerate(ascii_lines)
-                         if not l_isNumber(v[0])), -1)
+    def get_key_def(self, key_name):
+        """Return (key data dict, data path, dimension) for a key name.
 
-        self.nodeidx = nodeidx
+        Returns None for unknown keys or keys which are already present.
+        The shared empty key data is replaced by a dict on the first key.
+        """
         properties_list = [  # For easier parsing
-            [type(self).emitter_properties, self.emitter_data],
-            [type(self).material_properties, self.material_data],
-            [type(self).object_properties, self.object_data]]
-        l_isNumber = nvb_utils.isNumber
-        for i, line in enumerate(ascii_lines):
-            try:
-                label = line[0].lower()
-            except (IndexError, AttributeError):
-                continue  # Probably empty line, skip it
-            else:
-                if l_isNumber(label):
-                    continue
-            if label == 'node':
-                self.nodetype = line[1].lower()
-                self.name = nvb_utils.str2identifier(line[2])
-            elif label == 'endnode':
-                return
-            elif label == 'parent':
-                self.parentName = nvb_utils.str2identifier(line[1])
-            # Animeshes
-            elif label == 'sampleperiod':
-                self.sampleperiod = float(line[1])
-            elif label == 'animverts':
-                if not self.animverts:
-                    valcnt = int(line[1])
-                    self.animverts = [list(map(float, v))
-                                      for v in ascii_lines[i+1:i+valcnt+1]]
-                    self.shapedata = True
-            elif label == 'animtverts':
-                if not self.animtverts:
-                    valcnt = int(line[1])
-                    self.animtverts = [list(map(float, v))
-                                       for v in ascii_lines[i+1:i+valcnt+1]]
-                    self.uvdata = True
-            else:  # Check for keys
-                key_name = label
-                key_is_single = True
-                if key_name.endswith('key'):
-                    key_is_single = False
-                    key_name = key_name[:-3]
-                for key_def, key_data in properties_list:
-                    if key_name in key_def and key_name not in key_data:
-                        data_path = key_def[key_name][0]
-                        data_dim = key_def[key_name][1]
-                        # key_converter = key_def[key_name][2]
-                        if key_is_single:
-                            data = [[0.0] + list(map(float,
-                                    line[1:data_dim+1]))]
-                        else:
-                            keycnt = find_end(ascii_lines[i+1:])
-                            data = [list(map(float, v[:data_dim+1]))
-                                    for v in ascii_lines[i+1:i+keycnt+1]]
-                        # values = \
-                        # [[float(v[0])] + list(map(key_converter, v[1:]))
-                        #  for v in values]
-                        key_data[key_name] = [data, data_path, data_dim]
-                        break
+            [type(self).emitter_properties, 'emitter_data'],
+            [type(self).material_properties, 'material_data'],
+            [type(self).object_properties, 'object_data']]
+        for key_def, data_name in properties_list:
+            key_data = getattr(self, data_name)
+            if key_name in key_def and key_name not in key_data:
+                if key_data is Animnode.empty_key_data:
+                    key_data = dict()
+                    setattr(self, data_name, key_data)
+                # key_converter = key_def[key_name][2]
+                return key_data, key_def[key_name][0], key_def[key_name][1]
+        return None
+
+    def load_ascii_line(self, label, line, block, count):
+        """Read a single record from an ascii animation node."""
+        if label == 'node':
+            self.nodetype = line[1].lower()
+            self.name = sys.intern(nvb_utils.str2identifier(line[2]))
+        elif label == 'parent':
+            self.parent = sys.intern(nvb_utils.str2identifier(line[1]))
+        # Animeshes
+        elif label == 'sampleperiod':
+            self.sampleperiod = float(line[1])
+        elif label == 'animverts':
+            if not len(self.animverts):
+                self.animverts = nvb_parse.read_array(block, count, 3)
+                self.shapedata = True
+        elif label == 'animtverts':
+            if not len(self.animtverts):
+                self.animtverts = nvb_parse.read_array(block, count, 2)
+                self.uvdata = True
+        else:  # Check for keys
+            key_name = label
+            key_is_single = True
+            if key_name.endswith('key'):
+                key_is_single = False
+                key_name = key_name[:-3]
+            key_def = self.get_key_def(key_name)
+            if key_def:
+                key_data, data_path, data_dim = key_def
+                # Keys are stored as array of shape (N, dim + 1),
+                # the first column holds the times
+                if key_is_single:
+                    keys = numpy.zeros((1, data_dim+1), numpy.float32)
+                    values = line[1:data_dim+1]
+                    keys[0, 1:len(values)+1] = list(map(float, values))
+                else:
+                    # The tokenizer already found the end of the list
+                    keys = nvb_parse.read_array(block, count, data_dim+1)
+                key_data[key_name] = [keys, data_path, data_dim]
+
+    @staticmethod
+    def get_frames(keys, fps, frame_start):
+        """Convert the times of a key array to a list of frames."""
+        return (fps * keys[:, 0].astype(numpy.float64) + frame_start).tolist()
 
     def create_data_material(self, obj, anim, options):
         """Creates animations in material actions."""
@@ -167,13 +189,13 @@ class Animnode():
         fps = options.scene.render.fps
         frame_start = anim.frameStart
         action = nvb_utils.get_action(mat, mat.name)
-        for label, (data, data_path, data_dim) in self.material_data.items():
-            frames = [fps * d[0] + frame_start for d in data]
+        for label, (keys, data_path, data_dim) in self.material_data.items():
+            frames = Animnode.get_frames(keys, fps, frame_start)
             if not data_path:  # Needs conversion
                 values, dp, dp_dim = data_conversion(
-                    label, mat, [d[1:data_dim+1] for d in data])
+                    label, mat, keys[:, 1:data_dim+1].tolist())
             else:
-                values = [d[1:data_dim+1] for d in data]
+                values = keys[:, 1:data_dim+1].tolist()
                 dp = data_path
                 dp_dim = data_dim
             Animnode.insert_kfp(frames, values, action, dp, dp_dim)
@@ -185,11 +207,12 @@ class Animnode():
                 if obj.rotation_mode == 'AXIS_ANGLE':
                     dp = 'rotation_axis_angle'
                     dp_dim = 4
-                    new_values = [[v[3], v[0], v[1], v[2]] for v in vals]
+                    new_values = vals[:, [3, 0, 1, 2]].tolist()
                 elif obj.rotation_mode == 'QUATERNION':
                     dp = 'rotation_quaternion'
                     dp_dim = 4
-                    quats = [mathutils.Quaternion(v[0:3], v[3]) for v in vals]
+                    quats = [mathutils.Quaternion(v[0:3], v[3])
+                             for v in vals.tolist()]
                     new_values = [[q.w, q.x, q.y, q.z] for q in quats]
                 else:
                     dp = 'rotation_euler'
@@ -197,7 +220,7 @@ class Animnode():
                     # Run an euler filer
                     prev_eul = mathutils.Euler()
                     new_values = []
-                    for v in vals:
+                    for v in vals.tolist():
                         quat = mathutils.Quaternion(v[0:3], v[3])
                         eul = quat.to_euler('XYZ', prev_eul)
                         #  eul = nvb_utils.eulerFilter(quat.to_euler(),
@@ -209,25 +232,25 @@ class Animnode():
                 dp = 'location'
                 dp_dim = 3
                 if scl:
-                    new_values = [[l * scl for l in loc] for loc in vals]
+                    new_values = (vals * scl).tolist()
                 else:
-                    new_values = vals
+                    new_values = vals.tolist()
             elif label == 'scale':
                 dp = 'scale'
                 dp_dim = 3
-                new_values = [[v] * dp_dim for v in vals]
+                new_values = numpy.repeat(vals, dp_dim, axis=1).tolist()
             return new_values, dp, dp_dim
 
         fps = options.scene.render.fps
         frame_start = anim.frameStart
         action = nvb_utils.get_action(obj, options.mdlname + '.' + obj.name)
-        for label, (data, data_path, data_dim) in self.object_data.items():
-            frames = [fps * d[0] + frame_start for d in data]
+        for label, (keys, data_path, data_dim) in self.object_data.items():
+            frames = Animnode.get_frames(keys, fps, frame_start)
             if not data_path:  # Needs conversion
                 values, dp, dp_dim = data_conversion(
-                    label, obj, [d[1:data_dim+1] for d in data], options)
+                    label, obj, keys[:, 1:data_dim+1], options)
             else:
-                values = [d[1:data_dim+1] for d in data]
+                values = keys[:, 1:data_dim+1].tolist()
                 dp = data_path
                 dp_dim = data_dim
             Animnode.insert_kfp(frames, values, action, dp, dp_dim)
@@ -244,9 +267,9 @@ class Animnode():
         fps = options.scene.render.fps
         frame_start = anim.frameStart
         action = nvb_utils.get_action(part_settings, part_settings.name)
-        for label, (data, data_path, data_dim) in self.emitter_data.items():
-            frames = [fps * d[0] + frame_start for d in data]
-            values = [d[1:data_dim+1] for d in data]
+        for label, (keys, data_path, data_dim) in self.emitter_data.items():
+            frames = Animnode.get_frames(keys, fps, frame_start)
+            values = keys[:, 1:data_dim+1].tolist()
             dp = data_path
             dp_dim = data_dim
             if dp.startswith('nvb'):  # Group custom properties
@@ -312,7 +335,7 @@ class Animnode():
             curveX = nvb_utils.get_fcurve(action, dp, 0)
             curveY = nvb_utils.get_fcurve(action, dp, 1)
             curveZ = nvb_utils.get_fcurve(action, dp, 2)
-            samples = self.animverts[vertIdx::numVerts]
+            samples = self.animverts[vertIdx::numVerts].tolist()
             for sampleIdx, co in enumerate(samples):
                 frame = frameStart + (sampleIdx * sampleDistance)
                 curveX.keyframe_points.insert(frame, co[0], kfOptions)
@@ -368,7 +391,7 @@ class Animnode():
             dp = dpPrefix + str(uvIdx) + '].uv'
             curveU = nvb_utils.get_fcurve(action, dp, 0)
             curveV = nvb_utils.get_fcurve(action, dp, 1)
-            samples = self.animtverts[tvertIdx::numTVerts]
+            samples = self.animtverts[tvertIdx::numTVerts].tolist()
             for sampleIdx, co in enumerate(samples):
                 frame = frameStart + (sampleIdx * sampleDistance)
                 curveU.keyframe_points.insert(frame, co[0], kfOptions)
@@ -426,6 +449,22 @@ class Animnode():
         if self.shapedata:
             self.create_data_shape(obj, anim, animlength, options)
 
+    @staticmethod
+    def get_keyed_values(fcurves, defaults, anim, options):
+        """Get times and values of all keys of fcurves in an animation.
+
+        Returns a list of times (in seconds, relative to the start of the
+        animation) and a list of values with one component per fcurve.
+        Missing fcurves (None) use the default value.
+        """
+        keyframes = options.export_plan.keyframes
+        frames = keyframes.get_frames(fcurves, anim.frameStart, anim.frameEnd)
+        values = [keyframes.get_values(fcu, frames) if fcu else
+                  numpy.full(len(frames), default)
+                  for fcu, default in zip(fcurves, defaults)]
+        times = (frames - anim.frameStart) / options.scene.render.fps
+        return times.tolist(), numpy.column_stack(values).tolist()
+
     @staticmethod
     def get_keys_emitter(psy, anim, key_data, options):
         """Get keys from particle settings."""
@@ -433,9 +472,6 @@ class Animnode():
         action = psy.animation_data.action
         if not action:
             return
-        fps = options.scene.render.fps
-        anim_start = anim.frameStart
-        anim_end = anim.frameEnd
         # List of exportable data paths with formats and conversion functions
         exports = []
         for aur_name, (dp, dp_dim, _, aur_fstr) in \
@@ -446,14 +482,8 @@ class Animnode():
         for aur_name, aur_dim, aur_fstr, dp_name, dp_dim in exports:
             fcu = [all_fcurves.find(dp_name, i) for i in range(dp_dim)]
             if fcu.count(None) < dp_dim:  # ignore empty fcurves
-                keyed_frames = list(set().union(
-                    *[[k.co[0] for k in fcu[i].keyframe_points
-                       if anim_start <= k.co[0] <= anim_end]
-                      for i in range(dp_dim)]))
-                keyed_frames.sort()
-                aur_values = [[fcu[i].evaluate(f) for i in range(dp_dim)]
-                              for f in keyed_frames]
-                aur_times = [(f - anim_start) / fps for f in keyed_frames]
+                aur_times, aur_values = Animnode.get_keyed_values(
+                    fcu, [0.0] * dp_dim, anim, options)
                 aur_keys = list(zip(aur_times, aur_values))
                 key_data.append([aur_name, aur_keys, aur_dim * aur_fstr])
 
@@ -485,25 +515,14 @@ class Animnode():
             return
         # List of exportable data paths with formats and conversion functions
         exports = get_exports(action)
-        fps = options.scene.render.fps
-        anim_start = anim.frameStart
-        anim_end = anim.frameEnd
         # Get keyframe data
         all_fcurves = action.fcurves
         for aur_name, aur_dim, aur_fstr, dp_name, dp_dim, _, \
                 default_val in exports:
             fcu = [all_fcurves.find(dp_name, i) for i in range(dp_dim)]
             if fcu.count(None) < dp_dim:  # ignore empty fcurves
-                keyed_frames = list(set().union(
-                    *[[k.co[0] for k in fcu[i].keyframe_points
-                       if anim_start <= k.co[0] <= anim_end]
-                      for i in range(dp_dim)]))
-                keyed_frames.sort()
-                aur_values = [[fcu[i].evaluate(f) if fcu[i] else default_val[i]
-                              for i in range(dp_dim)] for f in keyed_frames]
-                # values = [[fcu[i].evaluate(f) for i in range(dp_dim)]
-                #           for f in frames]
-                aur_times = [(f - anim_start) / fps for f in keyed_frames]
+                aur_times, aur_values = Animnode.get_keyed_values(
+                    fcu, default_val, anim, options)
                 aur_keys = list(zip(aur_times, aur_values))
                 key_data.append([aur_name, aur_keys, aur_dim * aur_fstr])
 
@@ -571,49 +590,39 @@ class Animnode():
             return
         # List of exportable data paths with formats and conversion functions
         exports = get_exports(obj.rotation_mode)
-        fps = options.scene.render.fps
-        anim_start = anim.frameStart
-        anim_end = anim.frameEnd
         # Get keyframe data
         all_fcurves = action.fcurves
         for aur_name, aur_dim, aur_fstr, dp_name, dp_dim, dp_conversion, \
                 default_val in exports:
             fcu = [all_fcurves.find(dp_name, i) for i in range(dp_dim)]
             if fcu.count(None) < dp_dim:  # ignore empty fcurves
-                keyed_frames = list(set().union(
-                    *[[k.co[0] for k in fcu[i].keyframe_points
-                       if anim_start <= k.co[0] <= anim_end]
-                      for i in range(dp_dim) if fcu[i]]))
-                keyed_frames.sort()
                 # Get values at keyed frames and convert
-                values = [[fcu[i].evaluate(f) if fcu[i] else default_val[i]
-                           for i in range(dp_dim)] for f in keyed_frames]
-                # values = [[fcu[i].evaluate(f) for i in range(dp_dim)]
-                #           for f in frames]
+                aur_times, values = Animnode.get_keyed_values(
+                    fcu, default_val, anim, options)
                 # Convert to the format used by MDLs
                 if dp_conversion is not None:
                     aur_values = dp_conversion(obj, values)
                 else:
                     aur_values = values
-                aur_times = [(f - anim_start) / fps for f in keyed_frames]
                 aur_keys = list(zip(aur_times, aur_values))
                 key_data.append([aur_name, aur_keys, aur_dim * aur_fstr])
 
     @staticmethod
-    def generate_ascii_keys(obj, anim, asciiLines, options):
+    def generate_ascii_keys(plan_node, anim, asciiLines, options):
         """TODO: DOC."""
         kdata = []
         # 1. Object animation data
+        obj = plan_node.obj
         if obj.animation_data:
             Animnode.get_keys_object(obj, anim, kdata, options)
         # 2. Material animation data
-        mat = obj.active_material
+        mat = plan_node.material
         if mat and mat.animation_data:
             Animnode.get_keys_material(mat, anim, kdata, options)
         # 3. particle System/Emitter animation data
-        part_sys = obj.particle_systems.active
-        if part_sys and part_sys.settings.animation_data:
-            Animnode.get_keys_emitter(part_sys.settings, anim, kdata, options)
+        part_settings = plan_node.particles
+        if part_settings and part_settings.animation_data:
+            Animnode.get_keys_emitter(part_settings, anim, kdata, options)
         # Add keys to ascii lines
         time_fstr = '{:> 6.3f}'
         for key_name, keys, val_fstr in kdata:
@@ -621,7 +630,8 @@ class Animnode():
             if num_keys > 0:  # Create a key list
                 asciiLines.append('    ' + key_name + 'key ' + str(num_keys))
                 fstr = '      ' + time_fstr + val_fstr
-                asciiLines.extend([fstr.format(k[0], *k[1]) for k in keys])
+                asciiLines.extend(nvb_format.format_rows(
+                    fstr, [[k[0], *k[1]] for k in keys]))
 
     @staticmethod
     def generate_ascii_animesh_shapes(obj, anim, asciiLines, options,
@@ -697,7 +707,7 @@ class Animnode():
                 asciiLines.append('    animverts ' + str(numAnimVerts))
                 for frame, key in keys.items():
                     fstr = '      {: 6.3f} {: 6.3f} {: 6.3f}'
-                    asciiLines.extend([fstr.format(*v) for v in key])
+                    asciiLines.extend(nvb_format.format_rows(fstr, key))
                 asciiLines.append('    endlist')
                 return numSamples
         return -1
@@ -774,7 +784,7 @@ class Animnode():
                 asciiLines.append('    animtverts ' + str(numAnimUVs))
                 for frame, key in keys.items():
                     fstr = '      {: 6.3f} {: 6.3f}  0'
-                    asciiLines.extend([fstr.format(*v) for v in key])
+                    asciiLines.extend(nvb_format.format_rows(fstr, key))
                 asciiLines.append('    endlist')
                 return numSamples
         return -1
@@ -798,18 +808,14 @@ class Animnode():
                                                options, maxsamples)
 
     @staticmethod
-    def generate_ascii(obj, anim, asciiLines, options):
-        """TODO:Doc."""
-        if not obj:
-            return
+    def generate_ascii(plan_node, anim, asciiLines, options):
+        """Add a node of the export plan (nvb_export.PlanNode)."""
         # Type + Name
-        node_type = nvb_utils.getNodeType(obj)
-        node_name = nvb_utils.generate_node_name(obj, options.strip_trailing)
-        asciiLines.append('  node ' + node_type + ' ' + node_name)
+        asciiLines.append('  node ' + plan_node.nodetype + ' ' +
+                          plan_node.name)
         # Parent
-        parent_name = nvb_utils.generate_node_name(obj.parent,
-                                                   options.strip_trailing)
-        asciiLines.append('  parent ' + parent_name)
-        Animnode.generate_ascii_animesh(obj, anim, asciiLines, options)
-        Animnode.generate_ascii_keys(obj, anim, asciiLines, options)
+        asciiLines.append('  parent ' + plan_node.parent)
+        Animnode.generate_ascii_animesh(plan_node.obj, anim, asciiLines,
+                                        options)
+        Animnode.generate_ascii_keys(plan_node, anim, asciiLines, options)
         asciiLines.append('  endnode')
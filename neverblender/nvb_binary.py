@@ -0,0 +1,1652 @@
+"""Readers and writers for binary (compiled) mdl and walkmesh files.
+
+Compiled mdl files start with a 12 byte header (zero, size of the model data,
+size of the raw data). Pointers in the model data are relative to the start
+of the model data (byte 12), vertex data pointers in mesh headers are
+relative to the start of the raw data, which follows the model data.
+All structures are described as numpy dtypes and read as views of the
+(memory mapped) file, arrays are copied once into the nodes.
+"""
+
+import collections
+
+import numpy
+
+from . import nvb_def
+from . import nvb_node
+from . import nvb_anim
+from . import nvb_animnode
+from . import nvb_utils
+
+# Unused pointers are set to this value
+null_ptr = 0xFFFFFFFF
+
+# Three floats, e.g. a vertex. Array sizes count vectors, not floats.
+vector3 = numpy.dtype(('<f4', 3))
+
+
+def array_def(name):
+    """Field of a dynamic array: pointer, used and allocated size."""
+    return (name, '<u4', 3)
+
+
+file_header = numpy.dtype([('zero', '<u4'),
+                           ('mdl_size', '<u4'),
+                           ('raw_size', '<u4')])
+
+geometry_fields = [('func_ptr', '<u4', 2),
+                   ('name', 'S64'),
+                   ('root_node', '<u4'),
+                   ('node_count', '<u4'),
+                   ('runtime', '<u4', 6),
+                   ('ref_count', '<u4'),
+                   ('geometry_type', 'u1'),
+                   ('padding0', 'u1', 3)]
+
+model_header = numpy.dtype(geometry_fields +
+                           [('unknown0', 'u1', 2),
+                            ('classification', 'u1'),
+                            ('fogged', 'u1'),
+                            ('unknown1', '<u4'),
+                            array_def('animations'),
+                            ('supermodel_ptr', '<u4'),
+                            ('bbox_min', '<f4', 3),
+                            ('bbox_max', '<f4', 3),
+                            ('radius', '<f4'),
+                            ('animscale', '<f4'),
+                            ('supermodel', 'S64')])
+
+animation_header = numpy.dtype(geometry_fields +
+                               [('length', '<f4'),
+                                ('transtime', '<f4'),
+                                ('animroot', 'S64'),
+                                array_def('events')])
+
+animation_event = numpy.dtype([('time', '<f4'),
+                               ('name', 'S32')])
+
+node_header = numpy.dtype([('func_ptr', '<u4', 6),
+                           ('inheritcolor', '<u4'),
+                           ('partnumber', '<i4'),
+                           ('name', 'S32'),
+                           ('geometry_ptr', '<u4'),
+                           ('parent_ptr', '<u4'),
+                           array_def('children'),
+                           array_def('controller_keys'),
+                           array_def('controller_data'),
+                           ('flags', '<u4')])
+
+controller_key = numpy.dtype([('type', '<u4'),
+                              ('rows', '<i2'),
+                              ('time_index', '<i2'),
+                              ('data_index', '<i2'),
+                              ('columns', 'u1'),
+                              ('padding', 'u1')])
+
+light_header = numpy.dtype([('flareradius', '<f4'),
+                            array_def('unknown'),
+                            array_def('flaresizes'),
+                            array_def('flarepositions'),
+                            array_def('flarecolorshifts'),
+                            array_def('flaretextures'),
+                            ('lightpriority', '<u4'),
+                            ('ambientonly', '<u4'),
+                            ('ndynamictype', '<u4'),
+                            ('affectdynamic', '<u4'),
+                            ('shadow', '<u4'),
+                            ('lensflares', '<u4'),
+                            ('fadinglight', '<u4')])
+
+emitter_header = numpy.dtype([('deadspace', '<f4'),
+                              ('blastradius', '<f4'),
+                              ('blastlength', '<f4'),
+                              ('xgrid', '<u4'),
+                              ('ygrid', '<u4'),
+                              ('spawntype', '<u4'),
+                              ('update', 'S32'),
+                              ('render', 'S32'),
+                              ('blend', 'S32'),
+                              ('texture', 'S64'),
+                              ('chunkname', 'S16'),
+                              ('twosidedtex', '<u4'),
+                              ('loop', '<u4'),
+                              ('renderorder', '<u2'),
+                              ('padding', '<u2'),
+                              ('flags', '<u4')])
+
+reference_header = numpy.dtype([('refmodel', 'S64'),
+                                ('reattachable', '<u4')])
+
+mesh_header = numpy.dtype([('func_ptr', '<u4', 2),
+                           array_def('faces'),
+                           ('bbox_min', '<f4', 3),
+                           ('bbox_max', '<f4', 3),
+                           ('radius', '<f4'),
+                           ('average', '<f4', 3),
+                           ('diffuse', '<f4', 3),
+                           ('ambient', '<f4', 3),
+                           ('specular', '<f4', 3),
+                           ('shininess', '<f4'),
+                           ('shadow', '<u4'),
+                           ('beaming', '<u4'),
+                           ('render', '<u4'),
+                           ('transparencyhint', '<u4'),
+                           ('unknown0', '<u4'),
+                           ('textures', 'S64', 4),
+                           ('tilefade', '<u4'),
+                           array_def('vertex_indices'),
+                           array_def('left_over_faces'),
+                           array_def('vertex_indices_count'),
+                           array_def('vertex_indices_offset'),
+                           ('unknown1', '<u4', 2),
+                           ('triangle_mode', 'u1'),
+                           ('padding0', 'u1', 3),
+                           ('unknown2', '<u4'),
+                           ('verts', '<u4'),
+                           ('vert_count', '<u2'),
+                           ('texture_count', '<u2'),
+                           ('tverts', '<u4', 4),
+                           ('normals', '<u4'),
+                           ('colors', '<u4'),
+                           ('texture_anim', '<u4', 6),
+                           ('lightmapped', 'u1'),
+                           ('rotatetexture', 'u1'),
+                           ('padding1', 'u1', 2),
+                           ('normal_sum', '<f4'),
+                           ('unknown3', '<u4')])
+
+mesh_face = numpy.dtype([('normal', '<f4', 3),
+                         ('distance', '<f4'),
+                         ('material', '<u4'),
+                         ('adjacent', '<i2', 3),
+                         ('verts', '<u2', 3)])
+
+skin_header = numpy.dtype([array_def('weights'),
+                           ('weights_ptr', '<u4'),
+                           ('bone_refs_ptr', '<u4'),
+                           ('bone_map_ptr', '<u4'),
+                           ('bone_map_count', '<u4'),
+                           array_def('bone_quats'),
+                           array_def('bone_translations'),
+                           array_def('bone_constants'),
+                           ('bone_parts', '<i2', 17),
+                           ('padding', '<u2')])
+
+animmesh_header = numpy.dtype([('sampleperiod', '<f4'),
+                               array_def('animverts'),
+                               array_def('animtverts'),
+                               array_def('animnormals'),
+                               ('vertex_sets_ptr', '<u4'),
+                               ('tvert_sets_ptr', '<u4'),
+                               ('vertex_set_count', '<u4'),
+                               ('tvert_set_count', '<u4')])
+
+dangly_header = numpy.dtype([array_def('constraints'),
+                             ('displacement', '<f4'),
+                             ('tightness', '<f4'),
+                             ('period', '<f4'),
+                             ('vertex_data_ptr', '<u4')])
+
+aabb_header = numpy.dtype([('aabb_root', '<u4')])
+
+aabb_entry = numpy.dtype([('bbox_min', '<f4', 3),
+                          ('bbox_max', '<f4', 3),
+                          ('left', '<u4'),
+                          ('right', '<u4'),
+                          ('face', '<i4'),
+                          ('plane', '<u4')])
+
+# Binary walkmesh (BWM V1.0), offsets are relative to the file start
+walkmesh_magic = b'BWM V1.0'
+
+walkmesh_header = numpy.dtype([('magic', 'S8'),
+                               ('wkm_type', '<u4'),
+                               ('use1_rel', '<f4', 3),
+                               ('use2_rel', '<f4', 3),
+                               ('use1_abs', '<f4', 3),
+                               ('use2_abs', '<f4', 3),
+                               ('position', '<f4', 3),
+                               ('vert_count', '<u4'),
+                               ('verts', '<u4'),
+                               ('face_count', '<u4'),
+                               ('faces', '<u4'),
+                               ('materials', '<u4'),
+                               ('normals', '<u4'),
+                               ('distances', '<u4'),
+                               ('aabb_count', '<u4'),
+                               ('aabbs', '<u4'),
+                               ('unknown', '<u4'),
+                               ('adjacency_count', '<u4'),
+                               ('adjacency', '<u4'),
+                               ('edge_count', '<u4'),
+                               ('edges', '<u4'),
+                               ('perimeter_count', '<u4'),
+                               ('perimeters', '<u4')])
+
+walkmesh_aabb = numpy.dtype([('bbox_min', '<f4', 3),
+                             ('bbox_max', '<f4', 3),
+                             ('face', '<i4'),
+                             ('unknown', '<u4'),
+                             ('plane', '<u4'),
+                             ('left', '<u4'),
+                             ('right', '<u4')])
+
+walkmesh_edge = numpy.dtype([('edge', '<i4'),
+                             ('transition', '<i4')])
+
+
+class Flag():
+    """Content flags of a node, the headers follow in this order."""
+
+    HEADER = 0x001
+    LIGHT = 0x002
+    EMITTER = 0x004
+    CAMERA = 0x008
+    REFERENCE = 0x010
+    MESH = 0x020
+    SKIN = 0x040
+    ANIM = 0x080
+    DANGLY = 0x100
+    AABB = 0x200
+
+    # Header following the node header for every flag
+    headers = [(LIGHT, light_header),
+               (EMITTER, emitter_header),
+               (CAMERA, numpy.dtype([])),
+               (REFERENCE, reference_header),
+               (MESH, mesh_header),
+               (SKIN, skin_header),
+               (ANIM, animmesh_header),
+               (DANGLY, dangly_header),
+               (AABB, aabb_header)]
+
+
+# Combination of flags => node type
+node_types = {0x001: nvb_def.Nodetype.DUMMY,
+              0x003: nvb_def.Nodetype.LIGHT,
+              0x005: nvb_def.Nodetype.EMITTER,
+              0x009: nvb_def.Nodetype.DUMMY,  # Camera
+              0x011: nvb_def.Nodetype.REFERENCE,
+              0x021: nvb_def.Nodetype.TRIMESH,
+              0x061: nvb_def.Nodetype.SKIN,
+              0x0A1: nvb_def.Nodetype.ANIMMESH,
+              0x121: nvb_def.Nodetype.DANGLYMESH,
+              0x221: nvb_def.Nodetype.AABB}
+
+node_classes = {nvb_def.Nodetype.DUMMY: nvb_node.Dummy,
+                nvb_def.Nodetype.REFERENCE: nvb_node.Reference,
+                nvb_def.Nodetype.TRIMESH: nvb_node.Trimesh,
+                nvb_def.Nodetype.ANIMMESH: nvb_node.Animmesh,
+                nvb_def.Nodetype.DANGLYMESH: nvb_node.Danglymesh,
+                nvb_def.Nodetype.SKIN: nvb_node.Skinmesh,
+                nvb_def.Nodetype.EMITTER: nvb_node.Emitter,
+                nvb_def.Nodetype.LIGHT: nvb_node.Light,
+                nvb_def.Nodetype.AABB: nvb_node.Aabb}
+
+classifications = {0x01: nvb_def.Classification.EFFECT,
+                   0x02: nvb_def.Classification.TILE,
+                   0x04: nvb_def.Classification.CHARACTER,
+                   0x08: nvb_def.Classification.DOOR,
+                   0x10: nvb_def.Classification.ITEM,
+                   0x20: nvb_def.Classification.GUI}
+
+# Controller type => ascii name. Ids depend on the type of the node.
+controllers_common = {8: 'position', 20: 'orientation', 36: 'scale'}
+controllers_light = {76: 'color', 88: 'radius', 96: 'shadowradius',
+                     100: 'verticaldisplacement', 140: 'multiplier'}
+controllers_mesh = {100: 'selfillumcolor', 128: 'alpha'}
+controllers_emitter = {80: 'alphaend', 84: 'alphastart', 88: 'birthrate',
+                       92: 'bounce_co', 96: 'colorend', 108: 'colorstart',
+                       120: 'combinetime', 124: 'drag', 128: 'fps',
+                       132: 'frameend', 136: 'framestart', 140: 'grav',
+                       144: 'lifeexp', 148: 'mass', 152: 'bezier2',
+                       156: 'bezier3', 160: 'particlerot', 164: 'randvel',
+                       168: 'sizestart', 172: 'sizeend', 176: 'sizestart_y',
+                       180: 'sizeend_y', 184: 'spread', 188: 'threshold',
+                       192: 'velocity', 196: 'xsize', 200: 'ysize',
+                       204: 'blurlength', 208: 'lightningdelay',
+                       212: 'lightningradius', 216: 'lightningscale',
+                       228: 'detonate', 464: 'alphamid', 468: 'colormid',
+                       480: 'percentstart', 481: 'percentmid',
+                       482: 'percentend', 484: 'sizemid', 488: 'sizemid_y'}
+
+# Bezier keys store value, in and out tangent per row
+controller_bezier = 0x10
+
+# Emitter flags => ascii name
+emitter_flags = [(0x0001, 'p2p'), (0x0002, 'p2p_sel'),
+                 (0x0004, 'affectedbywind'), (0x0008, 'm_istinted'),
+                 (0x0010, 'bounce'), (0x0020, 'random'),
+                 (0x0040, 'inherit'), (0x0080, 'inheritvel'),
+                 (0x0100, 'inherit_local'), (0x0200, 'splat'),
+                 (0x0400, 'inherit_part')]
+
+
+def is_binary(data):
+    """Return True if data holds a compiled mdl file."""
+    return len(data) >= file_header.itemsize and data[:4] == b'\x00' * 4
+
+
+def is_walkmesh(data):
+    """Return True if data holds a binary walkmesh."""
+    return data[:len(walkmesh_magic)] == walkmesh_magic
+
+
+def to_str(value):
+    """Convert a fixed size, null terminated string to str."""
+    return value.split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+
+
+def to_line(label, values):
+    """Create an ascii line (list of strings) from a label and values."""
+    return [label] + [str(v) for v in values]
+
+
+def quat2axisangle(quats):
+    """Convert an array of quaternions (x, y, z, w) to axis-angles.
+
+    Converted in double precision, the angle is taken from the length of
+    the vector part, which (unlike w) keeps small angles exact. Identity
+    quaternions get the axis (0, 0, 1).
+    """
+    quats = numpy.asarray(quats, numpy.float64).reshape(-1, 4)
+    length = numpy.sqrt((quats[:, :3] ** 2).sum(axis=1))
+    axisangles = numpy.zeros((len(quats), 4), numpy.float64)
+    axisangles[:, 2] = 1.0
+    valid = length > 0.0
+    axisangles[valid, :3] = quats[valid, :3] / length[valid, numpy.newaxis]
+    axisangles[:, 3] = 2.0 * numpy.arctan2(length, quats[:, 3])
+    return axisangles.astype(numpy.float32)
+
+
+def aabb_rows(entries, order):
+    """Create the rows of an aabb tree (bbox min, bbox max, face index)."""
+    entries = entries[order]
+    tree = numpy.empty((len(entries), 7), numpy.float32)
+    tree[:, 0:3] = entries['bbox_min']
+    tree[:, 3:6] = entries['bbox_max']
+    tree[:, 6] = entries['face']
+    return tree
+
+
+def to_bytes(value):
+    """Convert a str to bytes for a fixed size string field."""
+    return str(value).encode('ascii', 'replace')
+
+
+def to_number(value, default=0.0):
+    """Convert a property value (str, bool, number) to float."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def axisangle2quat(values):
+    """Convert an array of axis-angles to quaternions (x, y, z, w)."""
+    values = numpy.asarray(values, numpy.float64).reshape(-1, 4)
+    length = numpy.sqrt((values[:, :3] ** 2).sum(axis=1))
+    valid = length > 1e-6
+    half = 0.5 * values[valid, 3]
+    quats = numpy.zeros((len(values), 4), numpy.float32)
+    quats[:, 3] = 1.0
+    quats[valid, :3] = values[valid, :3] / length[valid, numpy.newaxis] * \
+        numpy.sin(half)[:, numpy.newaxis]
+    quats[valid, 3] = numpy.cos(half)
+    return quats
+
+
+def quat_multiply(q1, q2):
+    """Multiply two quaternions (x, y, z, w)."""
+    x1, y1, z1, w1 = q1
+    x2, y2, z2, w2 = q2
+    return numpy.array([w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                        w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                        w1*z2 + x1*y2 - y1*x2 + z1*w2,
+                        w1*w2 - x1*x2 - y1*y2 - z1*z2])
+
+
+def quat_rotate(quat, vectors):
+    """Rotate an array of vectors of shape (N, 3) by a quaternion."""
+    u = numpy.asarray(quat[:3], numpy.float64)
+    t = 2.0 * numpy.cross(u, vectors)
+    return vectors + quat[3] * t + numpy.cross(u, t)
+
+
+def face_planes(verts, faces):
+    """Return normals and plane distances of an array of faces."""
+    corners = verts[faces]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0],
+                          corners[:, 2] - corners[:, 0])
+    length = numpy.sqrt((normals ** 2).sum(axis=1))
+    valid = length > 0.0
+    normals[valid] /= length[valid, numpy.newaxis]
+    distances = -(normals * corners[:, 0]).sum(axis=1)
+    return normals, distances
+
+
+def vertex_normals(verts, faces):
+    """Return area weighted normals of the vertices of a mesh."""
+    corners = verts[faces]
+    face_normals = numpy.cross(corners[:, 1] - corners[:, 0],
+                               corners[:, 2] - corners[:, 0])
+    normals = numpy.zeros((len(verts), 3), numpy.float64)
+    for i in range(3):
+        numpy.add.at(normals, faces[:, i], face_normals)
+    length = numpy.sqrt((normals ** 2).sum(axis=1))
+    valid = length > 0.0
+    normals[valid] /= length[valid, numpy.newaxis]
+    return normals
+
+
+def edge_pairs(faces):
+    """Return the matching edge in another face for every edge of a mesh.
+
+    Edges are numbered face * 3 + i, edge i runs from vertex i to vertex
+    (i + 1) % 3. Open edges are set to -1.
+    """
+    edges = numpy.stack([faces, numpy.roll(faces, -1, axis=1)], axis=2)
+    edges = numpy.sort(edges.reshape(-1, 2).astype(numpy.int64), axis=1)
+    pairs = numpy.full(len(edges), -1, numpy.int64)
+    if not len(edges):
+        return pairs
+    keys = edges[:, 0] * (edges.max() + 1) + edges[:, 1]
+    order = numpy.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    # Pair edges with identical keys, two at a time
+    run_start = numpy.r_[True, keys[1:] != keys[:-1]]
+    starts = numpy.flatnonzero(run_start)
+    run_pos = numpy.arange(len(keys)) - starts[numpy.cumsum(run_start) - 1]
+    first = numpy.flatnonzero((keys[1:] == keys[:-1]) &
+                              (run_pos[:-1] % 2 == 0))
+    pairs[order[first]] = order[first + 1]
+    pairs[order[first + 1]] = order[first]
+    return pairs
+
+
+def split_vertices(facedef, vert_count, tvert_count):
+    """Merge the vertex and uv indices of faces into a single index.
+
+    Binary meshes use the same index for vertices and uvs, vertices with
+    more than one uv are split. Returns the new faces (F, 3) and, for every
+    new vertex, the old vertex and uv index.
+    """
+    if not vert_count:
+        facedef = facedef[:0]
+    vert_idx = numpy.clip(facedef[:, 0:3], 0, max(vert_count - 1, 0))
+    vert_idx = vert_idx.astype(numpy.int64)
+    tvert_count = max(tvert_count, 1)
+    tvert_idx = numpy.clip(facedef[:, 4:7], 0, tvert_count - 1)
+    unique, inverse = numpy.unique(vert_idx * tvert_count + tvert_idx,
+                                   return_inverse=True)
+    return (inverse.reshape(-1, 3), unique // tvert_count,
+            unique % tvert_count)
+
+
+def aabb_links(faces):
+    """Return left and right child of the nodes of an aabb tree.
+
+    The tree is given by the face indices of its nodes in depth first order,
+    inner nodes have a face index of -1. Leaves have no children (-1).
+    """
+    left = numpy.full(len(faces), -1, numpy.int64)
+    right = numpy.full(len(faces), -1, numpy.int64)
+    stack = []  # Inner nodes still missing a child
+    for idx, face in enumerate(faces.tolist()):
+        if stack:
+            parent = stack[-1]
+            if left[parent] < 0:
+                left[parent] = idx
+            else:
+                right[parent] = idx
+                stack.pop()
+        if face < 0:
+            stack.append(idx)
+    return left, right
+
+
+def perimeters(faces, open_edges):
+    """Chain open edges into loops.
+
+    Returns the edges in loop order and the end (exclusive) of every loop.
+    """
+    flat_faces = faces.ravel().tolist()
+
+    def edge_end(edge):
+        return flat_faces[edge - edge % 3 + (edge % 3 + 1) % 3]
+
+    starts = dict()
+    for edge in open_edges:
+        starts.setdefault(flat_faces[edge], edge)
+    visited = set()
+    edges = []
+    loop_ends = []
+    for edge in open_edges:
+        if edge in visited:
+            continue
+        while edge is not None and edge not in visited:
+            visited.add(edge)
+            edges.append(edge)
+            edge = starts.get(edge_end(edge))
+        loop_ends.append(len(edges))
+    return edges, loop_ends
+
+
+class WalkmeshReader():
+    """Read a binary walkmesh (wok, pwk or dwk).
+
+    All arrays (verts, faces, materials, normals, distances, aabbs,
+    adjacency, edges, perimeters) are views of the data, which must stay
+    open while they are in use.
+    """
+
+    # Walkmesh type in header
+    AREA = 1  # wok
+    PLACEABLE = 0  # pwk, dwk
+
+    def __init__(self, data):
+        """Check the header and create views of all arrays."""
+        if not is_walkmesh(data):
+            raise nvb_def.MalformedMdlFile('Not a binary walkmesh')
+        self.data = data
+        self.header = self.view(walkmesh_header, 0, 1)[0]
+        header = self.header
+        self.wkm_type = int(header['wkm_type'])
+        self.position = header['position']
+        self.verts = self.view('<f4', header['verts'],
+                               header['vert_count'], 3)
+        face_count = int(header['face_count'])
+        self.faces = self.view('<u4', header['faces'], face_count, 3)
+        self.materials = self.view('<u4', header['materials'], face_count)
+        self.normals = self.view('<f4', header['normals'], face_count, 3)
+        self.distances = self.view('<f4', header['distances'], face_count)
+        self.aabbs = self.view(walkmesh_aabb, header['aabbs'],
+                               header['aabb_count'])
+        # Adjacent edge (face * 3 + edge) of every edge of walkable faces
+        self.adjacency = self.view('<i4', header['adjacency'],
+                                   header['adjacency_count'], 3)
+        self.edges = self.view(walkmesh_edge, header['edges'],
+                               header['edge_count'])
+        # End (exclusive index into edges) of every perimeter
+        self.perimeters = self.view('<u4', header['perimeters'],
+                                    header['perimeter_count'])
+
+    def view(self, dtype, offset, count, dim=0):
+        """Return a view of count items, shape (count, dim) if dim > 0."""
+        count = int(count)
+        try:
+            values = numpy.frombuffer(self.data, dtype,
+                                      count * max(dim, 1), int(offset))
+        except ValueError:
+            raise nvb_def.MalformedMdlFile('Invalid data offset')
+        if dim > 0:
+            values = values.reshape(count, dim)
+        return values
+
+    def get_aabb_tree(self):
+        """Return the aabb tree as rows in depth first order (a copy)."""
+        if not len(self.aabbs):
+            return numpy.zeros((0, 7), numpy.float32)
+        left = self.aabbs['left'].tolist()
+        right = self.aabbs['right'].tolist()
+        order = []
+        stack = [0]
+        while stack and len(order) < len(left):
+            idx = stack.pop()
+            if idx >= len(left):
+                continue
+            order.append(idx)
+            stack.append(right[idx])
+            stack.append(left[idx])
+        return aabb_rows(self.aabbs, order)
+
+    def read_mesh(self, node):
+        """Read vertices and faces into a (trimesh or aabb) node.
+
+        Vertices are stored relative to the node position.
+        """
+        node.position = tuple(self.position.tolist())
+        node.verts = self.verts - self.position
+        facedef = numpy.zeros((len(self.faces), 8), numpy.int32)
+        facedef[:, 0:3] = self.faces
+        facedef[:, 3] = 1
+        facedef[:, 4:7] = self.faces
+        facedef[:, 7] = self.materials
+        node.facedef = facedef
+
+    def read_nodes(self, nodelist, mdl_name, wkm_type):
+        """Create nodes like the ones read from an ascii walkmesh.
+
+        Area walkmeshes are read as a single aabb node. Placeable and door
+        walkmeshes become a mesh and two use points below a base dummy.
+        """
+        mdl_name = mdl_name.lower()
+        if self.wkm_type == WalkmeshReader.AREA:
+            node = nvb_node.Aabb(mdl_name + '_wok')
+            node.parent = mdl_name
+            self.read_mesh(node)
+            node.aabb_tree = self.get_aabb_tree()
+            node.nodeidx = len(nodelist)
+            nodelist.append(node)
+            return
+        base_name = mdl_name + '_' + wkm_type
+        if wkm_type == nvb_def.Walkmeshtype.DWK:
+            mesh_name = base_name + '_wg_closed'
+        else:
+            mesh_name = mdl_name + '_wg'
+        node = nvb_node.Trimesh(mesh_name)
+        node.parent = base_name
+        self.read_mesh(node)
+        node.nodeidx = len(nodelist)
+        nodelist.append(node)
+        for idx, field in enumerate(['use1_rel', 'use2_rel']):
+            node = nvb_node.Dummy(base_name + '_use0' + str(idx + 1))
+            node.parent = base_name
+            node.position = tuple(self.header[field].tolist())
+            node.nodeidx = len(nodelist)
+            nodelist.append(node)
+
+
+class MdlReader():
+    """Read header, nodes and animations of a compiled mdl file.
+
+    Data may be any bytes-like buffer (e.g. a memory mapped file).
+    """
+
+    def __init__(self, data):
+        """Check the file header and locate model and raw data."""
+        self.data = data
+        if not is_binary(data):
+            raise nvb_def.MalformedMdlFile('Not a binary mdl file')
+        header = self.read_struct(file_header, 0)
+        self.mdl_start = file_header.itemsize
+        self.raw_start = self.mdl_start + int(header['mdl_size'])
+        self.model = self.read_struct(model_header, self.mdl_start)
+
+    def read_array(self, dtype, offset, count, shape=None):
+        """Read count items of dtype starting at an absolute offset.
+
+        Returns a copy, views would keep the buffer from being closed.
+        """
+        dtype = numpy.dtype(dtype)
+        if count <= 0:
+            values = numpy.zeros(0, dtype)
+        else:
+            try:
+                values = numpy.frombuffer(self.data, dtype, count,
+                                          offset).copy()
+            except ValueError:
+                raise nvb_def.MalformedMdlFile('Invalid data offset')
+        if shape is not None:
+            values = values.reshape(shape)
+        return values
+
+    def read_struct(self, dtype, offset):
+        """Read a single struct at an absolute offset."""
+        return self.read_array(dtype, offset, 1)[0]
+
+    def mdl_array(self, dtype, array, shape=None):
+        """Read the contents of a dynamic array in the model data."""
+        return self.read_array(dtype, self.mdl_start + int(array[0]),
+                               int(array[1]), shape)
+
+    def raw_array(self, dtype, ptr, count, shape=None):
+        """Read an array from the raw data (None if the pointer is unset)."""
+        if ptr == null_ptr:
+            return None
+        return self.read_array(dtype, self.raw_start + int(ptr), count, shape)
+
+    def read_header(self, mdl):
+        """Read name, supermodel, classification and animationscale."""
+        mdl.name = to_str(self.model['name'])
+        mdl.supermodel = to_str(self.model['supermodel']).lower() or \
+            nvb_def.null
+        mdl.classification = classifications.get(
+            int(self.model['classification']),
+            nvb_def.Classification.UNKNOWN)
+        mdl.animscale = float(self.model['animscale'])
+
+    def read_node_headers(self, root_ptr):
+        """Generate (offset, node header, parent name) in file order."""
+        stack = [(int(root_ptr), '')]
+        while stack:
+            ptr, parent = stack.pop()
+            offset = self.mdl_start + ptr
+            header = self.read_struct(node_header, offset)
+            yield offset, header, parent
+            children = self.mdl_array('<u4', header['children'])
+            name = to_str(header['name'])
+            stack.extend((c, name) for c in children[::-1].tolist())
+
+    def read_sub_headers(self, offset, flags):
+        """Read the headers following a node header, by flag."""
+        offset += node_header.itemsize
+        headers = dict()
+        for flag, dtype in Flag.headers:
+            if flags & flag:
+                if dtype.itemsize:
+                    headers[flag] = self.read_struct(dtype, offset)
+                offset += dtype.itemsize
+        return headers
+
+    def read_controllers(self, header, controller_names):
+        """Generate (name, times, values) for all controllers of a node."""
+        keys = self.mdl_array(controller_key, header['controller_keys'])
+        if not len(keys):
+            return
+        data = self.mdl_array('<f4', header['controller_data'])
+        for key in keys:
+            name = controller_names.get(int(key['type']))
+            if not name:
+                continue
+            rows = int(key['rows'])
+            columns = int(key['columns'])
+            row_size = columns
+            if columns & controller_bezier:
+                columns = columns & ~controller_bezier
+                row_size = 3 * columns
+            time_index = int(key['time_index'])
+            data_index = int(key['data_index'])
+            times = data[time_index:time_index+rows]
+            values = data[data_index:data_index+rows*row_size]
+            if len(times) < rows or len(values) < rows * row_size:
+                print("Neverblender: WARNING - Invalid controller " + name)
+                continue
+            values = values.reshape(rows, row_size)[:, :columns]
+            if name == 'orientation':
+                if columns != 4:
+                    print("Neverblender: WARNING - Unsupported orientation")
+                    continue
+                values = quat2axisangle(values)
+            yield name, times, values
+
+    @staticmethod
+    def get_controller_names(flags):
+        """Return the controller names for a node type."""
+        names = dict(controllers_common)
+        if flags & Flag.LIGHT:
+            names.update(controllers_light)
+        elif flags & Flag.EMITTER:
+            names.update(controllers_emitter)
+        elif flags & Flag.MESH:
+            names.update(controllers_mesh)
+        return names
+
+    def read_geometry(self, nodelist):
+        """Read all nodes of the model geometry."""
+        part_names = dict()
+        skins = []
+        for offset, header, parent in self.read_node_headers(
+                self.model['root_node']):
+            flags = int(header['flags'])
+            node_type = node_types.get(flags)
+            if node_type is None:
+                raise nvb_def.MalformedMdlFile('Invalid node type')
+            name = to_str(header['name'])
+            node = node_classes[node_type](name.lower())
+            node.nodeidx = len(nodelist)
+            node.loadAsciiLine('node', ['node', node_type, name], '', 0)
+            node.loadAsciiLine('parent', ['parent', parent or nvb_def.null],
+                               '', 0)
+            node.loadAsciiLine('inheritcolor', to_line(
+                'inheritcolor', [header['inheritcolor']]), '', 0)
+            part_names[int(header['partnumber'])] = node.name
+            # Static controller values
+            for label, _, values in self.read_controllers(
+                    header, MdlReader.get_controller_names(flags)):
+                line = to_line(label, values[0].tolist())
+                node.loadAsciiLine(label, line, '', 0)
+            headers = self.read_sub_headers(offset, flags)
+            if Flag.LIGHT in headers:
+                self.read_light(node, headers[Flag.LIGHT])
+            if Flag.EMITTER in headers:
+                self.read_emitter(node, headers[Flag.EMITTER])
+            if Flag.REFERENCE in headers:
+                self.read_reference(node, headers[Flag.REFERENCE])
+            if Flag.MESH in headers:
+                self.read_mesh(node, headers[Flag.MESH])
+            if Flag.SKIN in headers:
+                skins.append((node, headers[Flag.SKIN]))
+            if Flag.DANGLY in headers:
+                self.read_dangly(node, headers[Flag.DANGLY])
+            if Flag.AABB in headers:
+                self.read_aabb(node, headers[Flag.AABB])
+            nodelist.append(node)
+        # Bones are referenced by part number, all nodes have to be known
+        for node, header in skins:
+            self.read_skin(node, header, part_names)
+
+    def read_light(self, node, header):
+        """Read the light header of a node."""
+        for label in ['flareradius', 'lightpriority', 'ambientonly',
+                      'ndynamictype', 'affectdynamic', 'shadow', 'lensflares',
+                      'fadinglight']:
+            node.loadAsciiLine(label, to_line(label, [header[label]]), '', 0)
+        node.flareSizes = self.mdl_array('<f4',
+                                         header['flaresizes']).tolist()
+        node.flarePositions = self.mdl_array(
+            '<f4', header['flarepositions']).tolist()
+        node.flareCShifts = [tuple(c) for c in self.mdl_array(
+            vector3, header['flarecolorshifts']).tolist()]
+        node.flareTextures = []
+        for ptr in self.mdl_array('<u4', header['flaretextures']).tolist():
+            start = self.mdl_start + ptr
+            end = self.data.find(b'\x00', start, start + 256)
+            node.flareTextures.append(
+                to_str(self.data[start:end if end >= 0 else start]))
+
+    @staticmethod
+    def read_emitter(node, header):
+        """Read the emitter header of a node."""
+        for label in ['deadspace', 'blastradius', 'blastlength', 'xgrid',
+                      'ygrid', 'spawntype', 'twosidedtex', 'loop',
+                      'renderorder']:
+            node.loadAsciiLine(label, to_line(label, [header[label]]), '', 0)
+        for label in ['update', 'render', 'blend', 'texture', 'chunkname']:
+            value = to_str(header[label]) or nvb_def.null
+            node.loadAsciiLine(label, [label, value], '', 0)
+        flags = int(header['flags'])
+        for flag, label in emitter_flags:
+            value = '1' if flags & flag else '0'
+            node.loadAsciiLine(label, [label, value], '', 0)
+
+    @staticmethod
+    def read_reference(node, header):
+        """Read the reference header of a node."""
+        node.loadAsciiLine('refmodel',
+                           ['refmodel', to_str(header['refmodel'])], '', 0)
+        node.loadAsciiLine('reattachable', to_line(
+            'reattachable', [header['reattachable']]), '', 0)
+
+    def read_mesh(self, node, header):
+        """Read the mesh header, vertices, faces and uvs of a node."""
+        for label in ['ambient', 'diffuse', 'specular']:
+            line = to_line(label, header[label].tolist())
+            node.loadAsciiLine(label, line, '', 0)
+        for label in ['shininess', 'shadow', 'beaming', 'render',
+                      'transparencyhint', 'tilefade', 'rotatetexture']:
+            node.loadAsciiLine(label, to_line(label, [header[label]]), '', 0)
+        for idx, texture in enumerate(header['textures']):
+            texture = to_str(texture)
+            if idx == 0:
+                texture = texture or nvb_def.null
+                node.loadAsciiLine('bitmap', ['bitmap', texture], '', 0)
+            elif texture:
+                label = 'texture' + str(idx)
+                node.loadAsciiLine(label, [label, texture], '', 0)
+        vert_count = int(header['vert_count'])
+        verts = self.raw_array('<f4', header['verts'], 3 * vert_count,
+                               (-1, 3))
+        if verts is not None:
+            node.verts = verts
+        # Faces: Vertex and uv indices are identical, no smoothgroups
+        faces = self.mdl_array(mesh_face, header['faces'])
+        facedef = numpy.ones((len(faces), 8), numpy.int32)
+        facedef[:, 0:3] = faces['verts']
+        facedef[:, 4:7] = faces['verts']
+        facedef[:, 7] = faces['material']
+        node.facedef = facedef
+        node.tverts = []
+        for ptr in header['tverts'][:int(header['texture_count'])]:
+            tverts = self.raw_array('<f4', ptr, 2 * vert_count, (-1, 2))
+            if tverts is not None:
+                node.tverts.append(tverts)
+        if not node.tverts:
+            node.tverts = [numpy.zeros((0, 2), numpy.float32)]
+        normals = self.raw_array('<f4', header['normals'], 3 * vert_count,
+                                 (-1, 3))
+        if normals is not None:
+            node.normals = normals
+        colors = self.raw_array('u1', header['colors'], 4 * vert_count,
+                                (-1, 4))
+        if colors is not None:
+            node.colors = colors[:, :3].astype(numpy.float32) / 255.0
+
+    def read_skin(self, node, header, part_names):
+        """Read the bone weights of a skinmesh.
+
+        The bone map assigns a bone index to every part number, vertices
+        reference up to four bones by index.
+        """
+        vert_count = len(node.verts)
+        weights = self.raw_array('<f4', header['weights_ptr'],
+                                 4 * vert_count, (-1, 4))
+        bone_refs = self.raw_array('<i2', header['bone_refs_ptr'],
+                                   4 * vert_count, (-1, 4))
+        if weights is None or bone_refs is None:
+            return
+        bone_map = self.read_array(
+            '<f4', self.mdl_start + int(header['bone_map_ptr']),
+            int(header['bone_map_count']))
+        bone_names = dict()
+        for partnumber, bone_idx in enumerate(bone_map.astype(int).tolist()):
+            if bone_idx >= 0 and partnumber in part_names:
+                bone_names[bone_idx] = part_names[partnumber]
+        valid = (bone_refs >= 0) & (weights > 0.0)
+        node.weights = [[[bone_names[b], w] for b, w, v in zip(br, wr, vr)
+                         if v and b in bone_names]
+                        for br, wr, vr in zip(bone_refs.tolist(),
+                                              weights.tolist(),
+                                              valid.tolist())]
+
+    def read_dangly(self, node, header):
+        """Read constraints, displacement, tightness and period."""
+        for label in ['displacement', 'tightness', 'period']:
+            node.loadAsciiLine(label, to_line(label, [header[label]]), '', 0)
+        node.constraints = self.mdl_array('<f4',
+                                          header['constraints']).tolist()
+
+    def read_aabb(self, node, header):
+        """Read the aabb tree of a walkmesh node."""
+        entries = []
+        stack = [int(header['aabb_root'])]
+        while stack and len(entries) < 2 * len(node.facedef):
+            ptr = stack.pop()
+            if ptr == 0 or ptr == null_ptr:
+                continue
+            entry = self.read_struct(aabb_entry, self.mdl_start + ptr)
+            entries.append(entry)
+            stack.append(int(entry['right']))
+            stack.append(int(entry['left']))
+        if entries:
+            node.aabb_tree = aabb_rows(numpy.array(entries, aabb_entry),
+                                       slice(None))
+
+    def read_animation_headers(self):
+        """Generate (offset, animation header) for all animations."""
+        for ptr in self.mdl_array('<u4', self.model['animations']).tolist():
+            offset = self.mdl_start + ptr
+            yield offset, self.read_struct(animation_header, offset)
+
+    def read_animations(self, animations, anim_filter=None, nodes=True):
+        """Read animations, optionally only those passing the filter.
+
+        Without nodes only the animation headers are read.
+        """
+        # Controller ids depend on the type of the geometry node
+        node_flags = dict()
+        if nodes:
+            for _, header, _ in self.read_node_headers(
+                    self.model['root_node']):
+                node_flags[to_str(header['name']).lower()] = \
+                    int(header['flags'])
+        for _, header in self.read_animation_headers():
+            anim = nvb_anim.Animation()
+            anim.name = nvb_utils.str2identifier(to_str(header['name']))
+            if anim_filter is not None and not anim_filter(anim.name):
+                continue
+            anim.length = float(header['length'])
+            anim.transtime = float(header['transtime'])
+            anim.animroot = to_str(header['animroot']).lower()
+            events = self.mdl_array(animation_event, header['events'])
+            anim.events = [(float(e['time']), to_str(e['name']))
+                           for e in events]
+            if nodes:
+                self.read_animation_nodes(anim, header['root_node'],
+                                          node_flags)
+            animations.append(anim)
+
+    def read_animation_nodes(self, anim, root_ptr, node_flags):
+        """Read the keys of all nodes of an animation."""
+        for offset, header, parent in self.read_node_headers(root_ptr):
+            flags = int(header['flags'])
+            name = to_str(header['name'])
+            geom_flags = node_flags.get(name.lower(), flags)
+            node = nvb_animnode.Animnode()
+            node.nodeidx = len(anim.nodes)
+            node_type = node_types.get(geom_flags, nvb_def.Nodetype.DUMMY)
+            node.load_ascii_line('node', ['node', node_type, name], '', 0)
+            node.load_ascii_line('parent', ['parent', parent or nvb_def.null],
+                                 '', 0)
+            for key_name, times, values in self.read_controllers(
+                    header, MdlReader.get_controller_names(geom_flags)):
+                key_def = node.get_key_def(key_name)
+                if not key_def:
+                    continue
+                key_data, data_path, data_dim = key_def
+                keys = numpy.zeros((len(times), data_dim+1), numpy.float32)
+                keys[:, 0] = times
+                dim = min(data_dim, values.shape[1])
+                keys[:, 1:dim+1] = values[:, :dim]
+                key_data[key_name] = [keys, data_path, data_dim]
+            if flags & Flag.ANIM:
+                anim_header = self.read_sub_headers(offset, flags)[Flag.ANIM]
+                node.sampleperiod = float(anim_header['sampleperiod'])
+                animverts = self.mdl_array(vector3, anim_header['animverts'])
+                if len(animverts):
+                    node.animverts = animverts
+                    node.shapedata = True
+                animtverts = self.mdl_array(vector3,
+                                            anim_header['animtverts'])
+                if len(animtverts):
+                    node.animtverts = animtverts[:, :2].copy()
+                    node.uvdata = True
+            anim.nodes.append(node)
+
+
+class MdlWriter():
+    """Compile a model into a binary mdl file.
+
+    Takes the nodes and animations of a Mdl, as read from an ascii or binary
+    file. Model data (headers, faces, keys) and raw data (vertex data) are
+    collected in separate buffers, pointers are relative to their start.
+    """
+
+    # Node type => content flags
+    node_flags = {nvb_def.Nodetype.DUMMY: 0x001,
+                  nvb_def.Nodetype.PATCH: 0x001,
+                  nvb_def.Nodetype.LIGHT: 0x003,
+                  nvb_def.Nodetype.EMITTER: 0x005,
+                  nvb_def.Nodetype.REFERENCE: 0x011,
+                  nvb_def.Nodetype.TRIMESH: 0x021,
+                  nvb_def.Nodetype.SKIN: 0x061,
+                  nvb_def.Nodetype.ANIMMESH: 0x0A1,
+                  nvb_def.Nodetype.DANGLYMESH: 0x121,
+                  nvb_def.Nodetype.AABB: 0x221}
+
+    # Geometry types of model and animation headers
+    MODEL = 2
+    ANIMATION = 5
+
+    # Controller index and size fields are 16 bit
+    max_controller_data = 0x7FFF
+
+    def __init__(self):
+        """Start with empty buffers."""
+        self.mdl_data = bytearray()
+        self.raw_data = bytearray()
+        self.part_numbers = dict()  # Node name => part number
+        self.geom_flags = dict()  # Node name => flags of geometry node
+        self.transforms = dict()  # Node name => world rotation, position
+        # Mesh name => vertex map, uv map, vertex count, uv count
+        self.vertex_maps = dict()
+
+    @staticmethod
+    def append(buffer, values):
+        """Append an array to a buffer (4 byte aligned), return its offset."""
+        offset = len(buffer)
+        buffer += numpy.ascontiguousarray(values).tobytes()
+        buffer += bytes(-len(buffer) % 4)
+        return offset
+
+    def put(self, offset, values):
+        """Overwrite reserved space in the model data."""
+        data = values.tobytes()
+        self.mdl_data[offset:offset+len(data)] = data
+
+    def mdl_array(self, values, dtype=None):
+        """Write an array into the model data, return its definition."""
+        values = numpy.asarray(values, dtype)
+        if not len(values):
+            return (0, 0, 0)
+        ptr = MdlWriter.append(self.mdl_data, values)
+        return (ptr, len(values), len(values))
+
+    def raw_array(self, values, dtype):
+        """Write an array into the raw data, return its pointer."""
+        if values is None or not len(values):
+            return null_ptr
+        return MdlWriter.append(self.raw_data, numpy.asarray(values, dtype))
+
+    @staticmethod
+    def get_tree(nodes):
+        """Return the root node and the children of every node (by name).
+
+        Additional root nodes are attached to the first one.
+        """
+        names = {n.name.lower() for n in nodes}
+        children = collections.defaultdict(list)
+        roots = []
+        for node in nodes:
+            parent = node.parent.lower()
+            if parent in names and parent != node.name.lower():
+                children[parent].append(node)
+            else:
+                roots.append(node)
+        if not roots:
+            return None, children
+        children[roots[0].name.lower()].extend(roots[1:])
+        return roots[0], children
+
+    @staticmethod
+    def walk(root, children):
+        """Generate all nodes of a tree in depth first order."""
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(children[node.name.lower()]))
+
+    def get_transforms(self, root, children):
+        """Compute world rotation and position of all nodes."""
+        stack = [(root, numpy.array([0.0, 0.0, 0.0, 1.0]), numpy.zeros(3))]
+        while stack:
+            node, rot, pos = stack.pop()
+            position = numpy.asarray(node.position, numpy.float64)
+            world_pos = pos + quat_rotate(rot, position[numpy.newaxis])[0]
+            world_rot = quat_multiply(rot, axisangle2quat(node.orientation)[0])
+            self.transforms[node.name.lower()] = (world_rot, world_pos)
+            stack.extend((c, world_rot, world_pos)
+                         for c in children[node.name.lower()])
+
+    def get_bounds(self, nodes):
+        """Return bounding box and radius of all meshes of a model."""
+        world_verts = [numpy.zeros((1, 3))]
+        for node in nodes:
+            if isinstance(node, nvb_node.Trimesh) and len(node.verts):
+                rot, pos = self.transforms[node.name.lower()]
+                world_verts.append(quat_rotate(rot, node.verts) + pos)
+        world_verts = numpy.concatenate(world_verts)
+        bbox_min = world_verts.min(axis=0)
+        bbox_max = world_verts.max(axis=0)
+        radius = numpy.sqrt(((bbox_max - bbox_min) ** 2).sum()) / 2.0
+        return bbox_min, bbox_max, radius
+
+    def write_tree(self, node, children, parent_ptr, write_node):
+        """Write a node and all its children, return the node pointer."""
+        offset, header, headers = write_node(node, parent_ptr)
+        ptrs = [self.write_tree(c, children, offset, write_node)
+                for c in children[node.name.lower()]]
+        header['children'] = self.mdl_array(ptrs, '<u4')
+        self.put(offset, header)
+        sub_offset = offset + node_header.itemsize
+        for flag, dtype in Flag.headers:
+            if flag in headers:
+                self.put(sub_offset, headers[flag])
+                sub_offset += dtype.itemsize
+        return offset
+
+    def begin_node(self, name, flags, parent_ptr, geometry_ptr):
+        """Reserve space for a node header and its sub headers.
+
+        Returns the offset, the node header and the sub headers by flag.
+        """
+        header = numpy.zeros(1, node_header)
+        header['name'] = to_bytes(name)
+        header['partnumber'] = self.part_numbers.get(name.lower(), -1)
+        header['geometry_ptr'] = geometry_ptr
+        header['parent_ptr'] = parent_ptr
+        header['flags'] = flags
+        headers = {flag: numpy.zeros(1, dtype) for flag, dtype in Flag.headers
+                   if flags & flag}
+        size = node_header.itemsize + sum(h.nbytes for h in headers.values())
+        offset = MdlWriter.append(self.mdl_data, numpy.zeros(size, 'u1'))
+        return offset, header, headers
+
+    def write_controllers(self, header, controllers):
+        """Write the controllers of a node, given as (type, times, values)."""
+        keys = []
+        data = []
+        size = 0
+        for ctype, times, values in controllers:
+            times = numpy.asarray(times, numpy.float32).ravel()
+            values = numpy.asarray(values, numpy.float32).reshape(
+                len(times), -1)
+            columns = values.shape[1]
+            if size + len(times) * (columns + 1) > \
+                    MdlWriter.max_controller_data:
+                print("Neverblender: WARNING - Too many keys in " +
+                      to_str(header['name'][0]))
+                continue
+            keys.append((ctype, len(times), size, size + len(times),
+                         columns, 0))
+            data.extend([times, values.ravel()])
+            size += len(times) * (columns + 1)
+        if keys:
+            header['controller_keys'] = self.mdl_array(keys, controller_key)
+            header['controller_data'] = self.mdl_array(numpy.concatenate(data),
+                                                       '<f4')
+
+    @staticmethod
+    def get_controller_ids(flags):
+        """Return the controller ids for a node type by name."""
+        return {name: ctype for ctype, name in
+                MdlReader.get_controller_names(flags).items()}
+
+    @staticmethod
+    def get_emitter_values(node):
+        """Return the properties of an emitter by ascii name."""
+        data = dict(node.blender_data)
+        values = {label: data[prop[0]] for label, prop in
+                  nvb_node.Emitter.property_dict.items() if prop[0] in data}
+        values['xsize'] = node.xsize
+        values['ysize'] = node.ysize
+        return values
+
+    def write_geometry_node(self, node, parent_ptr):
+        """Write header, sub headers and data of a geometry node."""
+        flags = MdlWriter.node_flags.get(node.nodetype, Flag.HEADER)
+        offset, header, headers = self.begin_node(node.name, flags,
+                                                  parent_ptr, 0)
+        # Static values are stored as controllers with a single key
+        values = [('position', node.position),
+                  ('orientation', axisangle2quat(node.orientation))]
+        if node.scale != 1.0:
+            values.append(('scale', node.scale))
+        if isinstance(node, nvb_node.Light):
+            values.extend([('color', node.color), ('radius', node.radius),
+                           ('multiplier', node.multiplier)])
+        elif isinstance(node, nvb_node.Trimesh):
+            values.extend([('selfillumcolor', node.selfillumcolor),
+                           ('alpha', node.material.alpha)])
+            header['inheritcolor'] = node.inheritcolor
+        elif isinstance(node, nvb_node.Emitter):
+            emitter_values = MdlWriter.get_emitter_values(node)
+            for label in controllers_emitter.values():
+                if label in emitter_values:
+                    value = emitter_values[label]
+                    if not isinstance(value, tuple):
+                        value = to_number(value)
+                    values.append((label, value))
+        ids = MdlWriter.get_controller_ids(flags)
+        self.write_controllers(header, [(ids[label], [0.0], value)
+                                        for label, value in values
+                                        if label in ids])
+        if Flag.LIGHT in headers:
+            self.write_light(node, headers[Flag.LIGHT])
+        if Flag.EMITTER in headers:
+            self.write_emitter(node, headers[Flag.EMITTER])
+        if Flag.REFERENCE in headers:
+            header_ref = headers[Flag.REFERENCE]
+            header_ref['refmodel'] = to_bytes(node.refmodel)
+            header_ref['reattachable'] = node.reattachable
+        if Flag.MESH in headers:
+            verts, vert_map = self.write_mesh(node, headers[Flag.MESH])
+            if Flag.SKIN in headers:
+                self.write_skin(node, headers[Flag.SKIN], vert_map)
+            if Flag.DANGLY in headers:
+                self.write_dangly(node, headers[Flag.DANGLY], verts,
+                                  vert_map)
+            if Flag.AABB in headers:
+                self.write_aabb(node, headers[Flag.AABB])
+        return offset, header, headers
+
+    def write_light(self, node, header):
+        """Fill the light header and write the lens flares."""
+        header['flareradius'] = node.flareradius
+        header['flaresizes'] = self.mdl_array(node.flareSizes, '<f4')
+        header['flarepositions'] = self.mdl_array(node.flarePositions, '<f4')
+        header['flarecolorshifts'] = self.mdl_array(
+            numpy.array(node.flareCShifts, numpy.float32).reshape(-1, 3))
+        texture_ptrs = [MdlWriter.append(self.mdl_data, numpy.frombuffer(
+                        to_bytes(t) + b'\x00', 'u1'))
+                        for t in node.flareTextures]
+        header['flaretextures'] = self.mdl_array(texture_ptrs, '<u4')
+        if node.ndynamictype >= 0:
+            header['ndynamictype'] = node.ndynamictype
+        else:
+            header['ndynamictype'] = node.isdynamic
+        for label in ['lightpriority', 'ambientonly', 'affectdynamic',
+                      'shadow', 'lensflares', 'fadinglight']:
+            header[label] = int(getattr(node, label))
+
+    @staticmethod
+    def write_emitter(node, header):
+        """Fill the emitter header."""
+        values = MdlWriter.get_emitter_values(node)
+        for label in ['deadspace', 'blastradius', 'blastlength']:
+            header[label] = to_number(values.get(label, 0.0))
+        for label in ['xgrid', 'ygrid', 'spawntype', 'twosidedtex', 'loop',
+                      'renderorder']:
+            header[label] = int(to_number(values.get(label, 0)))
+        for label in ['update', 'render', 'blend', 'texture', 'chunkname']:
+            value = values.get(label, nvb_def.null)
+            if value != nvb_def.null:
+                header[label] = to_bytes(value)
+        flags = 0
+        for flag, label in emitter_flags:
+            if to_number(values.get(label, 0)):
+                flags |= flag
+        header['flags'] = flags
+
+    def write_mesh(self, node, header):
+        """Fill the mesh header, write faces and vertex data.
+
+        Returns the vertices as written and the index of the original vertex
+        of each of them.
+        """
+        material = node.material
+        header['ambient'] = material.ambient
+        header['diffuse'] = material.diffuse
+        header['specular'] = material.specular
+        header['shininess'] = node.shininess
+        for label in ['shadow', 'beaming', 'render', 'transparencyhint',
+                      'tilefade', 'rotatetexture']:
+            header[label] = int(getattr(node, label))
+        for idx, texture in enumerate(material.textures[:4]):
+            if texture != nvb_def.null:
+                header['textures'][0, idx] = to_bytes(texture)
+        # Vertices with more than one uv are split
+        uvs = node.tverts[0] if node.tverts else []
+        faces, vert_map, tvert_map = split_vertices(
+            node.facedef, len(node.verts), len(uvs))
+        if len(vert_map) > 0xFFFF:
+            raise nvb_def.MalformedMdlFile('Too many vertices in ' +
+                                           node.name)
+        self.vertex_maps[node.name.lower()] = (vert_map, tvert_map,
+                                               len(node.verts), len(uvs))
+        orig_verts = numpy.asarray(node.verts, numpy.float64)
+        verts = orig_verts[vert_map]
+        # Faces, adjacency is found by original vertex (ignores uv seams)
+        orig_faces = vert_map[faces]
+        normals, distances = face_planes(verts, faces)
+        adjacent = edge_pairs(orig_faces)
+        adjacent = numpy.where(adjacent >= 0, adjacent // 3, -1)
+        face_data = numpy.zeros(len(faces), mesh_face)
+        face_data['normal'] = normals
+        face_data['distance'] = distances
+        face_data['material'] = numpy.maximum(node.facedef[:len(faces), 7], 0)
+        face_data['adjacent'] = adjacent.reshape(-1, 3)
+        face_data['verts'] = faces
+        header['faces'] = self.mdl_array(face_data)
+        if len(verts):
+            average = verts.mean(axis=0)
+            header['bbox_min'] = verts.min(axis=0)
+            header['bbox_max'] = verts.max(axis=0)
+            header['average'] = average
+            header['radius'] = numpy.sqrt(
+                ((verts - average) ** 2).sum(axis=1)).max()
+        # Vertex data
+        header['verts'] = self.raw_array(verts, '<f4')
+        header['vert_count'] = len(verts)
+        header['tverts'] = null_ptr
+        layers = [t for t in node.tverts[:4] if len(t)]
+        for idx, layer in enumerate(layers):
+            header['tverts'][0, idx] = self.raw_array(
+                layer[numpy.minimum(tvert_map, len(layer) - 1)], '<f4')
+        header['texture_count'] = len(layers)
+        if len(node.normals) == len(orig_verts):
+            vert_normals = node.normals[vert_map]
+        else:
+            vert_normals = vertex_normals(orig_verts, orig_faces)[vert_map]
+        header['normals'] = self.raw_array(vert_normals, '<f4')
+        header['colors'] = null_ptr
+        if len(node.colors) == len(orig_verts) and len(verts):
+            colors = numpy.full((len(verts), 4), 255, numpy.uint8)
+            colors[:, :3] = numpy.clip(
+                numpy.round(node.colors[vert_map] * 255.0), 0, 255)
+            header['colors'] = self.raw_array(colors, 'u1')
+        # Faces as a single triangle list
+        if len(faces):
+            ptr = self.raw_array(faces.ravel(), '<u2')
+            header['vertex_indices_count'] = self.mdl_array([faces.size],
+                                                            '<u4')
+            header['vertex_indices_offset'] = self.mdl_array([ptr], '<u4')
+        return verts, vert_map
+
+    def write_skin(self, node, header, vert_map):
+        """Write bone weights, bone map and bind pose of a skinmesh."""
+        vert_count = len(node.verts)
+        weights = numpy.zeros((vert_count, 4), numpy.float32)
+        bone_refs = numpy.full((vert_count, 4), -1, numpy.int16)
+        bones = collections.OrderedDict()  # Bone name => bone index
+        for vert_idx, vert_weights in enumerate(node.weights[:vert_count]):
+            col = 0
+            for bone_name, weight in vert_weights:
+                bone_name = bone_name.lower()
+                if bone_name not in self.part_numbers or col >= 4:
+                    continue
+                bone_idx = bones.setdefault(bone_name, len(bones))
+                weights[vert_idx, col] = weight
+                bone_refs[vert_idx, col] = bone_idx
+                col += 1
+        header['weights_ptr'] = self.raw_array(weights[vert_map], '<f4')
+        header['bone_refs_ptr'] = self.raw_array(bone_refs[vert_map], '<i2')
+        bone_map = numpy.full(len(self.part_numbers), -1, numpy.float32)
+        for bone_name, bone_idx in bones.items():
+            bone_map[self.part_numbers[bone_name]] = bone_idx
+        header['bone_map_ptr'] = self.mdl_array(bone_map, '<f4')[0]
+        header['bone_map_count'] = len(bone_map)
+        # Bind pose: Transformation from the skin into bone space
+        skin_rot, skin_pos = self.transforms[node.name.lower()]
+        quats = []
+        translations = []
+        for bone_name in bones:
+            bone_rot, bone_pos = self.transforms[bone_name]
+            inverse = bone_rot * [-1.0, -1.0, -1.0, 1.0]
+            quats.append(quat_multiply(inverse, skin_rot))
+            translations.append(quat_rotate(
+                inverse, (skin_pos - bone_pos)[numpy.newaxis])[0])
+        header['bone_quats'] = self.mdl_array(
+            numpy.reshape(quats, (-1, 4)), '<f4')
+        header['bone_translations'] = self.mdl_array(
+            numpy.reshape(translations, (-1, 3)), '<f4')
+        bone_parts = [self.part_numbers[b] for b in bones][:17]
+        header['bone_parts'] = bone_parts + [-1] * (17 - len(bone_parts))
+
+    def write_dangly(self, node, header, verts, vert_map):
+        """Write the constraints and settings of a danglymesh."""
+        constraints = numpy.zeros(len(vert_map), numpy.float32)
+        if len(node.constraints) == len(node.verts):
+            constraints = numpy.asarray(node.constraints,
+                                        numpy.float32)[vert_map]
+        header['constraints'] = self.mdl_array(constraints, '<f4')
+        header['displacement'] = node.displacement
+        header['tightness'] = node.tightness
+        header['period'] = node.period
+        header['vertex_data_ptr'] = self.raw_array(verts, '<f4')
+
+    def write_aabb(self, node, header):
+        """Write the aabb tree of a walkmesh node."""
+        tree = node.aabb_tree
+        if not len(tree):
+            print("Neverblender: WARNING - No aabb tree for " + node.name)
+            return
+        faces = tree[:, 6].astype(numpy.int32)
+        left, right = aabb_links(faces)
+        # Entries are written in order, children are linked by pointer
+        ptrs = len(self.mdl_data) + \
+            aabb_entry.itemsize * numpy.arange(len(tree))
+        entries = numpy.zeros(len(tree), aabb_entry)
+        entries['bbox_min'] = tree[:, 0:3]
+        entries['bbox_max'] = tree[:, 3:6]
+        entries['left'] = numpy.where(left >= 0, ptrs[left], 0)
+        entries['right'] = numpy.where(right >= 0, ptrs[right], 0)
+        entries['face'] = faces
+        header['aabb_root'] = MdlWriter.append(self.mdl_data, entries)
+
+    def write_animation(self, anim):
+        """Write an animation, return its pointer."""
+        header = numpy.zeros(1, animation_header)
+        offset = MdlWriter.append(self.mdl_data, header)
+        header['name'] = to_bytes(anim.name)
+        header['geometry_type'] = MdlWriter.ANIMATION
+        header['length'] = anim.length
+        header['transtime'] = anim.transtime
+        header['animroot'] = to_bytes(anim.animroot)
+        events = numpy.zeros(len(anim.events), animation_event)
+        for idx, (event_time, event_name) in enumerate(anim.events):
+            events[idx] = (event_time, to_bytes(event_name))
+        header['events'] = self.mdl_array(events)
+        root, children = MdlWriter.get_tree(anim.nodes)
+        if root is not None:
+            header['root_node'] = self.write_tree(
+                root, children, 0,
+                lambda node, ptr: self.write_anim_node(node, ptr, offset))
+            header['node_count'] = len(anim.nodes)
+        self.put(offset, header)
+        return offset
+
+    def write_anim_node(self, node, parent_ptr, geometry_ptr):
+        """Write header and keys of an animation node."""
+        name = node.name.lower()
+        flags = Flag.HEADER
+        if len(node.animverts) or len(node.animtverts):
+            flags |= Flag.ANIM
+        offset, header, headers = self.begin_node(node.name, flags,
+                                                  parent_ptr, geometry_ptr)
+        ids = MdlWriter.get_controller_ids(
+            self.geom_flags.get(name, Flag.HEADER))
+        controllers = []
+        for key_data in [node.object_data, node.material_data,
+                         node.emitter_data]:
+            for key_name, (keys, _, data_dim) in key_data.items():
+                if key_name == 'setfillumcolor':
+                    key_name = 'selfillumcolor'
+                if key_name not in ids or not len(keys):
+                    continue
+                values = keys[:, 1:data_dim+1]
+                if key_name == 'orientation':
+                    values = axisangle2quat(values)
+                controllers.append((ids[key_name], keys[:, 0], values))
+        self.write_controllers(header, controllers)
+        if Flag.ANIM in headers:
+            self.write_animmesh(node, headers[Flag.ANIM])
+        return offset, header, headers
+
+    def write_animmesh(self, node, header):
+        """Write the vertex and uv animations of an animmesh node.
+
+        The sets are remapped to the vertices of the geometry node, as
+        vertices with more than one uv have been split.
+        """
+        header['sampleperiod'] = node.sampleperiod
+        vert_map, tvert_map, vert_count, tvert_count = \
+            self.vertex_maps.get(node.name.lower(), (None, None, 0, 0))
+        animverts = node.animverts
+        if vert_count and len(animverts) % vert_count == 0:
+            sets = len(animverts) // vert_count
+            animverts = animverts.reshape(sets, vert_count, 3)[:, vert_map]
+            header['vertex_set_count'] = sets
+        header['animverts'] = self.mdl_array(animverts.reshape(-1, 3), '<f4')
+        animtverts = node.animtverts
+        if tvert_count and len(animtverts) % tvert_count == 0:
+            sets = len(animtverts) // tvert_count
+            animtverts = animtverts.reshape(sets, tvert_count, 2)[:, tvert_map]
+            header['tvert_set_count'] = sets
+        animtverts = animtverts.reshape(-1, 2)
+        uvw = numpy.zeros((len(animtverts), 3), numpy.float32)
+        uvw[:, :2] = animtverts
+        header['animtverts'] = self.mdl_array(uvw)
+
+    def write(self, mdl):
+        """Compile a model, return the contents of the binary file."""
+        model = numpy.zeros(1, model_header)
+        MdlWriter.append(self.mdl_data, model)
+        root, children = MdlWriter.get_tree(mdl.mdlnodes)
+        if root is None:
+            raise nvb_def.MalformedMdlFile('Unable to find geometry')
+        for partnumber, node in enumerate(MdlWriter.walk(root, children)):
+            name = node.name.lower()
+            self.part_numbers[name] = partnumber
+            self.geom_flags[name] = MdlWriter.node_flags.get(node.nodetype,
+                                                             Flag.HEADER)
+        self.get_transforms(root, children)
+        model['name'] = to_bytes(mdl.name)
+        model['geometry_type'] = MdlWriter.MODEL
+        model['classification'] = {v: k for k, v in classifications.items()
+                                   }.get(mdl.classification, 0)
+        model['fogged'] = 1
+        model['animscale'] = mdl.animscale
+        if mdl.supermodel != nvb_def.null:
+            model['supermodel'] = to_bytes(mdl.supermodel)
+        else:
+            model['supermodel'] = b'NULL'
+        bbox_min, bbox_max, radius = self.get_bounds(mdl.mdlnodes)
+        model['bbox_min'] = bbox_min
+        model['bbox_max'] = bbox_max
+        model['radius'] = radius
+        model['root_node'] = self.write_tree(root, children, 0,
+                                             self.write_geometry_node)
+        model['node_count'] = len(self.part_numbers)
+        anim_ptrs = [self.write_animation(anim) for anim in mdl.animations]
+        model['animations'] = self.mdl_array(anim_ptrs, '<u4')
+        self.put(0, model)
+        header = numpy.zeros(1, file_header)
+        header['mdl_size'] = len(self.mdl_data)
+        header['raw_size'] = len(self.raw_data)
+        return header.tobytes() + bytes(self.mdl_data) + bytes(self.raw_data)
+
+
+class WalkmeshWriter():
+    """Compile walkmesh nodes into a binary walkmesh (wok, pwk or dwk).
+
+    Takes the nodes as read from an ascii or binary walkmesh. Area
+    walkmeshes need an aabb node, placeable and door walkmeshes a mesh and
+    up to two use points.
+    """
+
+    # Surface materials (walkmesh face materials) which can't be walked on
+    nonwalkable = [0, 2, 7, 8, 15, 16, 17]
+
+    @staticmethod
+    def get_mesh(nodes, wkm_type):
+        """Return the node holding the walkmesh."""
+        if wkm_type == nvb_def.Walkmeshtype.WOK:
+            meshes = [n for n in nodes if isinstance(n, nvb_node.Aabb)]
+        else:
+            meshes = [n for n in nodes if isinstance(n, nvb_node.Trimesh)]
+            # Doors may have more than one state, use the closed one
+            meshes.sort(key=lambda n: not n.name.lower().endswith('closed'))
+        if not meshes:
+            raise nvb_def.MalformedMdlFile('Unable to find walkmesh data')
+        return meshes[0]
+
+    @staticmethod
+    def write_aabbs(tree):
+        """Create the aabb tree, children are linked by index."""
+        faces = tree[:, 6].astype(numpy.int32)
+        left, right = aabb_links(faces)
+        aabbs = numpy.zeros(len(tree), walkmesh_aabb)
+        aabbs['bbox_min'] = tree[:, 0:3]
+        aabbs['bbox_max'] = tree[:, 3:6]
+        aabbs['face'] = faces
+        aabbs['left'] = numpy.where(left >= 0, left, null_ptr)
+        aabbs['right'] = numpy.where(right >= 0, right, null_ptr)
+        return aabbs
+
+    def write(self, nodes, wkm_type):
+        """Compile walkmesh nodes, return the contents of the binary file."""
+        mesh = WalkmeshWriter.get_mesh(nodes, wkm_type)
+        header = numpy.zeros(1, walkmesh_header)
+        header['magic'] = walkmesh_magic
+        for node in nodes:
+            for idx, suffix in enumerate(['use01', 'use02']):
+                if isinstance(node, nvb_node.Dummy) and \
+                        node.name.lower().endswith(suffix):
+                    header['use' + str(idx + 1) + '_rel'] = node.position
+                    header['use' + str(idx + 1) + '_abs'] = node.position
+        position = numpy.asarray(mesh.position, numpy.float64)
+        header['position'] = position
+        verts = numpy.asarray(mesh.verts, numpy.float64) + position
+        faces = mesh.facedef[:, 0:3] if len(verts) else mesh.facedef[:0, 0:3]
+        faces = numpy.clip(faces, 0, max(len(verts) - 1, 0))
+        materials = numpy.maximum(mesh.facedef[:len(faces), 7], 0)
+        normals, distances = face_planes(verts, faces)
+        data = bytearray(header.nbytes)
+        header['vert_count'] = len(verts)
+        header['verts'] = MdlWriter.append(data, verts.astype('<f4'))
+        header['face_count'] = len(faces)
+        header['faces'] = MdlWriter.append(data, faces.astype('<u4'))
+        header['materials'] = MdlWriter.append(data, materials.astype('<u4'))
+        header['normals'] = MdlWriter.append(data, normals.astype('<f4'))
+        header['distances'] = MdlWriter.append(data, distances.astype('<f4'))
+        if wkm_type == nvb_def.Walkmeshtype.WOK:
+            header['wkm_type'] = WalkmeshReader.AREA
+            aabbs = WalkmeshWriter.write_aabbs(mesh.aabb_tree)
+            header['aabb_count'] = len(aabbs)
+            header['aabbs'] = MdlWriter.append(data, aabbs)
+            # Adjacent edges and perimeters of walkable faces
+            walkable = ~numpy.isin(materials, WalkmeshWriter.nonwalkable)
+            edge_walkable = numpy.repeat(walkable, 3)
+            pairs = edge_pairs(faces)
+            valid = edge_walkable & (pairs >= 0)
+            valid[valid] = edge_walkable[pairs[valid]]
+            adjacency = numpy.where(valid, pairs, -1)
+            header['adjacency_count'] = len(faces)
+            header['adjacency'] = MdlWriter.append(
+                data, adjacency.astype('<i4'))
+            open_edges = numpy.flatnonzero(edge_walkable & ~valid)
+            edges, loop_ends = perimeters(faces, open_edges.tolist())
+            edge_data = numpy.zeros(len(edges), walkmesh_edge)
+            edge_data['edge'] = edges
+            edge_data['transition'] = -1
+            header['edge_count'] = len(edge_data)
+            header['edges'] = MdlWriter.append(data, edge_data)
+            header['perimeter_count'] = len(loop_ends)
+            header['perimeters'] = MdlWriter.append(
+                data, numpy.asarray(loop_ends, '<u4'))
+        else:
+            header['wkm_type'] = WalkmeshReader.PLACEABLE
+        data[:header.nbytes] = header.tobytes()
+        return bytes(data)
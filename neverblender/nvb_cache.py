@@ -0,0 +1,287 @@
+"""On-disk cache of read mdl and walkmesh files."""
+
+import os
+import sys
+import json
+import stat
+import hashlib
+import zipfile
+import tempfile
+import collections
+
+import numpy
+
+from . import nvb_mdl
+from . import nvb_anim
+from . import nvb_node
+from . import nvb_parse
+from . import nvb_animnode
+
+# Classes which may be stored in (and rebuilt from) a cache entry
+classes = {cls.__name__: cls for cls in
+           [nvb_mdl.Mdl, nvb_mdl.NodeSpan, nvb_anim.Animation,
+            nvb_animnode.Animnode, nvb_node.Material] +
+           list(nvb_mdl.Mdl.nodelookup.values())}
+
+
+def get_user_directory(name):
+    """Return the path of a per-user directory for data of the addon."""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', '')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', '') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+    if not os.path.isabs(base):  # No usable home directory
+        return os.path.join(tempfile.gettempdir(),
+                            'neverblender-' + get_user_id() + '-' + name)
+    return os.path.join(base, 'neverblender', name)
+
+
+def default_directory():
+    """Return the default, per-user location of the cache."""
+    return get_user_directory('cache')
+
+
+def get_user_id():
+    """Return a string identifying the current user."""
+    try:
+        return str(os.getuid())
+    except AttributeError:  # Windows
+        return os.environ.get('USERNAME', 'user')
+
+
+def make_private_directory(directory):
+    """Create a directory only accessible by the current user (mode 0700).
+
+    Raises OSError if an existing directory is not owned by the user or
+    accessible by others.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        return  # Permissions can't be checked on Windows
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise OSError('Directory not owned by the user: ' + directory)
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+class Encoder():
+    """Convert read models to json and a few plain numpy arrays.
+
+    Objects are stored as class name and attributes and only classes of
+    the addon are rebuilt, so a cache entry can't run any code on load.
+    Arrays of the same type are concatenated into a single buffer.
+    """
+
+    def __init__(self):
+        """TODO: DOC."""
+        self.buffers = collections.OrderedDict()  # dtype: [arrays, size]
+
+    def encode_array(self, value):
+        """Add an array to the buffer of its type, return its location."""
+        if value.dtype.hasobject:
+            raise TypeError('Unable to store object arrays')
+        if value.size == 0 and value.ndim == 2:  # Keep sharing these
+            return {'empty': [value.shape[1], value.dtype.str]}
+        if value.dtype.str not in self.buffers:
+            self.buffers[value.dtype.str] = [[], 0]
+        buffer = self.buffers[value.dtype.str]
+        buffer[0].append(value.ravel())
+        buffer[1] += value.size
+        return {'array': [value.dtype.str, buffer[1] - value.size,
+                          list(value.shape)]}
+
+    def encode(self, value):
+        """Return a json compatible representation of value."""
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        elif isinstance(value, numpy.ndarray):
+            return self.encode_array(value)
+        elif isinstance(value, numpy.generic):
+            return value.item()
+        elif isinstance(value, list):
+            return [self.encode(v) for v in value]
+        elif isinstance(value, tuple) and \
+                classes.get(type(value).__name__) is type(value):
+            return {'class': type(value).__name__,
+                    'values': [self.encode(v) for v in value]}
+        elif isinstance(value, tuple):
+            return {'tuple': [self.encode(v) for v in value]}
+        elif isinstance(value, (set, frozenset)):
+            return {'frozenset': [self.encode(v) for v in value]}
+        elif isinstance(value, dict):
+            return {'dict': [[self.encode(k), self.encode(v)]
+                             for k, v in value.items()]}
+        elif classes.get(type(value).__name__) is type(value):
+            if '__getstate__' in vars(type(value)):
+                state = value.__getstate__()
+            else:
+                state = dict(getattr(value, '__dict__', ()))
+                for cls in type(value).__mro__:
+                    for slot in getattr(cls, '__slots__', ()):
+                        if hasattr(value, slot):
+                            state[slot] = getattr(value, slot)
+            return {'class': type(value).__name__,
+                    'state': [[k, self.encode(v)] for k, v in state.items()]}
+        raise TypeError('Unable to store ' + type(value).__name__)
+
+    def get_arrays(self):
+        """Return the buffers as dict of arrays for numpy.savez."""
+        arrays = dict()
+        for idx, (values, _) in enumerate(self.buffers.values()):
+            arrays['b' + str(idx)] = numpy.concatenate(values)
+        return arrays
+
+
+class Decoder():
+    """Rebuild data written by the Encoder from json and buffers.
+
+    Used as object_hook, so objects are rebuilt while the json is parsed.
+    """
+
+    def __init__(self, buffers):
+        """TODO: DOC."""
+        self.buffers = {b.dtype.str: b for b in buffers}
+
+    def __call__(self, value):
+        """Return the data represented by a json object."""
+        if 'array' in value:
+            dtype, start, shape = value['array']
+            size = int(numpy.prod(shape))
+            return self.buffers[dtype][start:start+size].reshape(shape)
+        elif 'empty' in value:
+            return nvb_parse.empty_array(*value['empty'])
+        elif 'tuple' in value:
+            return tuple(value['tuple'])
+        elif 'frozenset' in value:
+            return frozenset(value['frozenset'])
+        elif 'dict' in value:
+            return {k: v for k, v in value['dict']}
+        cls = classes[value['class']]
+        if 'values' in value:
+            return cls(*value['values'])
+        obj = cls.__new__(cls)
+        if '__setstate__' in vars(cls):
+            obj.__setstate__(dict(value['state']))
+        else:
+            for k, v in value['state']:
+                setattr(obj, k, v)
+        return obj
+
+
+def write_entry(f, data):
+    """Write data as npz file containing only plain arrays."""
+    encoder = Encoder()
+    meta = json.dumps(encoder.encode(data)).encode('utf-8')
+    arrays = encoder.get_arrays()
+    arrays['meta'] = numpy.frombuffer(meta, numpy.uint8)
+    numpy.savez(f, **arrays)
+
+
+def read_entry(filepath):
+    """Read data written by write_entry, never unpickling anything."""
+    with numpy.load(filepath, allow_pickle=False) as npz:
+        meta = npz['meta'].tobytes().decode('utf-8')
+        buffers = [npz[k] for k in npz.files if k != 'meta']
+    return json.loads(meta, object_hook=Decoder(buffers))
+
+
+class Cache():
+    """Size bounded cache of read models, least recently used are dropped.
+
+    Entries are keyed by absolute path, size and modification time of the
+    source file as well as the parser version, so changed files or parser
+    updates never return stale data. Models are stored as npz files: the
+    node structure as json, vertices, faces, keys, ... as raw arrays.
+    The cache directory is private to the user.
+    """
+
+    suffix = '.nvbcache.npz'
+
+    def __init__(self, directory='', max_size=512):
+        """Use a cache in directory holding at most max_size MB."""
+        self.directory = directory or default_directory()
+        self.max_size = max_size * 1024 * 1024
+
+    def get_entry(self, filepath, kind):
+        """Return the path of the cache entry for a file (None if missing)."""
+        try:
+            info = os.stat(filepath)
+        except OSError:
+            return None
+        key = '|'.join([os.path.abspath(filepath), str(info.st_size),
+                        str(info.st_mtime_ns), str(nvb_parse.version), kind])
+        key_hash = hashlib.sha1(key.encode('utf-8', 'replace')).hexdigest()
+        return os.path.join(self.directory, key_hash + Cache.suffix)
+
+    def load(self, filepath, kind='mdl'):
+        """Return the cached data for a file or None."""
+        entry = self.get_entry(filepath, kind)
+        if entry is None or not os.path.isfile(entry):
+            return None
+        try:
+            make_private_directory(self.directory)
+        except OSError:
+            print("Neverblender: WARNING - Unable to use cache directory " +
+                  self.directory)
+            return None
+        try:
+            data = read_entry(entry)
+            os.utime(entry)  # Mark as recently used
+        except (OSError, EOFError, zipfile.BadZipFile, AttributeError,
+                KeyError, IndexError, TypeError, ValueError):
+            print("Neverblender: WARNING - Dropping invalid cache entry " +
+                  entry)
+            self.remove(entry)
+            return None
+        return data
+
+    def store(self, filepath, data, kind='mdl'):
+        """Add data read from a file to the cache."""
+        entry = self.get_entry(filepath, kind)
+        if entry is None:
+            return
+        tmp_entry = entry + '.' + str(os.getpid())
+        try:
+            make_private_directory(self.directory)
+            with open(tmp_entry, 'wb') as f:
+                write_entry(f, data)
+            os.replace(tmp_entry, entry)
+        except (OSError, TypeError, ValueError):
+            print("Neverblender: WARNING - Unable to write cache entry for " +
+                  filepath)
+            self.remove(tmp_entry)
+            return
+        self.evict()
+
+    @staticmethod
+    def remove(entry):
+        """Delete a single cache entry."""
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Delete least recently used entries until the size limit is met."""
+        entries = []
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(Cache.suffix):
+                    info = entry.stat()
+                    entries.append((info.st_mtime, info.st_size, entry.path))
+        except OSError:
+            return
+        total_size = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            Cache.remove(path)
+            total_size -= size
+
+    def clear(self):
+        """Delete all cache entries."""
+        self.max_size, max_size = 0, self.max_size
+        self.evict()
+        self.max_size = max_size
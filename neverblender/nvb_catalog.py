@@ -0,0 +1,282 @@
+"""Catalogue of the mdl files in a directory, stored in a SQLite database."""
+
+import os
+import sqlite3
+import hashlib
+import collections
+
+from . import nvb_def
+from . import nvb_mdl
+from . import nvb_node
+from . import nvb_parse
+from . import nvb_binary
+from . import nvb_utils
+from . import nvb_cache
+
+
+def scan_file(filepath):
+    """Collect the catalogue data of a single mdl file.
+
+    Reads the header, counts nodes by type and collects textures and
+    materialnames. Does not require blender.
+    """
+    mdl = nvb_mdl.Mdl()
+    node_counts = collections.Counter()
+    textures = set()
+    materialnames = set()
+    with nvb_parse.map_file(filepath) as data:
+        if nvb_parse.is_binary(data):
+            reader = nvb_binary.MdlReader(data)
+            reader.read_header(mdl)
+            nodes = []
+            reader.read_geometry(nodes)
+            for node in nodes:
+                node_counts[node.nodetype] += 1
+                if isinstance(node, nvb_node.Trimesh):
+                    textures.update(t for t in node.material.textures
+                                    if t != nvb_def.null)
+                elif isinstance(node, nvb_node.Emitter):
+                    textures.update(v for p, v in node.blender_data
+                                    if p == 'nvb.texture' and
+                                    v != nvb_def.null)
+            reader.read_animations(mdl.animations, nodes=False)
+            return mdl, node_counts, textures, materialnames
+        records = nvb_parse.Tokenizer(data)
+        for label, line, _, _ in records:
+            if label == 'newanim':
+                break
+            elif label == 'node':
+                if len(line) > 1:
+                    node_counts[line[1].lower()] += 1
+            elif label == 'bitmap' or label.startswith('texture'):
+                if len(line) > 1 and label != 'texturenames':
+                    tex = nvb_utils.str2texture(line[1])
+                    if tex != nvb_def.null:
+                        textures.add(tex)
+            elif label == 'materialname':
+                if len(line) > 1 and nvb_utils.str2identifier(line[1]):
+                    materialnames.add(nvb_utils.str2identifier(line[1]))
+            elif not node_counts:
+                mdl.read_ascii_header(label, line)
+        mdl.scan_ascii_anims(data, records.line_start)
+    return mdl, node_counts, textures, materialnames
+
+
+class Catalog():
+    """Index of header data, nodes, animations and textures of mdl files.
+
+    Files are only scanned again if their size or modification time changed.
+    """
+
+    default_name = 'nvb_catalog.sqlite'
+
+    schema = ('CREATE TABLE IF NOT EXISTS models ('
+              'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, name TEXT, '
+              'supermodel TEXT, classification TEXT, animscale REAL)',
+              'CREATE TABLE IF NOT EXISTS nodes ('
+              'path TEXT, nodetype TEXT, count INTEGER)',
+              'CREATE TABLE IF NOT EXISTS animations ('
+              'path TEXT, name TEXT, length REAL)',
+              'CREATE TABLE IF NOT EXISTS textures ('
+              'path TEXT, texture TEXT)',
+              'CREATE TABLE IF NOT EXISTS materialnames ('
+              'path TEXT, materialname TEXT)',
+              'CREATE INDEX IF NOT EXISTS models_name ON models(name)',
+              'CREATE INDEX IF NOT EXISTS models_super ON models(supermodel)',
+              'CREATE INDEX IF NOT EXISTS nodes_path ON nodes(path)',
+              'CREATE INDEX IF NOT EXISTS anims_path ON animations(path)',
+              'CREATE INDEX IF NOT EXISTS anims_name ON animations(name)',
+              'CREATE INDEX IF NOT EXISTS tex_path ON textures(path)',
+              'CREATE INDEX IF NOT EXISTS tex_name ON textures(texture)',
+              'CREATE INDEX IF NOT EXISTS mtr_path ON materialnames(path)',
+              'CREATE INDEX IF NOT EXISTS mtr_name ON '
+              'materialnames(materialname)')
+
+    detail_tables = ('nodes', 'animations', 'textures', 'materialnames')
+
+    def __init__(self, db_path):
+        """Open (or create) the catalogue stored at db_path."""
+        self.db = sqlite3.connect(db_path)
+        with self.db:
+            for statement in Catalog.schema:
+                self.db.execute(statement)
+
+    @classmethod
+    def open_directory(cls, directory):
+        """Open the catalogue stored in a model directory."""
+        return cls(os.path.join(directory, cls.default_name))
+
+    @classmethod
+    def open_user_catalog(cls, directory):
+        """Open the catalogue of a model directory kept in the user's cache.
+
+        Used for directories the user can't write to.
+        """
+        user_dir = nvb_cache.get_user_directory('catalogs')
+        nvb_cache.make_private_directory(user_dir)
+        key = os.path.abspath(directory).encode('utf-8', 'replace')
+        return cls(os.path.join(user_dir, hashlib.sha1(key).hexdigest() +
+                                '.sqlite'))
+
+    @classmethod
+    def update_directory(cls, directory):
+        """Open and update the catalogue of a model directory.
+
+        If the catalogue can't be written to the directory, a catalogue in
+        the user's cache is used instead. Returns None if neither works.
+        """
+        for open_catalog in (cls.open_directory, cls.open_user_catalog):
+            catalog = None
+            try:
+                catalog = open_catalog(directory)
+                catalog.update(directory)
+                return catalog
+            except (sqlite3.DatabaseError, OSError):
+                if catalog is not None:
+                    catalog.close()
+        print("Neverblender: WARNING - Unable to write catalogue for " +
+              directory)
+        return None
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def remove_file(self, filepath):
+        """Remove a single file from the catalogue."""
+        self.db.execute('DELETE FROM models WHERE path = ?', (filepath,))
+        for table in Catalog.detail_tables:
+            self.db.execute('DELETE FROM ' + table + ' WHERE path = ?',
+                            (filepath,))
+
+    def add_file(self, filepath, mtime, size):
+        """Scan a single file and (re-)add it to the catalogue."""
+        mdl, node_counts, textures, materialnames = scan_file(filepath)
+        self.remove_file(filepath)
+        self.db.execute('INSERT INTO models VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (filepath, mtime, size, mdl.name.lower(),
+                         mdl.supermodel, mdl.classification, mdl.animscale))
+        self.db.executemany('INSERT INTO nodes VALUES (?, ?, ?)',
+                            [(filepath, t, c) for t, c in node_counts.items()])
+        self.db.executemany('INSERT INTO animations VALUES (?, ?, ?)',
+                            [(filepath, a.name, a.length)
+                             for a in mdl.animations])
+        self.db.executemany('INSERT INTO textures VALUES (?, ?)',
+                            [(filepath, t) for t in textures])
+        self.db.executemany('INSERT INTO materialnames VALUES (?, ?)',
+                            [(filepath, m) for m in materialnames])
+
+    def update(self, directory, recursive=True):
+        """Add new and changed mdl files, remove deleted ones.
+
+        Returns the number of scanned files.
+        """
+        known = {p: (m, s) for p, m, s in self.db.execute(
+                 'SELECT path, mtime, size FROM models')}
+        directory = os.path.abspath(directory)
+        scanned = 0
+        found = set()
+        with self.db:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                if not recursive:
+                    dirnames.clear()
+                for filename in filenames:
+                    if not filename.lower().endswith('.mdl'):
+                        continue
+                    filepath = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(filepath)
+                    except OSError:
+                        continue
+                    found.add(filepath)
+                    if known.get(filepath) == (stat.st_mtime, stat.st_size):
+                        continue
+                    try:
+                        self.add_file(filepath, stat.st_mtime, stat.st_size)
+                    except (OSError, ValueError, IndexError,
+                            nvb_def.MalformedMdlFile):
+                        print("Neverblender: WARNING - Unable to scan " +
+                              filepath)
+                        self.remove_file(filepath)
+                        continue
+                    scanned += 1
+            # Remove files which no longer exist
+            for filepath in known:
+                in_dir = os.path.dirname(filepath) == directory or \
+                    (recursive and filepath.startswith(directory + os.sep))
+                if in_dir and filepath not in found:
+                    self.remove_file(filepath)
+        return scanned
+
+    def find_models(self, name=None, supermodel=None, classification=None,
+                    texture=None, materialname=None, animation=None):
+        """Return the paths of all models matching every given criterion."""
+        query = 'SELECT path FROM models WHERE 1'
+        params = []
+        if name is not None:
+            query += ' AND name = ?'
+            params.append(name.lower())
+        if supermodel is not None:
+            query += ' AND supermodel = ?'
+            params.append(supermodel.lower())
+        if classification is not None:
+            query += ' AND classification = ?'
+            params.append(classification.lower())
+        if texture is not None:
+            query += ' AND path IN (SELECT path FROM textures ' \
+                     'WHERE texture = ?)'
+            params.append(texture.lower())
+        if materialname is not None:
+            query += ' AND path IN (SELECT path FROM materialnames ' \
+                     'WHERE materialname = ?)'
+            params.append(materialname.lower())
+        if animation is not None:
+            query += ' AND path IN (SELECT path FROM animations ' \
+                     'WHERE name = ?)'
+            params.append(animation.lower())
+        query += ' ORDER BY path'
+        return [r[0] for r in self.db.execute(query, params)]
+
+    def get_model(self, filepath):
+        """Return the header data of a model as dict (or None)."""
+        row = self.db.execute('SELECT name, supermodel, classification, '
+                              'animscale FROM models WHERE path = ?',
+                              (filepath,)).fetchone()
+        if row is None:
+            return None
+        model = dict(zip(('name', 'supermodel', 'classification',
+                          'animscale'), row))
+        model['nodes'] = dict(self.db.execute(
+            'SELECT nodetype, count FROM nodes WHERE path = ?', (filepath,)))
+        model['animations'] = self.db.execute(
+            'SELECT name, length FROM animations WHERE path = ?',
+            (filepath,)).fetchall()
+        model['textures'] = sorted(r[0] for r in self.db.execute(
+            'SELECT texture FROM textures WHERE path = ?', (filepath,)))
+        model['materialnames'] = sorted(r[0] for r in self.db.execute(
+            'SELECT materialname FROM materialnames WHERE path = ?',
+            (filepath,)))
+        return model
+
+    def get_supermodel_chain(self, name):
+        """Return paths of the supermodels of a model, nearest first."""
+        chain = []
+        visited = set()
+        row = self.db.execute('SELECT supermodel FROM models WHERE name = ?',
+                              (name.lower(),)).fetchone()
+        while row and row[0] and row[0] not in visited:
+            visited.add(row[0])
+            row = self.db.execute('SELECT path, supermodel FROM models '
+                                  'WHERE name = ? ORDER BY path',
+                                  (row[0],)).fetchone()
+            if row is None:
+                break
+            chain.append(row[0])
+            row = row[1:]
+        return chain
@@ -225,6 +225,7 @@ class ImportOptions():
         self.import_walkmesh = True
         self.importSmoothGroups = True
         self.import_normals = True
+        self.lazy_nodes = False  # Read node data only when creating objects
         self.importMaterials = True
         # Additional options for textures and materials
         self.mtr_import = True
@@ -236,6 +237,9 @@ class ImportOptions():
         self.anim_fps = 30
         self.anim_restpose = True
         self.anim_ignore_existing = False
+        self.anim_filter = None  # set of names or predicate, None for all
+        self.anim_workers = 0  # Read animations in parallel if > 1
+        self.cache = None  # nvb_cache.Cache for read models, None to disable
         self.anim_scale = None  # use None, instead of 1.0 - for perfomance
         # Blender Settings
         self.rotmode = 'XYZ'
@@ -260,6 +264,8 @@ class ExportOptions():
         self.export_walkmesh = True
         self.export_smoothgroups = True
         self.export_normals = False
+        self.export_binary = False  # Write compiled mdl and walkmesh files
+        self.export_plan = None  # Node order and names of the current model
         # UV Map Settings
         self.uvmapAutoJoin = True
         self.uvmapMode = 'REN'
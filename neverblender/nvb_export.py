@@ -0,0 +1,230 @@
+"""Helpers for exporting ascii mdl and walkmesh files."""
+
+import os
+import tempfile
+import collections
+
+import numpy
+
+from . import nvb_utils
+from . import nvb_parse
+
+# A node of the export plan. 'geometry' is False for walkmesh roots and their
+# children, which are only written to the walkmesh files
+PlanNode = collections.namedtuple('PlanNode',
+                                  ['obj', 'name', 'parent', 'nodetype',
+                                   'geometry', 'material', 'particles'])
+
+
+class LineWriter():
+    """Write ascii lines to a file while they are being generated.
+
+    Takes the place of the list of lines the exporters append to, but only
+    keeps a chunk of lines in memory. The file is opened on the first write,
+    so nothing is created if no lines are generated at all. The output is
+    identical to writing '\\n'.join(lines) at once.
+    """
+
+    def __init__(self, filepath, chunk_size=2048):
+        """Write to filepath, chunk_size lines at a time."""
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+        self.file = None
+        self.lines = []
+        self.line_count = 0  # Number of lines written to the file
+
+    def __enter__(self):
+        """Return the writer itself, to be used as list of lines."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Write the remaining lines and close the file.
+
+        If generating the lines failed, the incomplete file is removed.
+        """
+        if exc_type is None:
+            self.flush()
+            self.close()
+        else:
+            created = self.file is not None
+            self.close()
+            if created:
+                os.remove(os.fsencode(self.filepath))
+
+    def __len__(self):
+        """Return the number of lines generated so far."""
+        return self.line_count + len(self.lines)
+
+    def append(self, line):
+        """Add a single line."""
+        self.lines.append(line)
+        if len(self.lines) >= self.chunk_size:
+            self.flush()
+
+    def extend(self, lines):
+        """Add a sequence of lines."""
+        self.lines.extend(lines)
+        if len(self.lines) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write all pending lines to the file."""
+        if not self.lines:
+            return
+        if self.file is None:
+            self.file = open(os.fsencode(self.filepath), 'w')
+        if self.line_count:
+            self.file.write('\n')
+        self.file.write('\n'.join(self.lines))
+        self.line_count += len(self.lines)
+        self.lines = []
+
+    def close(self):
+        """Close the file, pending lines are discarded."""
+        self.lines = []
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def write_compiled(filepath, generate_lines, compile_data):
+    """Write a compiled file from generated ascii lines.
+
+    The lines are streamed to a temporary file next to filepath, which is
+    then memory mapped and compiled by compile_data, so the ascii text is
+    never held in memory as a whole. Nothing is written if no lines are
+    generated. Returns True if the file was written.
+    """
+    fd, ascii_path = tempfile.mkstemp(
+        suffix='.ascii', dir=os.path.dirname(os.path.abspath(filepath)))
+    os.close(fd)
+    try:
+        with LineWriter(ascii_path) as ascii_lines:
+            generate_lines(ascii_lines)
+        if not len(ascii_lines):
+            return False
+        with nvb_parse.map_file(ascii_path) as data:
+            binary_data = compile_data(data)
+        with open(os.fsencode(filepath), 'wb') as f:
+            f.write(binary_data)
+    finally:
+        try:
+            os.remove(ascii_path)
+        except OSError:  # Already removed by the LineWriter
+            pass
+    return True
+
+
+class ExportPlan():
+    """Node order, names and types of a model, computed once per export.
+
+    Children are sorted by name and import order to restore the original
+    order (important for supermodels and animations to work). The geometry,
+    walkmesh and animation passes iterate the same list of nodes instead of
+    sorting children and generating names for every node again.
+    """
+
+    def __init__(self, mdl_base, options):
+        """Build the plan for the model with the root object mdl_base."""
+        self.mdl_base = mdl_base
+        self.strip_trailing = options.strip_trailing
+        self.nodes = []
+        self.lookup = dict()  # Object name -> PlanNode
+        self.keyframes = KeyframeIndex()
+        parent = nvb_utils.generate_node_name(mdl_base.parent,
+                                              self.strip_trailing)
+        self.add_node(mdl_base, parent, True)
+
+    def add_node(self, obj, parent, geometry):
+        """Add obj with a given parent name, then all of its children."""
+        geometry = geometry and not nvb_utils.is_wkm_base(obj)
+        name = nvb_utils.generate_node_name(obj, self.strip_trailing)
+        part_sys = obj.particle_systems.active
+        node = PlanNode(obj, name, parent, nvb_utils.getNodeType(obj),
+                        geometry, obj.active_material,
+                        part_sys.settings if part_sys else None)
+        self.nodes.append(node)
+        self.lookup[obj.name] = node
+        for c in sorted(obj.children, key=lambda c: (c.nvb.imporder, c.name)):
+            self.add_node(c, name, geometry)
+
+    def get(self, obj):
+        """Return the plan node of obj or None if it is not in the model."""
+        if not obj:
+            return None
+        return self.lookup.get(obj.name)
+
+    def get_names(self, obj):
+        """Return the node name of obj and the name of its parent."""
+        node = self.get(obj)
+        if node:
+            return node.name, node.parent
+        return (nvb_utils.generate_node_name(obj, self.strip_trailing),
+                nvb_utils.generate_node_name(obj.parent, self.strip_trailing))
+
+
+class KeyframeIndex():
+    """Keyframe points of fcurves, read once per export.
+
+    All animations of a model share the same action timeline. Instead of
+    scanning every keyframe point once per animation, the points of an
+    fcurve are read once with foreach_get and the keys of an animation are
+    found by binary search.
+    """
+
+    def __init__(self):
+        """TODO: DOC."""
+        self.points = dict()  # fcurve pointer -> (frames, values)
+
+    def get_points(self, fcu):
+        """Return the frames and values of all points, sorted by frame."""
+        ptr = fcu.as_pointer()
+        if ptr not in self.points:
+            co = numpy.empty(2 * len(fcu.keyframe_points), numpy.float32)
+            fcu.keyframe_points.foreach_get('co', co)
+            co = co.reshape(-1, 2).astype(numpy.float64)
+            order = numpy.argsort(co[:, 0], kind='mergesort')
+            self.points[ptr] = (co[order, 0], co[order, 1])
+        return self.points[ptr]
+
+    def get_frames(self, fcurves, start, end):
+        """Return all keyed frames in [start, end], sorted and unique."""
+        frames = []
+        for fcu in fcurves:
+            if fcu:
+                key_frames, _ = self.get_points(fcu)
+                i0 = numpy.searchsorted(key_frames, start, side='left')
+                i1 = numpy.searchsorted(key_frames, end, side='right')
+                frames.append(key_frames[i0:i1])
+        if not frames:
+            return numpy.zeros(0)
+        return numpy.unique(numpy.concatenate(frames))
+
+    def get_values(self, fcu, frames):
+        """Return the values of an fcurve at the given frames.
+
+        Values at keyed frames are taken from the keyframe points. The fcurve
+        is only evaluated in between keys or if it has modifiers.
+        """
+        key_frames, key_values = self.get_points(fcu)
+        values = numpy.zeros(len(frames))
+        if len(key_frames) and not fcu.modifiers:
+            idx = numpy.searchsorted(key_frames, frames, side='left')
+            idx = numpy.minimum(idx, len(key_frames) - 1)
+            is_key = key_frames[idx] == frames
+            values[is_key] = key_values[idx[is_key]]
+            missing = numpy.flatnonzero(~is_key)
+        else:
+            missing = range(len(frames))
+        for i in missing:
+            values[i] = fcu.evaluate(frames[i])
+        return values
+
+
+def get_plan(mdl_base, options):
+    """Return the export plan for mdl_base, build it if necessary."""
+    plan = options.export_plan
+    if plan is None or plan.mdl_base != mdl_base:
+        plan = ExportPlan(mdl_base, options)
+        options.export_plan = plan
+    return plan
@@ -0,0 +1,164 @@
+"""Vectorized formatting of numeric arrays as lines of text.
+
+Most of an exported mdl consists of rows of numbers (vertices, faces,
+weights, keys). Instead of calling str.format once per row, all rows of an
+array are formatted at once: values are rounded to fixed point integers,
+their digits are written into a byte matrix and the matrix is decoded as
+text. The output is identical to fmt.format(*row) for every row.
+"""
+
+import re
+import string
+import functools
+
+import numpy
+
+# Supported fields: '{:[[ ]>][sign][width][.precision]f}' and the same
+# without precision for 'd'. Everything else is left to str.format.
+field_pattern = re.compile(r'^(?: ?>)?([-+ ]?)([1-9]\d*)?(?:\.(\d+))?([df])$')
+
+# Powers of ten for counting the digits of int64 values
+powers = 10 ** numpy.arange(1, 19, dtype=numpy.int64)
+
+
+@functools.lru_cache(maxsize=128)
+def parse_format(fmt):
+    """Split a format string into fields and the text following them.
+
+    Fields are tuples (preceding text, sign, width, precision, type).
+    Returns None if the format string can't be vectorized.
+    """
+    fields = []
+    trailing = ''
+    try:
+        parsed = list(string.Formatter().parse(fmt))
+    except ValueError:
+        return None
+    for literal, field_name, spec, conversion in parsed:
+        if '\n' in literal:
+            return None
+        if field_name is None:
+            trailing = literal
+            continue
+        match = field_pattern.match(spec)
+        if field_name or conversion or not match:
+            return None
+        sign, width, precision, ftype = match.groups()
+        if precision is None:
+            precision = 6 if ftype == 'f' else 0
+        elif ftype == 'd':
+            return None
+        fields.append((literal, sign or '-', int(width or 0), int(precision),
+                       ftype))
+    return tuple(fields), trailing
+
+
+def format_cells(values, sign, width, precision, ftype):
+    """Format a column of values into a byte matrix of right aligned cells.
+
+    Returns the matrix, the length of each cell and a mask of values which
+    have to be formatted by python instead.
+    """
+    count = len(values)
+    invalid = numpy.zeros(count, bool)
+    if ftype == 'd':
+        magnitude = values.astype(numpy.int64)
+        negative = magnitude < 0
+        magnitude = numpy.abs(magnitude)
+        fraction = None
+    else:
+        values = values.astype(numpy.float64)
+        finite = numpy.isfinite(values)
+        scaled = numpy.abs(numpy.where(finite, values, 0.0)) * \
+            10.0 ** precision
+        # The scaled value carries a rounding error of its own, values close
+        # to a tie may round differently than their exact decimal value
+        invalid = ~finite | (scaled >= 2.0 ** 52) | \
+            (numpy.abs(scaled - numpy.floor(scaled) - 0.5) <=
+             scaled * 2.0 ** -50)
+        rounded = numpy.rint(numpy.where(invalid, 0.0, scaled))
+        rounded = rounded.astype(numpy.int64)
+        magnitude, fraction = numpy.divmod(rounded, 10 ** precision)
+        negative = numpy.signbit(values) & finite  # Python keeps -0.0
+    ndigits = 1 + numpy.searchsorted(powers, magnitude, side='right')
+    has_sign = negative | (sign != '-')
+    length = has_sign + ndigits
+    if fraction is not None and precision > 0:
+        length += precision + 1
+    length = numpy.maximum(length, width)
+    cell_width = int(length.max()) if count else width
+    cells = numpy.full((count, cell_width), ord(' '), numpy.uint8)
+    pos = cell_width - 1
+    if fraction is not None and precision > 0:
+        for _ in range(precision):
+            cells[:, pos] = ord('0') + fraction % 10
+            fraction = fraction // 10
+            pos -= 1
+        cells[:, pos] = ord('.')
+        pos -= 1
+    for i in range(int(ndigits.max()) if count else 0):
+        digits = i < ndigits
+        cells[digits, pos - i] = ord('0') + magnitude[digits] % 10
+        magnitude = magnitude // 10
+    rows = numpy.flatnonzero(has_sign)
+    sign_chars = numpy.where(negative[rows], ord('-'), ord(sign))
+    cells[rows, pos - ndigits[rows]] = sign_chars
+    return cells, length, invalid
+
+
+def format_chunk(fmt, fields, trailing, rows):
+    """Format a chunk of rows, return a list of lines."""
+    count = len(rows)
+    parts = []
+    masks = []
+    fallback = numpy.zeros(count, bool)
+    for col, (literal, sign, width, precision, ftype) in enumerate(fields):
+        if literal:
+            text = numpy.frombuffer(literal.encode('utf-8'), numpy.uint8)
+            parts.append(numpy.broadcast_to(text, (count, len(text))))
+            masks.append(numpy.ones((count, len(text)), bool))
+        cells, length, invalid = format_cells(rows[:, col], sign, width,
+                                              precision, ftype)
+        fallback |= invalid
+        parts.append(cells)
+        cell_width = cells.shape[1]
+        masks.append(numpy.arange(cell_width) >=
+                     (cell_width - length)[:, numpy.newaxis])
+    text = numpy.frombuffer((trailing + '\n').encode('utf-8'), numpy.uint8)
+    parts.append(numpy.broadcast_to(text, (count, len(text))))
+    masks.append(numpy.ones((count, len(text)), bool))
+    block = numpy.hstack(parts)[numpy.hstack(masks)]
+    lines = block.tobytes().decode('utf-8').split('\n')[:-1]
+    for idx in numpy.flatnonzero(fallback).tolist():
+        values = [int(v) if f[4] == 'd' else float(v)
+                  for v, f in zip(rows[idx].tolist(), fields)]
+        lines[idx] = fmt.format(*values)
+    return lines
+
+
+def format_rows(fmt, values, chunk_size=65536):
+    """Format every row of an (N, k) array, same as fmt.format(*row).
+
+    Values may be an array or a sequence of rows. Returns a list of lines.
+    Formats with fields other than right aligned 'd' and 'f' fields are
+    formatted row by row with str.format.
+    """
+    parsed = parse_format(fmt)
+    try:
+        rows = numpy.asarray(values)
+    except ValueError:  # Rows of different length
+        rows = None
+    if parsed is None or rows is None or not rows.size or rows.ndim != 2 or \
+            rows.dtype.kind not in 'biuf' or rows.shape[1] != len(parsed[0]):
+        return [fmt.format(*row) for row in values]
+    fields, trailing = parsed
+    lines = []
+    for start in range(0, len(rows), chunk_size):
+        lines.extend(format_chunk(fmt, fields, trailing,
+                                  rows[start:start+chunk_size]))
+    return lines
+
+
+def format_values(fmt, values):
+    """Format every value of a 1d array, same as fmt.format(value)."""
+    return format_rows(fmt, numpy.reshape(values, (-1, 1)))
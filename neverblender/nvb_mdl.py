@@ -1,14 +1,32 @@
 """TODO: DOC."""
 
 import os
+import sys
+import itertools
+import collections
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
 from datetime import datetime
 
-import bpy
+try:
+    import bpy
+except ImportError:  # Not running inside blender, parsing only
+    pass
 
 from . import nvb_node
 from . import nvb_anim
 from . import nvb_def
 from . import nvb_utils
+from . import nvb_parse
+from . import nvb_binary
+from . import nvb_export
+
+
+# Entry of the node offset table for lazily read nodes
+NodeSpan = collections.namedtuple('NodeSpan',
+                                  ['nodeidx', 'nodetype', 'name', 'parent',
+                                   'start', 'end'])
 
 
 class Mdl():
@@ -34,148 +52,338 @@ class Mdl():
         self.animscale = 1.0
         self.classification = nvb_def.Classification.UNKNOWN
         # Geometry
+        self.filepath = ''
         self.mdlnodes = []
+        self.node_table = []  # Offsets of lazily read nodes
         self.pwknodes = []
         self.dwknodes = []
         # Animations
         self.animations = []
 
-    def read_ascii_header(self, ascii_block):
-        """TODO: DOC."""
-        ascii_lines = [l.strip().split() for l in ascii_block.splitlines()]
-        for line in ascii_lines:
+    def read_ascii_header(self, label, line):
+        """Read a single line from the header of an ascii mdl."""
+        if label == 'newmodel':
             try:
-                label = line[0].lower()
-            except (IndexError, AttributeError):
-                continue  # Probably empty line, skip it
-            if label == 'newmodel':
-                try:
-                    self.name = line[1]
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read model name.")
-            elif label == 'setsupermodel':
-                try:  # should be ['setsupermodel', modelname, supermodelname]
-                    self.supermodel = line[2].lower()
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read supermodel. \
-                           Using default value " + self.supermodel)
-            elif label == 'classification':
-                try:
-                    self.classification = line[1].lower()
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read \
-                           classification. \
-                           Using Default value " + self.classification)
-                if self.classification not in nvb_def.Classification.ALL:
-                    print("Neverblender: WARNING - Invalid classification \
-                           '" + self.classification + "'")
-                    self.classification = nvb_def.Classification.UNKNOWN
-            elif label == 'setanimationscale':
-                try:
-                    self.animscale = float(line[1])
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read \
-                           animationscale. \
-                           Using default value " + self.animscale)
-
-    def read_ascii_wkm(self, ascii_block, wkmtype, options):
-        """TODO: DOC."""
+                self.name = line[1]
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read model name.")
+        elif label == 'setsupermodel':
+            try:  # should be ['setsupermodel', modelname, supermodelname]
+                self.supermodel = line[2].lower()
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read supermodel. \
+                       Using default value " + self.supermodel)
+        elif label == 'classification':
+            try:
+                self.classification = line[1].lower()
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read \
+                       classification. \
+                       Using Default value " + self.classification)
+            if self.classification not in nvb_def.Classification.ALL:
+                print("Neverblender: WARNING - Invalid classification \
+                       '" + self.classification + "'")
+                self.classification = nvb_def.Classification.UNKNOWN
+        elif label == 'setanimationscale':
+            try:
+                self.animscale = float(line[1])
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read \
+                       animationscale. \
+                       Using default value " + self.animscale)
+
+    @staticmethod
+    def read_ascii_node_line(line):
+        """Read type and name from the first line of an ascii node."""
+        try:  # Read node type
+            node_type = line[1].lower()
+        except (IndexError, AttributeError):
+            raise nvb_def.MalformedMdlFile('Unable to read node type')
+        try:  # Read node name
+            node_name = line[2].lower()
+        except (IndexError, AttributeError):
+            raise nvb_def.MalformedMdlFile('Unable to read node name')
+        if node_type not in Mdl.nodelookup:
+            raise nvb_def.MalformedMdlFile('Invalid node type')
+        return node_type, node_name
+
+    @staticmethod
+    def read_ascii_node(line, nodeidx):
+        """Create a node from the first line of an ascii node."""
+        node_type, node_name = Mdl.read_ascii_node_line(line)
+        node = Mdl.nodelookup[node_type](node_name)
+        node.nodeidx = nodeidx
+        return node
+
+    @staticmethod
+    def read_ascii_geom(records, nodelist):
+        """Read all nodes of an ascii geometry block."""
+        node = None
+        for label, line, block, count in records:
+            if label == 'node':
+                node = Mdl.read_ascii_node(line, len(nodelist))
+                node.loadAsciiLine(label, line, block, count)
+                nodelist.append(node)
+            elif label == 'endnode':
+                node = None
+            elif node is not None:
+                node.loadAsciiLine(label, line, block, count)
+
+    def read_ascii_wkm(self, ascii_data, wkmtype, options):
+        """Parse an ascii walkmesh file."""
         if options.import_walkmesh:
-            geom_start = ascii_block.find('node ')
-            if (geom_start < 0):  # Most likely empty walkmesh file
-                print("Neverblender: WARNING: Unable to read walkmesh data")
-                return
             if wkmtype == 'pwk':
-                Mdl.read_ascii_geom(ascii_block[geom_start:], self.pwknodes)
+                nodelist = self.pwknodes
             elif wkmtype == 'dwk':
-                Mdl.read_ascii_geom(ascii_block[geom_start:], self.dwknodes)
+                nodelist = self.dwknodes
+            else:
+                return
+            Mdl.read_ascii_geom(nvb_parse.Tokenizer(ascii_data), nodelist)
+            if not nodelist:  # Most likely empty walkmesh file
+                print("Neverblender: WARNING: Unable to read walkmesh data")
 
-    @staticmethod
-    def read_ascii_geom(ascii_block, nodelist):
-        """Read the geometry block of ascii mdl."""
-        dlm = 'node '
-        ascii_node_list = [dlm + b for b in ascii_block.split(dlm) if b]
-        for idx, ascii_node in enumerate(ascii_node_list):
-            ascii_lines = [l.strip().split() for l in ascii_node.splitlines()]
-            node = None
-            node_type = ''
-            node_name = 'UNNAMED'
-            try:  # Read node type
-                node_type = ascii_lines[0][1].lower()
-            except (IndexError, AttributeError):
-                raise nvb_def.MalformedMdlFile('Unable to read node type')
-            try:  # Read node name
-                node_name = ascii_lines[0][2].lower()
-            except (IndexError, AttributeError):
-                raise nvb_def.MalformedMdlFile('Unable to read node name')
-            try:  # Create (node) object
-                node = Mdl.nodelookup[node_type](node_name)
-            except KeyError:
-                raise nvb_def.MalformedMdlFile('Invalid node type')
-            # Parse and add to node list
-            node.loadAscii(ascii_lines, idx)
-            nodelist.append(node)
-
-    def read_ascii_anims(self, ascii_block):
-        """Load all animations from an ascii mdl block."""
-        def read_anim(ascii_anim):
-            """Load a single animation from an ascii animation block."""
-            anim = nvb_anim.Animation()
-            anim.loadAscii(ascii_anim)
-            return anim
-        dlm = 'newanim '  # Split animations using 'newanim' as delimiter
-        animList = [dlm + b for b in ascii_block.split(dlm) if b]
-        self.animations = list(map(read_anim, animList))
-
-    def read_ascii_mdl(self, ascii_block, options):
-        """Parse an ascii mdl file."""
-        geom_start = ascii_block.find('node ')
-        anim_start = ascii_block.find('newanim ')
-
-        if (anim_start > 0) and (geom_start > anim_start):
-            raise nvb_def.MalformedMdlFile('Animations before geometry')
-        if (geom_start < 0):
+    def read_ascii_mdl(self, ascii_data, options):
+        """Parse an ascii mdl file in a single pass.
+
+        With options.lazy_nodes no nodes are created, only the node offset
+        table (type, name and parent of each node) is read. The nodes are
+        read from it when needed.
+        """
+        lazy = options.lazy_nodes and self.filepath
+        records = nvb_parse.Tokenizer(ascii_data)
+        node = None
+        span = None  # Offset table entry of the current node (lazy)
+        span_end = 0
+        for label, line, block, count in records:
+            if span is not None and label in ('node', 'endnode', 'newanim'):
+                if label == 'endnode':
+                    span_end = records.pos
+                self.node_table.append(span._replace(end=span_end))
+                span = None
+            if label == 'node':
+                if lazy:
+                    node_type, _ = Mdl.read_ascii_node_line(line)
+                    span = NodeSpan(len(self.node_table), node_type,
+                                    nvb_utils.str2identifier(line[2]), '',
+                                    records.line_start, 0)
+                    span_end = records.pos
+                else:
+                    node = Mdl.read_ascii_node(line, len(self.mdlnodes))
+                    node.loadAsciiLine(label, line, block, count)
+                    self.mdlnodes.append(node)
+            elif label == 'endnode':
+                node = None
+            elif label == 'newanim':
+                if not self.mdlnodes and not self.node_table:
+                    raise nvb_def.MalformedMdlFile(
+                        'Animations before geometry')
+                if options.anim_import:
+                    self.read_ascii_anims(ascii_data, records.line_start,
+                                          options.anim_filter,
+                                          options.anim_workers)
+                break
+            elif span is not None:
+                if label == 'parent':
+                    span = span._replace(
+                        parent=nvb_utils.str2identifier(line[1]))
+                span_end = records.pos
+            elif node is not None:
+                node.loadAsciiLine(label, line, block, count)
+            else:
+                self.read_ascii_header(label, line)
+        if span is not None:  # Missing endnode
+            self.node_table.append(span._replace(end=span_end))
+        if not self.mdlnodes and not self.node_table:
             raise nvb_def.MalformedMdlFile('Unable to find geometry')
 
-        self.read_ascii_header(ascii_block[:geom_start-1])
-        # Import Geometry
-        if (anim_start > 0):
-            # Animations present, exclude them for geometry loading
-            Mdl.read_ascii_geom(ascii_block[geom_start:anim_start],
-                                self.mdlnodes)
-        else:
-            Mdl.read_ascii_geom(ascii_block[geom_start:], self.mdlnodes)
-        # Import Animations
-        if options.anim_import and (anim_start > 0):
-            self.read_ascii_anims(ascii_block[anim_start:])
+    def load_nodes(self, ascii_data):
+        """Generate fully read nodes from the node offset table.
 
-    def read_binary_wkm(self, options):
-        """Parse a single walkmesh file."""
-        # TODO: Implement binary import or call external compiler
-        pass
+        Nodes are read one at a time, so the full data is only held in
+        memory while it is in use.
+        """
+        for span in self.node_table:
+            nodelist = []
+            records = nvb_parse.Tokenizer(ascii_data, span.start, span.end)
+            Mdl.read_ascii_geom(records, nodelist)
+            node = nodelist[0]
+            node.nodeidx = span.nodeidx
+            yield node
 
-    def read_binary_mdl(self, options):
-        """Parse a binary mdl file."""
-        # TODO: Implement binary import or call external compiler
-        pass
+    @staticmethod
+    def match_anim_name(name, anim_filter):
+        """Check an animation name against a set of names or a predicate."""
+        if anim_filter is None:
+            return True
+        if callable(anim_filter):
+            return anim_filter(name)
+        return name in anim_filter
+
+    @staticmethod
+    def read_ascii_anim(ascii_data, start, end):
+        """Read a single animation from ascii_data[start:end]."""
+        records = nvb_parse.Tokenizer(ascii_data, start, end)
+        anim = nvb_anim.Animation()
+        anim.loadAsciiLine(*next(iter(records)))  # newanim line
+        anim.loadAscii(records)
+        return anim
+
+    def read_ascii_anims(self, ascii_data, start=0, anim_filter=None,
+                         workers=0):
+        """Read all animations matching the filter.
+
+        Animations are located by their 'newanim' line. Animations not
+        matching the filter are skipped without being tokenized.
+        With more than one worker, the animations are read by a pool of
+        processes and merged in file order.
+        """
+        anim_starts = list(nvb_parse.find_label(ascii_data, 'newanim', start))
+        anim_ends = anim_starts[1:] + [len(ascii_data)]
+        spans = []
+        for anim_start, anim_end in zip(anim_starts, anim_ends):
+            records = nvb_parse.Tokenizer(ascii_data, anim_start, anim_end)
+            _, line, _, _ = next(iter(records))  # newanim line
+            if len(line) < 2:
+                print("Neverblender: WARNING - Unable to read animation name.")
+                continue
+            name = nvb_utils.str2identifier(line[1])
+            if Mdl.match_anim_name(name, anim_filter):
+                spans.append((anim_start, anim_end))
+        if workers > 1 and len(spans) > 1 and self.filepath:
+            try:
+                with create_process_pool(workers) as executor:
+                    self.animations.extend(executor.map(
+                        read_anim_block, itertools.repeat(self.filepath),
+                        *zip(*spans)))
+                return
+            except (OSError, concurrent.futures.process.BrokenProcessPool):
+                print("Neverblender: WARNING - Unable to read animations \
+                       in parallel.")
+                self.animations = []
+        for anim_start, anim_end in spans:
+            self.animations.append(
+                Mdl.read_ascii_anim(ascii_data, anim_start, anim_end))
+
+    def scan_ascii_header(self, ascii_data):
+        """Read the model header and animation headers, but no nodes."""
+        records = nvb_parse.Tokenizer(ascii_data)
+        for label, line, _, _ in records:
+            if label in ('beginmodelgeom', 'node', 'newanim'):
+                break
+            self.read_ascii_header(label, line)
+        self.scan_ascii_anims(ascii_data, records.line_start)
+
+    def scan_ascii_anims(self, ascii_data, start=0):
+        """Read animation headers only, skipping all node bodies."""
+        for anim_start in nvb_parse.find_label(ascii_data, 'newanim', start):
+            anim = nvb_anim.Animation()
+            records = iter(nvb_parse.Tokenizer(ascii_data, anim_start))
+            anim.loadAsciiLine(*next(records))  # newanim line
+            for label, line, block, count in records:
+                if label in ('node', 'doneanim', 'newanim'):
+                    break
+                anim.loadAsciiLine(label, line, block, count)
+            self.animations.append(anim)
+
+    def read_binary_wkm(self, data, wkmtype, options):
+        """Parse a binary walkmesh file."""
+        if options.import_walkmesh:
+            if wkmtype == 'pwk':
+                nodelist = self.pwknodes
+            elif wkmtype == 'dwk':
+                nodelist = self.dwknodes
+            else:
+                return
+            reader = nvb_binary.WalkmeshReader(data)
+            reader.read_nodes(nodelist, self.name, wkmtype)
+
+    def read_binary_mdl(self, data, options):
+        """Parse a binary (compiled) mdl file."""
+        reader = nvb_binary.MdlReader(data)
+        reader.read_header(self)
+        reader.read_geometry(self.mdlnodes)
+        if not self.mdlnodes:
+            raise nvb_def.MalformedMdlFile('Unable to find geometry')
+        if options.anim_import:
+            reader.read_animations(
+                self.animations,
+                lambda name: Mdl.match_anim_name(name, options.anim_filter))
 
     def read_mdl(self, filepath, options):
         """Parse a single mdl file."""
-        with open(os.fsencode(filepath), 'rb') as f:
-            if bytes(f.read(1)) == b'\x00':
-                self.read_binary_mdl(options)
-                return
-        with open(os.fsencode(filepath), 'r') as f:
-            self.read_ascii_mdl(f.read(), options)
+        self.filepath = filepath
+        if options.cache is not None:
+            self.read_mdl_cached(filepath, options)
+            return
+        with nvb_parse.map_file(filepath) as data:
+            if nvb_parse.is_binary(data):
+                self.read_binary_mdl(data, options)
+            else:
+                self.read_ascii_mdl(data, options)
+
+    def read_mdl_cached(self, filepath, options):
+        """Get a mdl from the cache or read the complete file and cache it.
+
+        Animation options (anim_import, anim_filter) are applied afterwards.
+        """
+        cached_mdl = options.cache.load(filepath, 'mdl')
+        if cached_mdl is not None:
+            self.__dict__.update(cached_mdl.__dict__)
+            self.filepath = filepath
+        else:
+            read_options = nvb_def.ImportOptions()
+            read_options.anim_workers = options.anim_workers
+            with nvb_parse.map_file(filepath) as data:
+                if nvb_parse.is_binary(data):
+                    self.read_binary_mdl(data, read_options)
+                else:
+                    self.read_ascii_mdl(data, read_options)
+            options.cache.store(filepath, self, 'mdl')
+        self.animations = [a for a in self.animations
+                           if options.anim_import and
+                           Mdl.match_anim_name(a.name, options.anim_filter)]
 
     def read_wkm(self, filepath, wkm_type, options):
         """Parse a single walkmesh file."""
-        with open(os.fsencode(filepath), 'rb') as f:
-            if bytes(f.read(1)) == b'\x00':
-                self.read_binary_wkm(options)
+        nodelist = {'pwk': self.pwknodes, 'dwk': self.dwknodes}.get(wkm_type)
+        use_cache = options.cache is not None and options.import_walkmesh \
+            and nodelist is not None
+        if use_cache:
+            cached_nodes = options.cache.load(filepath, wkm_type)
+            if cached_nodes is not None:
+                nodelist.extend(cached_nodes)
                 return
-        with open(os.fsencode(filepath), 'r') as f:
-            self.read_ascii_wkm(f.read(), wkm_type, options)
+        with nvb_parse.map_file(filepath) as data:
+            if nvb_parse.is_binary(data):
+                self.read_binary_wkm(data, wkm_type, options)
+            else:
+                self.read_ascii_wkm(data, wkm_type, options)
+        if use_cache:
+            options.cache.store(filepath, nodelist, wkm_type)
+
+    def scan_mdl(self, filepath):
+        """Parse the header and animation names and lengths of a mdl file."""
+        with nvb_parse.map_file(filepath) as data:
+            if nvb_parse.is_binary(data):
+                reader = nvb_binary.MdlReader(data)
+                reader.read_header(self)
+                reader.read_animations(self.animations, nodes=False)
+            else:
+                self.scan_ascii_header(data)
+
+    @staticmethod
+    def compile_ascii(ascii_data):
+        """Compile an ascii mdl into a binary mdl, return the binary data."""
+        mdl = Mdl()
+        mdl.read_ascii_mdl(ascii_data, nvb_def.ImportOptions())
+        return nvb_binary.MdlWriter().write(mdl)
+
+    @staticmethod
+    def compile_ascii_wkm(ascii_data, wkmtype):
+        """Compile an ascii walkmesh into a binary walkmesh."""
+        nodelist = []
+        Mdl.read_ascii_geom(nvb_parse.Tokenizer(ascii_data), nodelist)
+        return nvb_binary.WalkmeshWriter().write(nodelist, wkmtype)
 
     @staticmethod
     def generateAsciiHeader(mdl_base, ascii_lines, options):
@@ -194,24 +402,18 @@ class Mdl():
         ascii_lines.append('setanimationscale ' + str(round(mdlanimscale, 2)))
 
     @staticmethod
-    def generateAsciiGeometry(obj, ascii_lines, options):
+    def generateAsciiGeometry(mdl_base, ascii_lines, options):
         """TODO: DOC."""
-        if nvb_utils.is_wkm_base(obj):
-            return
-        node_type = nvb_utils.getNodeType(obj)
-        try:
-            node = Mdl.nodelookup[node_type]
-        except KeyError:
-            print("Neverblender: WARNING - Unsupported node type.")
-
-        node.generateAscii(obj, ascii_lines, options, False)
-        # Sort children to restore original order before import
-        # (important for supermodels/animations to work)
-        children = [c for c in obj.children]
-        children.sort(key=lambda c: c.name)
-        children.sort(key=lambda c: c.nvb.imporder)
-        for c in children:
-            Mdl.generateAsciiGeometry(c, ascii_lines, options)
+        plan = nvb_export.get_plan(mdl_base, options)
+        for plan_node in plan.nodes:
+            if not plan_node.geometry:
+                continue
+            try:
+                node = Mdl.nodelookup[plan_node.nodetype]
+            except KeyError:
+                print("Neverblender: WARNING - Unsupported node type.")
+            else:
+                node.generateAscii(plan_node.obj, ascii_lines, options, False)
 
     @staticmethod
     def generateAsciiAnimations(mdl_base, ascii_lines, options):
@@ -258,17 +460,18 @@ class Mdl():
     def generateAsciiWalkmesh(mdl_base, ascii_lines, wkmtype, options):
         """TODO: DOC."""
         mdlname = mdl_base.name
+        plan = nvb_export.get_plan(mdl_base, options)
         wkmObjects = []
         if wkmtype == nvb_def.Walkmeshtype.WOK:
             # Walkmesh for tiles: Append only AABB mesh
-            wok = nvb_utils.get_aabb(mdl_base)
+            wok = plan.get(nvb_utils.get_aabb(mdl_base))
             if wok:
                 wkmObjects.append(wok)
         else:
             # Walkmesh for doors: Append all children of the walkmesh root
             wkmRoot = nvb_utils.get_wkm_base(mdl_base, wkmtype)
             if wkmRoot:
-                wkmObjects = [c for c in wkmRoot.children]
+                wkmObjects = [n for n in plan.nodes if n.obj.parent == wkmRoot]
         # Abort if there is nothing to write
         if not wkmObjects:
             return
@@ -276,14 +479,13 @@ class Mdl():
         if wkmtype == nvb_def.Walkmeshtype.WOK:
             ascii_lines.append("beginwalkmeshgeom " + mdlname)
         # Write Data
-        for obj in wkmObjects:
-            nodeType = nvb_utils.getNodeType(obj)
+        for plan_node in wkmObjects:
             try:
-                node = Mdl.nodelookup[nodeType]
+                node = Mdl.nodelookup[plan_node.nodetype]
             except KeyError:
                 print("Neverblender: WARNING - Unable to get node type.")
             else:
-                node.generateAscii(obj, ascii_lines, options, True)
+                node.generateAscii(plan_node.obj, ascii_lines, options, True)
         # Extra data for wok files
         if wkmtype == nvb_def.Walkmeshtype.WOK:
             ascii_lines.append("endwalkmeshgeom " + mdlname)
@@ -369,8 +571,16 @@ class Mdl():
 
         # Create mdl objects
         mdlresolver = nvb_utils.NodeResolver()
-        Mdl.create_objects(self.mdlnodes, mdlresolver, options)
-        mdl_base = self.link_objects(self.mdlnodes, mdlresolver, options)
+        if self.node_table:  # Lazily read nodes, read full data now
+            with nvb_parse.map_file(self.filepath) as ascii_data:
+                Mdl.create_objects(self.load_nodes(ascii_data), mdlresolver,
+                                   options)
+            # Table entries have name, parent and index as well
+            mdl_base = self.link_objects(self.node_table, mdlresolver,
+                                         options)
+        else:
+            Mdl.create_objects(self.mdlnodes, mdlresolver, options)
+            mdl_base = self.link_objects(self.mdlnodes, mdlresolver, options)
         # Create pwk objects
         if self.pwknodes:
             wkmresolver = nvb_utils.NodeResolver()
@@ -414,3 +624,75 @@ class Mdl():
             options.scene.render.fps = options.anim_fps
         self.create_animations(self.animations, mdl_base, node_resolver,
                                options)
+
+
+def scan_header(filepath):
+    """Read only the header of a mdl file (usable without blender).
+
+    Returns a Mdl without any nodes. Animations have their header data
+    (name, length, transtime, animroot, events) but no nodes either.
+    """
+    mdl = Mdl()
+    mdl.scan_mdl(filepath)
+    return mdl
+
+
+def create_process_pool(workers):
+    """Create a process pool running the python interpreter, not blender.
+
+    Workers are spawned instead of forked from blender, where possible.
+    """
+    context = multiprocessing.get_context('spawn')
+    try:
+        python_path = getattr(bpy.app, 'binary_path_python', sys.executable)
+    except NameError:  # Not running inside blender
+        pass
+    else:
+        context.set_executable(python_path)
+    try:
+        return concurrent.futures.ProcessPoolExecutor(workers,
+                                                      mp_context=context)
+    except TypeError:  # Python < 3.7, no choice of context
+        return concurrent.futures.ProcessPoolExecutor(workers)
+
+
+def read_anim_block(filepath, start, end):
+    """Read a single animation from a file (used by worker processes)."""
+    with nvb_parse.map_file(filepath) as ascii_data:
+        return Mdl.read_ascii_anim(ascii_data, start, end)
+
+
+def read_model(mdl_filepath, options):
+    """Read a mdl file and its walkmeshes without creating any objects."""
+    mdl_filedir, mdl_filename = os.path.split(mdl_filepath)
+    mdl_name = os.path.splitext(mdl_filename)[0]
+    mdl = Mdl()
+    mdl.read_mdl(mdl_filepath, options)
+    if options.import_walkmesh:
+        for wkm_type in nvb_def.Walkmeshtype.IMPORT:
+            wkm_filename = mdl_name + '.' + wkm_type
+            wkm_filepath = os.path.join(mdl_filedir, wkm_filename)
+            if os.path.isfile(os.fsencode(wkm_filepath)):
+                mdl.read_wkm(wkm_filepath, wkm_type, options)
+    return mdl
+
+
+def read_models(filepaths, options, workers, queue_size=0):
+    """Generate the models read from several mdl files, in order.
+
+    Files are read ahead by a pool of processes. At most queue_size read
+    models (default: two per process) are waiting to be consumed at a time.
+    The options must not hold any blender data.
+    """
+    if queue_size < 1:
+        queue_size = 2 * workers
+    filepaths = iter(filepaths)
+    pending = collections.deque()
+    with create_process_pool(workers) as executor:
+        for filepath in itertools.islice(filepaths, queue_size):
+            pending.append(executor.submit(read_model, filepath, options))
+        while pending:
+            mdl = pending.popleft().result()
+            for filepath in itertools.islice(filepaths, 1):
+                pending.append(executor.submit(read_model, filepath, options))
+            yield mdl
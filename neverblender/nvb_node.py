@@ -1,25 +1,36 @@
 """TODO: DOC."""
 
 import math
-import array
-import copy
 import os
 import itertools
 
-import mathutils
-import bpy
-import bmesh
-from bpy_extras.io_utils import unpack_list, unpack_face_list
+import numpy
+
+try:
+    import mathutils
+    import bpy
+    import bmesh
+    from bpy_extras.io_utils import unpack_face_list
+except ImportError:  # Not running inside blender, parsing only
+    pass
 
 from . import nvb_mtr
 from . import nvb_def
 from . import nvb_utils
 from . import nvb_aabb
+from . import nvb_parse
+from . import nvb_format
 
 
 class Material(object):
     """A material read from an mdl node."""
 
+    __slots__ = ('name', 'ambient', 'diffuse', 'diffuse_alpha', 'specular',
+                 'alpha', 'textures', 'renderhints', 'materialname', 'mtr')
+
+    # Shared by all materials, replaced when adding textures
+    default_textures = (nvb_def.null,)
+
     def __init__(self, name='unnamed'):
         """TODO: DOC."""
         self.name = name
@@ -28,8 +39,8 @@ class Material(object):
         self.diffuse_alpha = -1.0  # EE stores an alpha as 4th diffuse value
         self.specular = (0.0, 0.0, 0.0)
         self.alpha = 1.0
-        self.textures = [nvb_def.null]
-        self.renderhints = set()
+        self.textures = Material.default_textures
+        self.renderhints = frozenset()  # Shared, replaced when adding hints
         self.materialname = ''
         self.mtr = None
 
@@ -102,18 +113,21 @@ class Material(object):
         elif label == 'materialname':
             self.materialname = nvb_utils.str2identifier(line[1])
         elif label == 'renderhint':
-            self.renderhints.add(nvb_utils.str2identifier(line[1]))
+            self.renderhints = self.renderhints.union(
+                [nvb_utils.str2identifier(line[1])])
         elif label == 'bitmap':
             if self.textures[0] == nvb_def.null:  # Do not overwrite existing
-                self.textures[0] = nvb_utils.str2texture(line[1])
+                self.textures = (nvb_utils.str2texture(line[1]),) + \
+                    self.textures[1:]
         elif label.startswith('texture'):
             if label[7:]:  # 'texture' is followed by a number
                 idx = int(label[7:])
-                cnt = len(self.textures)
+                textures = list(self.textures)
+                cnt = len(textures)
                 if idx+1 > cnt:
-                    self.textures.extend([nvb_def.null
-                                         for _ in range(idx+1-cnt)])
-                self.textures[idx] = nvb_utils.str2texture(line[1])
+                    textures.extend([nvb_def.null for _ in range(idx+1-cnt)])
+                textures[idx] = nvb_utils.str2texture(line[1])
+                self.textures = tuple(textures)
 
     @staticmethod
     def applyNASMSettings(material, options):
@@ -185,13 +199,15 @@ class Material(object):
         if self.mtr:
             self.renderhints = self.renderhints.union(self.mtr.renderhints)
             if self.mtr.textures:  # Transfer texture names
-                l1 = len(self.textures)
+                textures = list(self.textures)
+                l1 = len(textures)
                 l2 = len(self.mtr.textures)
                 if l2 > l1:
-                    self.textures.extend(['' for _ in range(l2-l1+1)])
+                    textures.extend(['' for _ in range(l2-l1+1)])
                 for idx, txname in enumerate(self.mtr.textures):
                     if txname:  # null value in mtr overwrites existing in mdl
-                        self.textures[idx] = txname
+                        textures[idx] = txname
+                self.textures = tuple(textures)
 
     def create(self, options, makeunique=False):
         """Creates a blender material with the stored values."""
@@ -300,6 +316,11 @@ class Node(object):
 
     nodetype = 'undefined'
 
+    # Models may contain thousands of nodes, slots keep them small. Defaults
+    # are immutable and shared, containers are replaced instead of mutated
+    __slots__ = ('createdobj', 'nodeidx', 'name', 'parent', 'position',
+                 'orientation', 'scale', 'wirecolor')
+
     def __init__(self, name='unnamed'):
         """TODO: DOC."""
         self.createdobj = ''  # Name of the corresponding object in blender
@@ -308,7 +329,7 @@ class Node(object):
         self.name = name
         self.parent = ''
         self.position = (0.0, 0.0, 0.0)
-        self.orientation = [0.0, 0.0, 0.0, 0.0]
+        self.orientation = (0.0, 0.0, 0.0, 0.0)
         self.scale = 1.0
         self.wirecolor = (1.0, 1.0, 1.0)
 
@@ -333,24 +354,10 @@ class Node(object):
         """TODO: DOC."""
         return self.name
 
-    def loadAsciiLine(self, itlines):
-        """TODO: DOC."""
-        line = None
-        try:
-            line = next(itlines)
-        except StopIteration:
-            return None
-        label = ''
-        try:
-            label = line[0].lower()
-        except (IndexError, AttributeError):
-            return line  # Probably empty line or comment
-        if nvb_utils.isNumber(label):
-            return line
+    def loadAsciiLine(self, label, line, block, count):
+        """Read a single record (line and attached values) of a node."""
         if label == 'node':
             self.name = nvb_utils.str2identifier(line[2])
-        elif label == 'endnode':
-            return line
         elif label == 'parent':
             self.parent = nvb_utils.str2identifier(line[1])
         elif label == 'position':
@@ -361,15 +368,6 @@ class Node(object):
             self.scale = float(line[1])
         elif label == 'wirecolor':
             self.wirecolor = tuple([float(v) for v in line[1:4]])
-        return line
-
-    def loadAscii(self, ascii_lines, nodeidx=-1):
-        """TODO: DOC."""
-        self.nodeidx = nodeidx
-        iterable = iter(ascii_lines)
-        line = True
-        while line is not None:
-            line = self.loadAsciiLine(iterable)
 
     def createObjectData(self, obj, options):
         """TODO: DOC."""
@@ -409,11 +407,15 @@ class Node(object):
     @classmethod
     def generateAscii(cls, obj, asciiLines, options, iswalkmesh=False):
         """TODO: Doc."""
-        node_name = nvb_utils.generate_node_name(obj, options.strip_trailing)
+        if options.export_plan:
+            node_name, parent_name = options.export_plan.get_names(obj)
+        else:
+            node_name = nvb_utils.generate_node_name(obj,
+                                                     options.strip_trailing)
+            parent_name = nvb_utils.generate_node_name(obj.parent,
+                                                       options.strip_trailing)
         asciiLines.append('node ' + cls.nodetype + ' ' + node_name)
         # Parent
-        parent_name = nvb_utils.generate_node_name(obj.parent,
-                                                   options.strip_trailing)
         asciiLines.append('  parent ' + parent_name)
 
         cls.generateAsciiData(obj, asciiLines, options, iswalkmesh)
@@ -425,15 +427,13 @@ class Dummy(Node):
 
     nodetype = nvb_def.Nodetype.DUMMY
 
+    __slots__ = ('emptytype',)
+
     def __init__(self, name='unnamed'):
         """TODO: Doc."""
         Node.__init__(self, name)
         self.emptytype = nvb_def.Emptytype.DUMMY
 
-    def loadAscii(self, asciiLines, nodeidx=-1):
-        """TODO: Doc."""
-        Node.loadAscii(self, asciiLines, nodeidx)
-
     def createObjectData(self, obj, options):
         """TODO: DOC."""
         Node.createObjectData(self, obj, options)
@@ -445,6 +445,8 @@ class Patch(Node):
 
     nodetype = nvb_def.Nodetype.PATCH
 
+    __slots__ = ('emptytype',)
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Node.__init__(self, name)
@@ -461,6 +463,8 @@ class Reference(Node):
 
     nodetype = nvb_def.Nodetype.REFERENCE
 
+    __slots__ = ('emptytype', 'refmodel', 'reattachable')
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Node.__init__(self, name)
@@ -469,16 +473,13 @@ class Reference(Node):
         self.refmodel = nvb_def.null
         self.reattachable = 0
 
-    def loadAsciiLine(self, itlines):
+    def loadAsciiLine(self, label, line, block, count):
         """TODO: Doc."""
-        line = Node.loadAsciiLine(self, itlines)
-        if line:
-            label = line[0].lower()
-            if label == 'refmodel':
-                self.refmodel = nvb_utils.str2identifier(line[1])
-            elif label == 'reattachable':
-                self.reattachable = nvb_utils.str2bool(line[1])
-        return line
+        Node.loadAsciiLine(self, label, line, block, count)
+        if label == 'refmodel':
+            self.refmodel = nvb_utils.str2identifier(line[1])
+        elif label == 'reattachable':
+            self.reattachable = nvb_utils.str2bool(line[1])
 
     def createObjectData(self, obj, options):
         """TODO: Doc."""
@@ -502,6 +503,11 @@ class Trimesh(Node):
 
     nodetype = nvb_def.Nodetype.TRIMESH
 
+    __slots__ = ('meshtype', 'center', 'tilefade', 'render', 'shadow',
+                 'beaming', 'inheritcolor', 'transparencyhint',
+                 'selfillumcolor', 'shininess', 'rotatetexture', 'material',
+                 'verts', 'facedef', 'tverts', 'tangents', 'normals', 'colors')
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Node.__init__(self, name)
@@ -518,147 +524,128 @@ class Trimesh(Node):
         self.shininess = 0
         self.rotatetexture = 0
         self.material = Material()
-        self.verts = []
-        self.facedef = []
-        self.tverts = [[]]
-        self.tangents = []
-        self.normals = []
-        self.colors = []
-
-    def loadAsciiLine(self, itlines):
+        self.verts = nvb_parse.empty_array(3)
+        self.facedef = nvb_parse.empty_array(8, numpy.int32)
+        self.tverts = [nvb_parse.empty_array(2)]
+        self.tangents = nvb_parse.empty_array(4)
+        self.normals = nvb_parse.empty_array(3)
+        self.colors = nvb_parse.empty_array(3)
+
+    def loadAsciiLine(self, label, line, block, count):
         """TODO: Doc."""
-        line = Node.loadAsciiLine(self, itlines)
-        if line:
-            label = line[0].lower()
-            if label == 'tilefade':
-                self.tilefade = int(line[1])
-            elif label == 'render':
-                self.render = nvb_utils.str2bool(line[1])
-            elif label == 'shadow':
-                self.shadow = nvb_utils.str2bool(line[1])
-            elif label == 'beaming':
-                self.beaming = int(line[1])
-            elif label == 'inheritcolor':
-                self.inheritcolor = int(line[1])
-            elif label == 'rotatetexture':
-                self.rotatetexture = int(line[1])
-            elif label == 'transparencyhint':
-                self.transparencyhint = int(line[1])
-            elif ((label == 'selfillumcolor') or
-                  (label == 'setfillumcolor')):
-                self.selfillumcolor = tuple([float(v) for v in line[1:4]])
-            elif label == 'shininess':
-                self.shininess = int(float(line[1]))
-            elif label == 'verts':
-                if not self.verts:
-                    nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.verts = [tuple(map(nvb_utils.str2float, v))
-                                  for v in tmp]
-            elif label == 'faces':
-                if not self.facedef:
-                    nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.facedef = [list(map(int, v)) for v in tmp]
-            elif label == 'normals':
-                if not self.normals:
-                    nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.normals = [tuple(map(nvb_utils.str2float, v))
-                                    for v in tmp]
-            elif label == 'tangents':
-                if not self.tangents:
-                    nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.tangents = [tuple(map(nvb_utils.str2float, v))
-                                     for v in tmp]
-            elif label == 'colors':
-                if not self.colors:
-                    nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.colors = [tuple(map(float, v)) for v in tmp]
-            elif label.startswith('tverts'):
-                tvid = 0
-                if label[6:]:  # might be '', which we interpret as 0
-                    tvid = int(label[6:])
-                    tvcnt = len(self.tverts)
-                    if tvid+1 > tvcnt:
-                        self.tverts.extend([[] for _ in range(tvid-tvcnt+1)])
-                if not self.tverts[tvid]:
-                    nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.tverts[tvid] = [(float(v[0]), float(v[1]))
-                                         for v in tmp]
-            else:
-                self.material.loadAsciiLine(line)
-        return line
+        Node.loadAsciiLine(self, label, line, block, count)
+        if label == 'tilefade':
+            self.tilefade = int(line[1])
+        elif label == 'render':
+            self.render = nvb_utils.str2bool(line[1])
+        elif label == 'shadow':
+            self.shadow = nvb_utils.str2bool(line[1])
+        elif label == 'beaming':
+            self.beaming = int(line[1])
+        elif label == 'inheritcolor':
+            self.inheritcolor = int(line[1])
+        elif label == 'rotatetexture':
+            self.rotatetexture = int(line[1])
+        elif label == 'transparencyhint':
+            self.transparencyhint = int(line[1])
+        elif ((label == 'selfillumcolor') or
+              (label == 'setfillumcolor')):
+            self.selfillumcolor = tuple([float(v) for v in line[1:4]])
+        elif label == 'shininess':
+            self.shininess = int(float(line[1]))
+        elif label == 'verts':
+            if not len(self.verts):
+                self.verts = nvb_parse.read_array(block, count, 3)
+        elif label == 'faces':
+            if not len(self.facedef):
+                self.facedef = nvb_parse.read_array(block, count, 8,
+                                                    numpy.int32)
+        elif label == 'normals':
+            if not len(self.normals):
+                self.normals = nvb_parse.read_array(block, count, 3)
+        elif label == 'tangents':
+            if not len(self.tangents):
+                self.tangents = nvb_parse.read_array(block, count, 4)
+        elif label == 'colors':
+            if not len(self.colors):
+                self.colors = nvb_parse.read_array(block, count, 3)
+        elif label.startswith('tverts'):
+            tvid = 0
+            if label[6:]:  # might be '', which we interpret as 0
+                tvid = int(label[6:])
+                tvcnt = len(self.tverts)
+                if tvid+1 > tvcnt:
+                    self.tverts.extend([nvb_parse.empty_array(2)
+                                        for _ in range(tvid-tvcnt+1)])
+            if not len(self.tverts[tvid]):
+                self.tverts[tvid] = nvb_parse.read_array(block, count, 2)
+        else:
+            self.material.loadAsciiLine(line)
 
     def fix_degenerated_uvs(self):
         """Fixes degenerated UVs by adding dummy coordinates."""
         def distance(p0, p1):
-            """Euclidean Distance."""
-            return math.sqrt(sum([(a - b)**2 for a, b in list(zip(p0, p1))]))
+            """Euclidean Distance, per face."""
+            return numpy.sqrt(numpy.sum((p0 - p1)**2, axis=1),
+                              dtype=numpy.float64)
 
         tvert_cnt = len(self.tverts[0])
         if tvert_cnt > 0:
-            add_dummy_uvs = False
-            for f in self.facedef:
-                uvs = self.tverts[0][f[4]], \
-                      self.tverts[0][f[5]], \
-                      self.tverts[0][f[6]]
-                min_distance = distance(uvs[0], uvs[1])
-                for p0, p1 in itertools.combinations(uvs, 2):
-                    min_distance = min(min_distance, distance(p0, p1))
-                # tverts are too close == degenerated
-                if min_distance <= 0.001:
-                    add_dummy_uvs = True
-                    f[4], f[5], f[6] = tvert_cnt, tvert_cnt + 1, tvert_cnt + 2
-            if add_dummy_uvs:
-                self.tverts[0].extend([(0, 0), (0, 1), (1, 1)])
+            uvs = self.tverts[0][self.facedef[:, 4:7]]  # (faces, 3, 2)
+            # Smallest distance between two uvs of a face (nan only counts
+            # for the first pair, like python's min)
+            min_distance = distance(uvs[:, 0], uvs[:, 1])
+            for d in (distance(uvs[:, 0], uvs[:, 2]),
+                      distance(uvs[:, 1], uvs[:, 2])):
+                min_distance = numpy.where(d < min_distance, d, min_distance)
+            # tverts are too close == degenerated
+            degenerated = min_distance <= 0.001
+            if degenerated.any():
+                self.facedef[degenerated, 4:7] = \
+                    (tvert_cnt, tvert_cnt + 1, tvert_cnt + 2)
+                dummy_uvs = numpy.array([(0, 0), (0, 1), (1, 1)],
+                                        self.tverts[0].dtype)
+                self.tverts[0] = numpy.concatenate((self.tverts[0],
+                                                    dummy_uvs))
 
     @staticmethod
     def createUVlayer(mesh, tverts, faceuvs, uvname, uvimg=None):
         """TODO: Doc."""
         uvmap = None
 
-        if tverts and mesh.tessfaces:
-            uvmap = mesh.tessface_uv_textures.new(uvname)
-            mesh.tessface_uv_textures.active = uvmap
-            # Set uv's
-            for i in range(len(faceuvs)):
-                tessfaceUV = uvmap.data[i]
-                tessfaceUV.uv1 = tverts[faceuvs[i][0]]
-                tessfaceUV.uv2 = tverts[faceuvs[i][1]]
-                tessfaceUV.uv3 = tverts[faceuvs[i][2]]
-                tessfaceUV.image = uvimg
+        if len(tverts) > 0 and mesh.polygons:
+            uvmap = mesh.uv_textures.new(uvname)
+            mesh.uv_textures.active = uvmap
+            # Set uv's, faces are triangles with one loop per corner
+            loop_uvs = numpy.asarray(tverts, numpy.float32)[
+                numpy.ravel(faceuvs)]
+            mesh.uv_layers[uvmap.name].data.foreach_set('uv',
+                                                        loop_uvs.ravel())
+            if uvimg:
+                for texpoly in uvmap.data:
+                    texpoly.image = uvimg
         return uvmap
 
     @staticmethod
     def createVColors(mesh, vcolors, vcname):
         """Create a color map from a per-vertex color list for the mesh."""
         cmap = None
-        if vcolors:
+        if len(vcolors) > 0:
             cmap = mesh.vertex_colors.new(vcname)
-            # Get all loops for each vertex
-            vert_loop_map = {}
-            for l in mesh.loops:
-                if l.vertex_index in vert_loop_map:
-                    vert_loop_map[l.vertex_index].append(l.index)
-                else:
-                    vert_loop_map[l.vertex_index] = [l.index]
+            if not mesh.loops:
+                return cmap
+            # Get the vertex of each loop
+            loop_vids = numpy.empty(len(mesh.loops), numpy.int32)
+            mesh.loops.foreach_get('vertex_index', loop_vids)
             # Set color for each vertex (in every loop)
             # BUGFIX: colors have dim 4 on some systems
             #         (should be 3 as per documentation)
             color_dim = len(cmap.data[0].color)
-            if color_dim > 3:
-                for vidx in vert_loop_map:
-                    for lidx in vert_loop_map[vidx]:
-                        cmap.data[lidx].color = \
-                            (*vcolors[vidx], *[0]*(color_dim-3))
-            else:  # Keep the right way separate for speed
-                for vidx in vert_loop_map:
-                    for lidx in vert_loop_map[vidx]:
-                        cmap.data[lidx].color = vcolors[vidx]
+            loop_colors = numpy.zeros((len(loop_vids), color_dim),
+                                      numpy.float32)
+            loop_colors[:, :3] = numpy.asarray(vcolors, numpy.float32)[
+                loop_vids]
+            cmap.data.foreach_set('color', loop_colors.ravel())
         return cmap
 
     def createMesh(self, name, options):
@@ -669,14 +656,22 @@ class Trimesh(Node):
         me = bpy.data.meshes.new(name)
         # Create vertices
         me.vertices.add(len(self.verts))
-        me.vertices.foreach_set('co', unpack_list(self.verts))
+        me.vertices.foreach_set('co', self.verts.ravel())
         # Create per-Vertex normals
-        if self.normals and options.import_normals:
-            me.vertices.foreach_set('normal', unpack_list(self.normals))
-        # Create faces
-        face_vids = [v[0:3] for v in self.facedef]
-        me.tessfaces.add(len(face_vids))
-        me.tessfaces.foreach_set('vertices_raw', unpack_face_list(face_vids))
+        if len(self.normals) > 0 and options.import_normals:
+            me.vertices.foreach_set('normal', self.normals.ravel())
+        # Create faces, loops are kept in the order of the face definition
+        face_vids = self.facedef[:, :3]  # face vertex indices
+        face_cnt = len(face_vids)
+        me.polygons.add(face_cnt)
+        me.loops.add(face_cnt * 3)
+        me.polygons.foreach_set('loop_start',
+                                numpy.arange(0, face_cnt * 3, 3,
+                                             dtype=numpy.int32))
+        me.polygons.foreach_set('loop_total',
+                                numpy.full(face_cnt, 3, numpy.int32))
+        me.loops.foreach_set('vertex_index', face_vids.ravel())
+        me.update(calc_edges=True)
         # Create material
         material = None
         matimg = None
@@ -686,74 +681,64 @@ class Trimesh(Node):
             if material:
                 me.materials.append(material)
                 # Set material idx (always 0, only a single material)
-                me.tessfaces.foreach_set('material_index',
-                                         [0] * len(me.tessfaces))
+                me.polygons.foreach_set('material_index',
+                                        numpy.zeros(face_cnt, numpy.int32))
                 tslot0 = material.texture_slots[0]
                 if tslot0 and tslot0.texture:
                     matimg = tslot0.texture.image
         # Create uvmaps
-        # EEEKADOODLE fix
-        eeka_faceuvs = [(f[5], f[6], f[4]) if f[2] == 0 else (f[4], f[5], f[6])
-                        for f in self.facedef]
-        # Save fixed uvs for animeshes
+        face_uvs = self.facedef[:, 4:7]  # face tvert indices
+        # Save uv order for animeshes
         if self.nodetype == nvb_def.Nodetype.ANIMMESH:
             if me.name not in nvb_def.tvert_order:
-                nvb_def.tvert_order[me.name] = copy.deepcopy(eeka_faceuvs)
+                nvb_def.tvert_order[me.name] = face_uvs.tolist()
         # Iterate in reverse so the first uvmap can be set to active
         uvmap = None
         for idx, tvs in reversed(list(enumerate(self.tverts))):
-            if tvs:  # may be []
+            if len(tvs) > 0:  # may be empty
                 uvname = 'tvert' + str(idx)
-                uvmap = Trimesh.createUVlayer(me, tvs, eeka_faceuvs,
+                uvmap = Trimesh.createUVlayer(me, tvs, face_uvs,
                                               uvname, matimg)
         if uvmap:
             me.uv_textures[uvmap.name].active = True  # blender 2.8 error!
         # Import smooth groups as sharp edges
-        if options.importSmoothGroups:
-            me.update()
+        if options.importSmoothGroups and me.loops:
             me.show_edge_sharp = True
-            bm = bmesh.new()
-            bm.from_mesh(me)
-            if hasattr(bm.edges, "ensure_lookup_table"):
-                bm.edges.ensure_lookup_table()
-            # Mark edge as sharp if its faces belong to different smooth groups
-            for e in bm.edges:
-                f = e.link_faces
-                if (len(f) > 1) and \
-                   (self.facedef[f[0].index][3] !=
-                        self.facedef[f[1].index][3]):
-                    edgeIdx = e.index
-                    me.edges[edgeIdx].use_edge_sharp = True
-            bm.free()
-            del bm
+            # Mark edge as sharp if its faces belong to different smooth
+            # groups. Each loop links an edge to a face (three loops per face)
+            loop_edges = numpy.empty(len(me.loops), numpy.int32)
+            me.loops.foreach_get('edge_index', loop_edges)
+            loop_groups = numpy.repeat(self.facedef[:, 3], 3)
+            edge_cnt = len(me.edges)
+            group_min = numpy.full(edge_cnt, numpy.iinfo(numpy.int32).max,
+                                   numpy.int32)
+            group_max = numpy.full(edge_cnt, numpy.iinfo(numpy.int32).min,
+                                   numpy.int32)
+            numpy.minimum.at(group_min, loop_edges, loop_groups)
+            numpy.maximum.at(group_max, loop_edges, loop_groups)
+            me.edges.foreach_set('use_edge_sharp', group_min < group_max)
         # Import custom normals
-        me.update()
-        if self.normals and me.loops and options.import_normals:
-            # Use normals for shading
-            # TODO: Test this... faster?
-            # me.normals_split_custom_set_from_vertices(self.normals)
-            for l in me.loops:
-                l.normal[:] = self.normals[l.vertex_index]
-            me.validate(clean_customdata=False)
-            clnors = array.array('f', [0.0] * (len(me.loops) * 3))
-            me.loops.foreach_get('normal', clnors)
-            me.create_normals_split()
-            me.normals_split_custom_set(tuple(zip(*(iter(clnors),) * 3)))
-            me.polygons.foreach_set('use_smooth', [True] * len(me.polygons))
+        if len(self.normals) > 0 and me.loops and options.import_normals:
+            # Use normals for shading. Faces have to be smooth before the
+            # custom normals are set, they are stored relative to the
+            # automatic normals
+            me.polygons.foreach_set('use_smooth', numpy.ones(face_cnt, bool))
             me.use_auto_smooth = True
             me.show_edge_sharp = True
+            me.create_normals_split()
+            me.normals_split_custom_set_from_vertices(self.normals)
         elif options.importSmoothGroups:
             # Use shading groups for shading
-            sgr_list = set([fd[3] for fd in self.facedef])
+            sgr_list = set(self.facedef[:, 3].tolist())
             if len(sgr_list) == 1 and sgr_list.pop() == 0:
                 # single smoothgroup 0 means non-smooth
                 me.polygons.foreach_set('use_smooth',
-                                        [False] * len(me.polygons))
+                                        numpy.zeros(face_cnt, bool))
                 me.use_auto_smooth = False
                 me.auto_smooth_angle = 0.523599
             else:
                 me.polygons.foreach_set('use_smooth',
-                                        [True] * len(me.polygons))
+                                        numpy.ones(face_cnt, bool))
                 me.use_auto_smooth = True
                 me.auto_smooth_angle = 1.570796
         # Create Vertex colors
@@ -874,7 +859,7 @@ class Trimesh(Node):
                         vcolors[vidx] = cmap.data[lidx].color[:3]
                 asciiLines.append('  colors ' + str(len(mesh.vertices)))
                 fstr = '    {: 8.5f} {: 8.5f} {: 8.5f}'
-                asciiLines.extend([fstr.format(*vc) for vc in vcolors])
+                asciiLines.extend(nvb_format.format_rows(fstr, vcolors))
 
         def generateNormals(mesh, asciiLines, uvmap):
             """Generates normals and tangents."""
@@ -896,7 +881,8 @@ class Trimesh(Node):
             if mdl_normals.count(None) == 0:
                 asciiLines.append('  normals ' + str(len(mdl_normals)))
                 fstr = '    {: 8.5f} {: 8.5f} {: 8.5f}'
-                asciiLines.extend([fstr.format(*n) for n in mdl_normals])
+                asciiLines.extend(nvb_format.format_rows(
+                    fstr, [n[:] for n in mdl_normals]))
             else:
                 print("Neverblender - WARNING: Invalid normals for mesh " +
                       mesh.name)
@@ -908,8 +894,8 @@ class Trimesh(Node):
             if mdl_tangents.count(None) == 0:
                 asciiLines.append('  tangents ' + str(len(mdl_tangents)))
                 fstr = '    {: 8.5f} {: 8.5f} {: 8.5f} {: 3.1f}'
-                asciiLines.extend([fstr.format(*t[0], t[1])
-                                  for t in mdl_tangents])
+                asciiLines.extend(nvb_format.format_rows(
+                    fstr, [[*t[0], t[1]] for t in mdl_tangents]))
             else:
                 print("Neverblender - WARNING: Invalid tangents for mesh " +
                       mesh.name)
@@ -931,8 +917,11 @@ class Trimesh(Node):
         fcSGrps = getSmoothGroups(obj, me, options)
         # Add vertices
         asciiLines.append('  verts ' + str(len(me.vertices)))
+        vertex_co = numpy.empty(len(me.vertices) * 3, numpy.float32)
+        me.vertices.foreach_get('co', vertex_co)
         fstr = '    {: 8.5f} {: 8.5f} {: 8.5f}'
-        asciiLines.extend([fstr.format(*v.co) for v in me.vertices])
+        asciiLines.extend(nvb_format.format_rows(fstr,
+                                                 vertex_co.reshape(-1, 3)))
         # Add normals and tangents
         uvmap = me.uv_textures.active
         if uvmap and options.export_normals and obj.nvb.render:
@@ -997,7 +986,8 @@ class Trimesh(Node):
                 else:
                     asciiLines.append('  tverts' + str(idx) + ' ' +
                                       str(len(fuvd[1])))
-                asciiLines.extend([fstr.format(v[0], v[1]) for v in fuvd[1]])
+                asciiLines.extend(nvb_format.format_rows(
+                    fstr, [v[:2] for v in fuvd[1]]))
         # Vertex color
         generateVColors(me, asciiLines)
         # Write faces to file
@@ -1014,7 +1004,7 @@ class Trimesh(Node):
                '{:' + sdigs + 'd}  ' + \
                '{:' + udigs + 'd} {:' + udigs + 'd} {:' + udigs + 'd}  ' + \
                '{:' + mdigs + 'd}'
-        asciiLines.extend([fstr.format(*f) for f in faces])
+        asciiLines.extend(nvb_format.format_rows(fstr, faces))
         bpy.data.meshes.remove(me)
 
     @classmethod
@@ -1070,6 +1060,8 @@ class Animmesh(Trimesh):
 
     nodetype = nvb_def.Nodetype.ANIMMESH
 
+    __slots__ = ()
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Trimesh.__init__(self, name)
@@ -1081,6 +1073,8 @@ class Danglymesh(Trimesh):
 
     nodetype = nvb_def.Nodetype.DANGLYMESH
 
+    __slots__ = ('period', 'tightness', 'displacement', 'constraints')
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Trimesh.__init__(self, name)
@@ -1091,23 +1085,19 @@ class Danglymesh(Trimesh):
         self.displacement = 1.0
         self.constraints = []
 
-    def loadAsciiLine(self, itlines):
+    def loadAsciiLine(self, label, line, block, count):
         """TODO: Doc."""
-        line = Trimesh.loadAsciiLine(self, itlines)
-        if line:
-            label = line[0].lower()
-            if label == 'period':
-                self.period = float(line[1])
-            elif label == 'tightness':
-                self.tightness = float(line[1])
-            elif label == 'displacement':
-                self.displacement = float(line[1])
-            elif label == 'constraints':
-                if not self.constraints:
-                    vcnt = int(line[1])
-                    tmp = [next(itlines) for _ in range(vcnt)]
-                    self.constraints = [float(v[0]) for v in tmp]
-        return line
+        Trimesh.loadAsciiLine(self, label, line, block, count)
+        if label == 'period':
+            self.period = float(line[1])
+        elif label == 'tightness':
+            self.tightness = float(line[1])
+        elif label == 'displacement':
+            self.displacement = float(line[1])
+        elif label == 'constraints':
+            if not self.constraints:
+                self.constraints = [float(v[0])
+                                    for v in nvb_parse.split_rows(block)]
 
     def createConstraints(self, obj):
         """Create a vertex group for the object."""
@@ -1139,7 +1129,8 @@ class Danglymesh(Trimesh):
             print('Neverblender: WARNING - No constraints for danglymesh ' +
                   obj.name)
             weights = [0] * len(obj.data.vertices)
-            asciiLines.extend(['    {: 5.1f}'.format(w) for w in weights])
+            asciiLines.extend(nvb_format.format_values('    {: 5.1f}',
+                                                       weights))
             return
         vg = obj.vertex_groups[vg_name]
         vg_idx = vg.index
@@ -1149,7 +1140,7 @@ class Danglymesh(Trimesh):
         asciiLines.append('  constraints ' + str(len(weights)))
         for i in vg_members:
             weights[i] = vg.weight(i)*255
-        asciiLines.extend(['    {: 5.1f}'.format(w) for w in weights])
+        asciiLines.extend(nvb_format.format_values('    {: 5.1f}', weights))
 
     @classmethod
     def generateAsciiData(cls, obj, asciiLines, options, iswalkmesh=False):
@@ -1169,6 +1160,8 @@ class Skinmesh(Trimesh):
 
     nodetype = nvb_def.Nodetype.SKIN
 
+    __slots__ = ('weights',)
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Trimesh.__init__(self, name)
@@ -1204,16 +1197,12 @@ class Skinmesh(Trimesh):
                     name_weight_pairs.append([n, w])
             self.weights.append(name_weight_pairs)
 
-    def loadAsciiLine(self, itlines):
+    def loadAsciiLine(self, label, line, block, count):
         """TODO: Doc."""
-        line = Trimesh.loadAsciiLine(self, itlines)
-        if line:
-            label = line[0].lower()
-            if label == 'weights':
-                cnt = int(line[1])
-                tmp = [next(itlines) for _ in range(cnt)]
-                self.loadAsciiWeights(tmp)
-        return line
+        Trimesh.loadAsciiLine(self, label, line, block, count)
+        if label == 'weights':
+            self.loadAsciiWeights(
+                nvb_parse.split_rows(nvb_parse.decode(block)))
 
     def createSkinGroups(self, obj):
         """TODO: Doc."""
@@ -1255,13 +1244,17 @@ class Skinmesh(Trimesh):
         skingroups = {vg.index: vg.name for vg in obj.vertex_groups
                       if vg.name in bpy.data.objects}
         ascii_lines.append('  weights ' + str(len(obj.data.vertices)))
-        fstr = '{} {:5.3f}'
+        vertex_weights = []
         for v in obj.data.vertices:
             weights = [[skingroups[g.group], g.weight] for g in v.groups
                        if g.group in skingroups]
-            weights = clean_weights(weights)
-            ascii_lines.append('    ' + ' '.join([fstr.format(*w)
-                                                  for w in weights]))
+            vertex_weights.append(clean_weights(weights))
+        # Format all weight values at once, then pair them with the names
+        values = iter(nvb_format.format_values(
+            '{:5.3f}', [w[1] for weights in vertex_weights for w in weights]))
+        ascii_lines.extend(['    ' + ' '.join([w[0] + ' ' + next(values)
+                                               for w in weights])
+                            for weights in vertex_weights])
 
     @classmethod
     def generateAsciiData(cls, obj, asciiLines, options, iswalkmesh=False):
@@ -1357,6 +1350,9 @@ class Emitter(Node):
                       'punch_through': 'Punch_Through',
                       'lighten': 'Lighten'}
 
+    __slots__ = ('meshtype', 'xsize', 'ysize', 'blender_data',
+                 'blender_data_nvb')
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Node.__init__(self, name)
@@ -1367,24 +1363,21 @@ class Emitter(Node):
         self.blender_data = []
         self.blender_data_nvb = []
 
-    def loadAsciiLine(self, itlines):
+    def loadAsciiLine(self, label, line, block, count):
         """TODO: Doc."""
-        line = Node.loadAsciiLine(self, itlines)
-        if line:
-            label = line[0].lower()
-            if label == 'xsize':  # emitter mesh size (in cm)
-                self.xsize = float(line[1])
-            elif label == 'ysize':  # emitter mesh size (in cm)
-                self.ysize = float(line[1])
-            else:
-                if label in type(self).property_dict:
-                    data_path, dim, convert, _ = self.property_dict[label]
-                    if dim > 1:
-                        value = tuple(list(map(convert, line[1:dim+1])))
-                    else:
-                        value = convert(line[1].lower())
-                    self.blender_data.append((data_path, value))
-        return line
+        Node.loadAsciiLine(self, label, line, block, count)
+        if label == 'xsize':  # emitter mesh size (in cm)
+            self.xsize = float(line[1])
+        elif label == 'ysize':  # emitter mesh size (in cm)
+            self.ysize = float(line[1])
+        else:
+            if label in type(self).property_dict:
+                data_path, dim, convert, _ = self.property_dict[label]
+                if dim > 1:
+                    value = tuple(list(map(convert, line[1:dim+1])))
+                else:
+                    value = convert(line[1].lower())
+                self.blender_data.append((data_path, value))
 
     def create_particle_system(self, obj, options):
         part_mod = obj.modifiers.new(name='particles', type='PARTICLE_SYSTEM')
@@ -1566,6 +1559,12 @@ class Light(Node):
 
     nodetype = nvb_def.Nodetype.LIGHT
 
+    __slots__ = ('shadow', 'radius', 'multiplier', 'lightpriority', 'color',
+                 'ambientonly', 'ndynamictype', 'isdynamic', 'affectdynamic',
+                 'negativelight', 'fadinglight', 'lensflares', 'flareradius',
+                 'flareTextures', 'flareSizes', 'flarePositions',
+                 'flareCShifts')
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Node.__init__(self, name)
@@ -1583,105 +1582,56 @@ class Light(Node):
         self.fadinglight = 1
         self.lensflares = 0
         self.flareradius = 1.0
-        self.flareNumValues = [0, 0, 0, 0]
         self.flareTextures = []
         self.flareSizes = []
         self.flarePositions = []
         self.flareCShifts = []  # Flare color shifts
 
-    def loadAsciiLine(self, itlines):
+    def loadAsciiLine(self, label, line, block, count):
         """TODO: Doc."""
-        aline = Node.loadAsciiLine(self, itlines)
-        if not aline:
-            return aline
-        try:
-            label = aline[0].lower()
-        except (IndexError, AttributeError):
-            return aline  # Probably empty line, skip it
+        Node.loadAsciiLine(self, label, line, block, count)
         if (label == 'radius'):
-            self.radius = float(aline[1])
+            self.radius = float(line[1])
         elif (label == 'shadow'):
-            self.shadow = nvb_utils.str2bool(aline[1])
+            self.shadow = nvb_utils.str2bool(line[1])
         elif (label == 'multiplier'):
-            self.multiplier = float(aline[1])
+            self.multiplier = float(line[1])
         elif (label == 'color'):
-            self.color = tuple([float(v) for v in aline[1:4]])
+            self.color = tuple([float(v) for v in line[1:4]])
         elif (label == 'ambientonly'):
-            self.ambientonly = int(aline[1])
+            self.ambientonly = int(line[1])
         elif (label == 'isdynamic'):
-            self.isdynamic = int(aline[1])
+            self.isdynamic = int(line[1])
         elif (label == 'ndynamictype'):
-            self.ndynamictype = int(aline[1]) 
+            self.ndynamictype = int(line[1])
         elif (label == 'affectdynamic'):
-            self.affectdynamic = int(aline[1])
+            self.affectdynamic = int(line[1])
         elif (label == 'negativelight'):
-            self.negativelight = int(aline[1])
+            self.negativelight = int(line[1])
         elif (label == 'lightpriority'):
-            self.lightpriority = int(aline[1])
+            self.lightpriority = int(line[1])
         elif (label == 'fadinglight'):
-            self.fadinglight = int(aline[1])
+            self.fadinglight = int(line[1])
         elif (label == 'lensflares'):
-            self.lensflares = int(aline[1])
+            self.lensflares = int(line[1])
         elif (label == 'flareradius'):
-            self.flareradius = float(aline[1])
+            self.flareradius = float(line[1])
         elif (label == 'texturenames'):
             if not self.flareTextures:
-                vcnt = self.flareNumValues[0]
-                tmp = [next(itlines) for _ in range(vcnt)]
-                self.flareTextures = [v[0] for v in tmp]
+                self.flareTextures = [nvb_parse.decode(v[0])
+                                      for v in nvb_parse.split_rows(block)]
         elif (label == 'flaresizes'):
             if not self.flareSizes:
-                vcnt = self.flareNumValues[1]
-                tmp = [next(itlines) for _ in range(vcnt)]
-                self.flareSizes = [float(v[0]) for v in tmp]
+                self.flareSizes = [float(v[0])
+                                   for v in nvb_parse.split_rows(block)]
         elif (label == 'flarepositions'):
             if not self.flarePositions:
-                vcnt = self.flareNumValues[2]
-                tmp = [next(itlines) for _ in range(vcnt)]
-                self.flarePositions = [float(v[0]) for v in tmp]
+                self.flarePositions = [float(v[0])
+                                       for v in nvb_parse.split_rows(block)]
         elif (label == 'flarecolorshifts'):
             if not self.flareCShifts:
-                vcnt = self.flareNumValues[3]
-                tmp = [next(itlines) for _ in range(vcnt)]
-                self.flareCShifts = [tuple(map(float, v)) for v in tmp]
-        return aline
-
-    def loadNumFlareValues(self, asciiLines):
-        """Get the number of values for flares."""
-        l_isNumber = nvb_utils.isNumber
-        for idx, aline in enumerate(asciiLines):
-            try:
-                label = aline[0].lower()
-            except (IndexError, AttributeError):
-                return aline  # Probably empty line or comment
-            if not nvb_utils.isNumber(label):
-                if (label == 'texturenames'):
-                    # Can't do anything here
-                    pass
-                elif (label == 'flaresizes'):
-                    vcnt = next((i for i, v in enumerate(asciiLines[idx+1:])
-                                if not l_isNumber(v[0])), -1)
-                    self.flareNumValues[1] = vcnt
-                elif (label == 'flarepositions'):
-                    vcnt = next((i for i, v in enumerate(asciiLines[idx+1:])
-                                if not l_isNumber(v[0])), -1)
-                    self.flareNumValues[2] = vcnt
-                elif (label == 'flarecolorshifts'):
-                    vcnt = next((i for i, v in enumerate(asciiLines[idx+1:])
-                                if not l_isNumber(v[0])), -1)
-                    self.flareNumValues[3] = vcnt
-        self.flareNumValues[0] = min(self.flareNumValues[1:])
-
-    def loadAscii(self, asciiLines, nodeidx=-1):
-        """TODO: DOC."""
-        self.nodeidx = nodeidx
-        #  Need to do two passes. First one is to find the number of flares
-        aline = self.loadNumFlareValues(asciiLines)
-        # Second pass to get the values
-        iterable = iter(asciiLines)
-        aline = True
-        while aline is not None:
-            aline = self.loadAsciiLine(iterable)
+                self.flareCShifts = [tuple(map(float, v))
+                                     for v in nvb_parse.split_rows(block)]
 
     def createLamp(self, name):
         """TODO: Doc."""
@@ -1716,7 +1666,8 @@ class Light(Node):
                not options.render_lights:
                 obj.hide_render = True
             # Create lensflares
-            numflares = min(self.flareNumValues)
+            numflares = min(len(self.flareTextures), len(self.flareSizes),
+                            len(self.flarePositions), len(self.flareCShifts))
             if (self.flareradius > 0) or (numflares > 0):
                 data.nvb.uselensflares = True
                 for i in range(numflares):
@@ -1783,11 +1734,28 @@ class Aabb(Trimesh):
 
     nodetype = nvb_def.Nodetype.AABB
 
+    __slots__ = ('aabb_tree',)
+
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Trimesh.__init__(self, name)
         self.meshtype = nvb_def.Meshtype.AABB
 
+        # AABB tree in depth first order, one row per tree node:
+        # bbox min (3), bbox max (3), face index (-1 for inner nodes)
+        self.aabb_tree = nvb_parse.empty_array(7)
+
+    def loadAsciiLine(self, label, line, block, count):
+        """TODO: Doc."""
+        Trimesh.loadAsciiLine(self, label, line, block, count)
+        if label == 'aabb':
+            if not len(self.aabb_tree):
+                tree = nvb_parse.read_array(block, count, 7)
+                if len(line) >= 8:  # First row follows the label
+                    root = nvb_parse.read_array(' '.join(line[1:8]), 1, 7)
+                    tree = numpy.concatenate([root, tree])
+                self.aabb_tree = tree
+
     @staticmethod
     def generateAsciiAABB(obj, asciiLines, options):
         """TODO: Doc."""
@@ -1856,7 +1824,7 @@ class Aabb(Trimesh):
             fstr = '    ' + \
                    '{: 5.2f} {: 5.2f} {: 5.2f}  ' + \
                    '{: 5.2f} {: 5.2f} {: 5.2f} {: 3d}'
-            asciiLines.extend([fstr.format(*bb) for bb in aabbTree])
+            asciiLines.extend(nvb_format.format_rows(fstr, aabbTree))
 
     @classmethod
     def generateAsciiData(cls, obj, asciiLines, options, iswalkmesh=True):
@@ -1872,20 +1840,20 @@ class Aabb(Trimesh):
         me = bpy.data.meshes.new(name)
         # Create vertices
         me.vertices.add(len(self.verts))
-        me.vertices.foreach_set('co', unpack_list(self.verts))
+        me.vertices.foreach_set('co', self.verts.ravel())
         # Create faces
-        face_vids = [v[0:3] for v in self.facedef]  # face vertex indices
+        face_vids = self.facedef[:, :3]  # face vertex indices
         face_cnt = len(face_vids)
         me.polygons.add(face_cnt)
         me.loops.add(face_cnt * 3)
         me.polygons.foreach_set('loop_start', range(0, face_cnt * 3, 3))
         me.polygons.foreach_set('loop_total', (3,) * face_cnt)
-        me.loops.foreach_set('vertex_index', unpack_list(face_vids))
+        me.loops.foreach_set('vertex_index', face_vids.ravel())
         nvb_utils.create_wok_materials(me)
         me.update()
         # Apply the walkmesh materials to each face
-        me.polygons.foreach_set('material_index',
-                                [f[7] for f in self.facedef])
+        me.polygons.foreach_set('material_index', numpy.ascontiguousarray(
+            self.facedef[:, 7], dtype=numpy.int32))
         return me
 
     def createMeshOLD(self, name, options):
@@ -1894,9 +1862,9 @@ class Aabb(Trimesh):
         me = bpy.data.meshes.new(name)
         # Create vertices
         me.vertices.add(len(self.verts))
-        me.vertices.foreach_set('co', unpack_list(self.verts))
+        me.vertices.foreach_set('co', self.verts.ravel())
         # Create faces
-        face_vids = [v[0:3] for v in self.facedef]
+        face_vids = self.facedef[:, :3]
         me.tessfaces.add(len(face_vids))
         me.tessfaces.foreach_set('vertices_raw', unpack_face_list(face_vids))
         # Create materials
@@ -1915,8 +1883,8 @@ class Aabb(Trimesh):
             me.materials.append(material)
         me.update()
         # Apply the walkmesh materials to each face
-        me.polygons.foreach_set('material_index',
-                                [f[7] for f in self.facedef])
+        me.polygons.foreach_set('material_index', numpy.ascontiguousarray(
+            self.facedef[:, 7], dtype=numpy.int32))
         return me
 
     def createObject(self, options):
@@ -2,10 +2,14 @@
 
 import os
 import math
+import copy
 import bpy
 import bpy_extras
 
 from . import nvb_mdl
+from . import nvb_export
+from . import nvb_catalog
+from . import nvb_cache
 from . import nvb_mtr
 from . import nvb_def
 from . import nvb_utils
@@ -40,6 +44,13 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
             name='Export Normals and Tangents',
             description='Add normals and tangents to MDL',
             default=False)
+    export_binary = bpy.props.BoolProperty(
+            name='Compile',
+            description='Write compiled (binary) MDL and walkmesh files. '
+                        'Values are compiled from the ascii export, so '
+                        'they keep its precision (e.g. 5 decimals for '
+                        'positions, 3 for uvs)',
+            default=False)
     # UV Map Export settings
     uv_autojoin = bpy.props.BoolProperty(
             name='Auto Join UVs',
@@ -149,21 +160,31 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
             options.filepath = mdl_path
             options.classification = mdl_base.nvb.classification
             # Export MDL
-            ascii_lines = []
-            nvb_mdl.Mdl.generateAscii(mdl_base, ascii_lines, options)
-            with open(os.fsencode(options.filepath), 'w') as f:
-                f.write('\n'.join(ascii_lines))
+            if options.export_binary:  # Compiled from the streamed lines
+                nvb_export.write_compiled(
+                    options.filepath,
+                    lambda lines: nvb_mdl.Mdl.generateAscii(
+                        mdl_base, lines, options),
+                    nvb_mdl.Mdl.compile_ascii)
+            else:  # Lines are written node by node
+                with nvb_export.LineWriter(options.filepath) as ascii_lines:
+                    nvb_mdl.Mdl.generateAscii(mdl_base, ascii_lines, options)
             # Export walkmesh for MDL
             if options.export_walkmesh:
                 wkm_type = get_walkmeshtype(mdl_base)
                 wkm_ext = '.' + wkm_type
-                ascii_lines = []
-                nvb_mdl.Mdl.generateAsciiWalkmesh(mdl_base, ascii_lines,
-                                                  wkm_type, options)
-                if ascii_lines:
-                    wkm_path = get_filepath(mdl_path, wkm_name, wkm_ext)
-                    with open(os.fsencode(wkm_path), 'w') as f:
-                        f.write('\n'.join(ascii_lines))
+                wkm_path = get_filepath(mdl_path, wkm_name, wkm_ext)
+                if options.export_binary:
+                    nvb_export.write_compiled(
+                        wkm_path,
+                        lambda lines: nvb_mdl.Mdl.generateAsciiWalkmesh(
+                            mdl_base, lines, wkm_type, options),
+                        lambda data: nvb_mdl.Mdl.compile_ascii_wkm(
+                            data, wkm_type))
+                else:  # No file is created if there is no walkmesh
+                    with nvb_export.LineWriter(wkm_path) as ascii_lines:
+                        nvb_mdl.Mdl.generateAsciiWalkmesh(
+                            mdl_base, ascii_lines, wkm_type, options)
         # Export MTRs
         if options.mtr_export:
             for mat_name in options.mtrdb:
@@ -184,6 +205,7 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         box.prop(self, 'export_walkmesh')
         box.prop(self, 'export_smoothgroups')
         box.prop(self, 'export_normals')
+        box.prop(self, 'export_binary')
         # UV Map settings
         box = layout.box()
         box.label(text='UV Map Settings')
@@ -217,6 +239,7 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         options.export_walkmesh = self.export_walkmesh
         options.export_smoothgroups = self.export_smoothgroups
         options.export_normals = self.export_normals
+        options.export_binary = self.export_binary
         # UV Map settings
         options.uvmapAutoJoin = self.uv_autojoin
         options.uvmapMode = self.uv_mode
@@ -304,6 +327,11 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         name='Insert Rest Pose',
         description='Insert rest keyframe before every animation',
         default=True)
+    anim_workers = bpy.props.IntProperty(
+        name='Parallel Processes',
+        description='Read animations in parallel processes ' +
+                    '(0 or 1 = read serially)',
+        default=0, min=0, max=64)
     # Blender Settings
     rotmode = bpy.props.EnumProperty(
         name='Rotation Mode',
@@ -329,36 +357,90 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
     render_fading = bpy.props.BoolProperty(name='Render Fading Objects',
                                            description='Render Fading Objects',
                                            default=True, options={'HIDDEN'})
+    # Catalogue Options
+    catalog_use = bpy.props.BoolProperty(
+        name='Query Catalogue',
+        description='Import all models in the directory matching the query, '
+                    'using a catalogue file in the directory',
+        default=False)
+    catalog_supermodel = bpy.props.StringProperty(
+        name='Supermodel',
+        description='Only models with this supermodel',
+        default='')
+    catalog_texture = bpy.props.StringProperty(
+        name='Texture',
+        description='Only models using this texture',
+        default='')
+    use_cache = bpy.props.BoolProperty(
+        name='Cache Models',
+        description='Keep read models in a cache on disk, ' +
+                    'speeds up importing them again',
+        default=False)
+    # Parallel reading of multiple files
+    import_workers = bpy.props.IntProperty(
+        name='Parallel Processes',
+        description='Read files ahead in parallel processes when ' +
+                    'importing multiple files (0 or 1 = read serially)',
+        default=0, min=0, max=64)
+
+    def query_catalog(self):
+        """Get the paths of all matching models from the catalogue."""
+        directory = os.path.dirname(self.filepath)
+        if self.directory:
+            directory = self.directory
+        catalog = nvb_catalog.Catalog.update_directory(directory)
+        if catalog is None:
+            return []
+        with catalog:
+            return catalog.find_models(
+                supermodel=self.catalog_supermodel or None,
+                texture=self.catalog_texture or None)
 
     def mdl_import(self, context, options):
-        def load_file(mdl_filepath, options):
-            mdl_filedir, mdl_filename = os.path.split(mdl_filepath)
-            mdl_name = os.path.splitext(mdl_filename)[0]
-
-            options.mdlname = mdl_name
+        def create_mdl(mdl, mdl_filepath, options):
+            mdl_filename = os.path.basename(mdl_filepath)
+            options.mdlname = os.path.splitext(mdl_filename)[0]
             options.filepath = mdl_filepath
-            mdl = nvb_mdl.Mdl()
-            mdl.read_mdl(mdl_filepath, options)
-            if options.import_walkmesh:
-                for wkm_type in nvb_def.Walkmeshtype.IMPORT:
-                    wkm_filename = mdl_name + '.' + wkm_type
-                    wkm_filepath = os.path.join(mdl_filedir, wkm_filename)
-                    if os.path.isfile(os.fsencode(wkm_filepath)):
-                        mdl.read_wkm(wkm_filepath, wkm_type, options)
             mdl.create(options)
 
+        def load_file(mdl_filepath, options):
+            mdl = nvb_mdl.read_model(mdl_filepath, options)
+            create_mdl(mdl, mdl_filepath, options)
+
+        def get_read_options(options):
+            """Copy of the options for worker processes (no blender data)."""
+            read_options = copy.copy(options)
+            read_options.scene = None
+            read_options.mtrdb = dict()
+            read_options.anim_workers = 0
+            return read_options
+
         def get_location(idx):
             k = math.floor(math.floor(math.sqrt(idx)-1)/2)+1
             return (10.0 * min(k, max(-k, -2*k + abs(i-(4*k*k)-k))),
                     10.0 * min(k, max(-k, -2*k + abs(i-(4*k*k)+k))), 0.0)
 
         # Build list of files
-        pathlist = [os.path.join(self.directory, f.name) for f in self.files]
-        if not pathlist:
-            pathlist.append(self.filepath)
+        if self.catalog_use:
+            pathlist = self.query_catalog()
+            if not pathlist:
+                self.report({'INFO'}, 'No matching models in catalogue')
+                return {'CANCELLED'}
+        else:
+            pathlist = [os.path.join(self.directory, f.name)
+                        for f in self.files]
+            if not pathlist:
+                pathlist.append(self.filepath)
         # Import models
         if len(pathlist) == 1:  # single model => use location in options
             load_file(pathlist[0], options)
+        elif self.import_workers > 1:  # read ahead in worker processes
+            mdl_list = nvb_mdl.read_models(pathlist,
+                                           get_read_options(options),
+                                           self.import_workers)
+            for i, (fp, mdl) in enumerate(zip(pathlist, mdl_list)):
+                options.mdl_location = get_location(i)
+                create_mdl(mdl, fp, options)
         else:  # multiple models => place in a spiral, overwrite options loc.
             for i, fp in enumerate(pathlist):
                 options.mdl_location = get_location(i)
@@ -389,6 +471,7 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         sub1 = box.column()
         sub1.enabled = self.anim_import
         sub1.prop(self, 'anim_restpose')
+        sub1.prop(self, 'anim_workers')
         row = sub1.row(align=True)
         row.prop(self, 'anim_fps_use', text='')
         sub2 = row.row(align=True)
@@ -401,6 +484,16 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         box.prop(self, 'rotmode')
         box.prop(self, 'fix_uvs')
 
+        # Catalogue Settings
+        box = layout.box()
+        box.prop(self, 'catalog_use')
+        sub = box.column()
+        sub.enabled = self.catalog_use
+        sub.prop(self, 'catalog_supermodel')
+        sub.prop(self, 'catalog_texture')
+        box.prop(self, 'import_workers')
+        box.prop(self, 'use_cache')
+
     def execute(self, context):
         """TODO: DOC."""
         options = nvb_def.ImportOptions()
@@ -419,8 +512,11 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         # Animation Options
         options.anim_import = self.anim_import
         options.anim_restpose = self.anim_restpose
+        options.anim_workers = self.anim_workers
         options.anim_fps_use = self.anim_fps_use
         options.anim_fps = self.anim_fps
+        if self.use_cache:
+            options.cache = nvb_cache.Cache()
         # Blender Settings
         options.rotmode = self.rotmode
         options.fix_uvs = self.fix_uvs
@@ -455,10 +551,26 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
         name='Insert Rest Pose',
         description='Insert rest keyframe before every animation',
         default=True)
+    anim_workers = bpy.props.IntProperty(
+        name='Parallel Processes',
+        description='Read animations in parallel processes ' +
+                    '(0 or 1 = read serially)',
+        default=0, min=0, max=64)
     anim_ignore_existing = bpy.props.BoolProperty(
         name='Ignore Existing',
         description='Do not import already existing animations',
         default=True)
+    use_cache = bpy.props.BoolProperty(
+        name='Cache Models',
+        description='Keep read models in a cache on disk, ' +
+                    'speeds up importing them again',
+        default=False)
+    catalog_use = bpy.props.BoolProperty(
+        name='Find Supermodel',
+        description='Look up the supermodel of the selected model in the '
+                    'catalogue of the directory instead of using the '
+                    'selected files',
+        default=False)
 
     def mdl_import(self, context, options):
         def load_file(mdl_filepath, mdl_base, options):
@@ -472,11 +584,33 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
             mdl.create_super(mdl_base, options)
 
         # Build list of files
-        pathlist = [os.path.join(self.directory, f.name) for f in self.files]
-        # Import models
         mdl_base = nvb_utils.get_obj_mdl_base(context.object)
+        if self.catalog_use:
+            supermodel = nvb_utils.str2identifier(mdl_base.nvb.supermodel)
+            if not supermodel:
+                self.report({'INFO'}, 'Model has no supermodel')
+                return {'CANCELLED'}
+            cat = nvb_catalog.Catalog.update_directory(self.directory)
+            if cat is None:
+                self.report({'INFO'}, 'Unable to read catalogue')
+                return {'CANCELLED'}
+            with cat:
+                pathlist = cat.find_models(name=supermodel)[:1]
+            if not pathlist:
+                self.report({'INFO'}, 'Supermodel not found in catalogue')
+                return {'CANCELLED'}
+        else:
+            pathlist = [os.path.join(self.directory, f.name)
+                        for f in self.files]
+        # Import models
         if round(mdl_base.nvb.animscale, 3) != 1.0:
             options.anim_scale = mdl_base.nvb.animscale
+        # Only names and parents of the nodes are needed
+        options.lazy_nodes = True
+        if options.anim_ignore_existing:
+            # Existing animations don't have to be read at all
+            existing_anims = set(mdl_base.nvb.animList.keys())
+            options.anim_filter = lambda name: name not in existing_anims
         for filepath in pathlist:
             load_file(filepath, mdl_base, options)
         return {'FINISHED'}
@@ -492,8 +626,11 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
 
         # Animation Import Settings
         box = layout.box()
+        box.prop(self, 'catalog_use')
         box.prop(self, 'anim_ignore_existing')
         box.prop(self, 'anim_restpose')
+        box.prop(self, 'anim_workers')
+        box.prop(self, 'use_cache')
         row = box.row(align=True)
         row.prop(self, 'anim_fps_use', text='')
         sub = row.row(align=True)
@@ -507,7 +644,10 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
         options.anim_fps_use = self.anim_fps_use
         options.anim_fps = self.anim_fps
         options.anim_restpose = self.anim_restpose
+        options.anim_workers = self.anim_workers
         options.anim_ignore_existing = self.anim_ignore_existing
+        if self.use_cache:
+            options.cache = nvb_cache.Cache()
         return self.mdl_import(context, options)
 
     def invoke(self, context, event):
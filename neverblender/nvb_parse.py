@@ -0,0 +1,253 @@
+"""Forward-only tokenizer for ascii mdl and walkmesh files."""
+
+import os
+import re
+import mmap
+import warnings
+import contextlib
+
+import numpy
+
+# Increase whenever the data read by the parser changes (invalidates caches)
+version = 6
+
+# Shared empty arrays, used as defaults by nodes
+empty_arrays = dict()
+
+
+class Tokenizer():
+    """Walk an ascii mdl block once and yield one record per labeled line.
+
+    Each record is a tuple (label, line, block, count):
+        label - lower case first token of the line
+        line  - the split line (list of strings)
+        block - raw, unsplit text of the value rows following the line
+        count - number of rows in the block
+    Lists with a size (verts, faces, weights, ...) are read by count.
+    Key lists and other unsized lists end at the first non-numeric line,
+    which is found with a single regular expression match, their rows are
+    counted by newlines unless they contain empty lines. Name lists
+    (e.g. flare textures) end at the first line with more than one token.
+    Stray values, comments and empty lines are skipped.
+    Data may be a str or any bytes-like buffer (e.g. a memory mapped file).
+    For bytes, only labeled lines are decoded, blocks are kept as bytes.
+    The position is shared, so nested loops over the same tokenizer (e.g.
+    for animations) continue where the previous one stopped.
+    """
+
+    # Labels followed by a list with the size given as second token
+    sized_lists = {'verts', 'faces', 'normals', 'tangents', 'colors',
+                   'weights', 'constraints', 'animverts', 'animtverts'}
+    # Labels followed by a list of names, one per line
+    name_lists = {'texturenames'}
+    # First characters of numeric rows
+    numeric = set('0123456789-+.')
+    # A whole numeric token (including 1.#QNAN and the like). Names starting
+    # with a digit (e.g. flare textures) are labels, not numbers
+    number = r'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?' \
+             r'(?:#[A-Za-z0-9]+)?(?=\s|$)'
+    # Run of numeric or empty rows (ending an unsized list) and single rows
+    numeric_run = r'(?:[ \t\r\f\v]*(?:' + number + r'[^\n]*)?\n)*' \
+                  r'(?:[ \t\r\f\v]*' + number + r'[^\n]*)?'
+    numeric_row = r'^[ \t\r\f\v]*' + number
+    empty_row = r'\n[ \t\r\f\v]*\n'
+    patterns = {str: (re.compile(numeric_run),
+                      re.compile(numeric_row, re.MULTILINE),
+                      re.compile(empty_row)),
+                bytes: (re.compile(numeric_run.encode()),
+                        re.compile(numeric_row.encode(), re.MULTILINE),
+                        re.compile(empty_row.encode()))}
+    is_number = re.compile(number).match
+    # Run of rows with a single name (ending a name list)
+    name_run = r'(?:[ \t\r\f\v]*(?:(?![Ee][Nn][Dd][Nn][Oo][Dd][Ee]\s)' \
+               r'[^\s#]\S*[ \t\r\f\v]*)?(?:\n|\Z))*'
+    name_patterns = {str: re.compile(name_run),
+                     bytes: re.compile(name_run.encode())}
+
+    def __init__(self, data, start=0, end=-1):
+        """Tokenize data[start:end]; data may be a str or bytes."""
+        self.data = data
+        self.pos = start
+        self.line_start = start  # Start of the last labeled line
+        if end < 0:
+            end = len(data)
+        self.end = end
+        self.is_text = isinstance(data, str)
+
+    @classmethod
+    def list_size(cls, label, line):
+        """Return the size of the list following a line or -1 if unsized."""
+        if label in cls.sized_lists or label.startswith('tverts'):
+            try:
+                return int(line[1])
+            except (IndexError, ValueError):
+                pass
+        return -1
+
+    def __iter__(self):
+        """Generate records until the end of the block is reached."""
+        data = self.data
+        find = data.find
+        end = self.end
+        numeric = self.numeric
+        is_number = self.is_number
+        if self.is_text:
+            newline = '\n'
+            match_run, match_rows, find_empty = Tokenizer.patterns[str]
+            match_names = Tokenizer.name_patterns[str].match
+        else:
+            newline = b'\n'
+            match_run, match_rows, find_empty = Tokenizer.patterns[bytes]
+            match_names = Tokenizer.name_patterns[bytes].match
+        match_run = match_run.match
+        match_rows = match_rows.findall
+        find_empty = find_empty.search
+        pos = self.pos
+        while pos < end:
+            eol = find(newline, pos, end)
+            if eol < 0:
+                eol = end
+            line_start = pos
+            line = decode(data[pos:eol]).split()
+            pos = eol + 1
+            if not line or line[0][0] == '#' or \
+                    (line[0][0] in numeric and is_number(line[0])):
+                continue  # Empty line, comment or stray value
+            label = line[0].lower()
+            block_start = pos
+            block_end = pos
+            count = 0
+            size = Tokenizer.list_size(label, line)
+            if size >= 0:
+                while count < size and pos < end:
+                    eol = find(newline, pos, end)
+                    if eol < 0:
+                        eol = end
+                    pos = eol + 1
+                    count += 1
+                block_end = min(pos, end)
+            elif label in Tokenizer.name_lists:
+                if pos < end:
+                    pos = match_names(data, pos, end).end()
+                block_end = pos
+                count = len(data[block_start:block_end].split())
+            elif pos < end:
+                # Unsized list: Every numeric line belongs to it. The end
+                # is found by regex, not line by line
+                pos = match_run(data, pos, end).end()
+                block_end = pos
+                count = -1
+            block = data[block_start:block_end]
+            if count < 0:
+                # Count the rows of an unsized list by newlines, by regex
+                # only if it contains empty rows (the block follows a
+                # newline, which is included to find an empty first row)
+                count = block.count(newline)
+                if block and block[-1:] != newline:
+                    count += 1  # Last row at the end of the data
+                if count and find_empty(data, block_start - 1, block_end):
+                    count = len(match_rows(block))
+            self.pos = pos
+            self.line_start = line_start
+            yield label, line, block, count
+            pos = self.pos  # Nested readers may have moved on
+
+
+def decode(data):
+    """Decode raw bytes (labels, names) to str, str is returned as is."""
+    if isinstance(data, str):
+        return data
+    return data.decode('utf-8', 'replace')
+
+
+def find_label(data, label, start=0):
+    """Generate the start of every line beginning with the given label.
+
+    Lines are found with a regular expression, without tokenizing the lines
+    in between.
+    """
+    if isinstance(data, str):
+        pattern = r'^[ \t]*' + re.escape(label) + r'(?=\s)'
+    else:
+        pattern = rb'^[ \t]*' + re.escape(label.encode()) + rb'(?=\s)'
+    regex = re.compile(pattern, re.MULTILINE | re.IGNORECASE)
+    for match in regex.finditer(data, start):
+        yield match.start()
+
+
+def is_binary(data):
+    """Return True if data holds a binary file.
+
+    Binary mdl files start with a zero, binary walkmeshes with 'BWM '.
+    """
+    return data[:1] in (b'\x00', '\x00') or data[:4] in (b'BWM ', 'BWM ')
+
+
+@contextlib.contextmanager
+def map_file(filepath):
+    """Open a file once and map it into memory for reading.
+
+    Yields a read only mmap (or empty bytes for empty files) which can be
+    passed to the tokenizer directly.
+    """
+    with open(os.fsencode(filepath), 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files can't be mapped
+            data = None
+        if data is None:
+            yield b''
+        else:
+            with data:
+                yield data
+
+
+def split_rows(block):
+    """Split a raw block of values into a list of rows."""
+    return [row for row in (l.split() for l in block.splitlines()) if row]
+
+
+def empty_array(dim, dtype=numpy.float32):
+    """Return a shared, read only array of shape (0, dim)."""
+    key = (dim, numpy.dtype(dtype).str)
+    if key not in empty_arrays:
+        values = numpy.zeros((0, dim), dtype)
+        values.flags.writeable = False
+        empty_arrays[key] = values
+    return empty_arrays[key]
+
+
+def read_array(block, count, dim, dtype=numpy.float32):
+    """Decode count rows of a raw block into an array of shape (count, dim).
+
+    The whole block is decoded with a single call. Blocks with invalid
+    numbers or irregular rows are decoded row by row instead, treating
+    invalid or missing values as 0.
+    """
+    if count < 1:
+        return empty_array(dim, dtype)
+    eol = block.find(b'\n' if isinstance(block, bytes) else '\n')
+    ncols = len(block[:eol].split() if eol >= 0 else block.split())
+    if ncols >= dim:
+        try:
+            with warnings.catch_warnings():
+                # Older numpy versions only warn about unmatched data
+                warnings.simplefilter('ignore')
+                values = numpy.fromstring(block, dtype=dtype, sep=' ')
+        except ValueError:
+            pass
+        else:
+            if values.size == count * ncols:
+                values = values.reshape(count, ncols)
+                if ncols > dim:
+                    values = numpy.ascontiguousarray(values[:, :dim])
+                return values
+    # Malformed block, fall back to per-value conversion
+    values = numpy.zeros((count, dim), dtype)
+    for i, row in enumerate(split_rows(block)[:count]):
+        for j, v in enumerate(row[:dim]):
+            try:
+                values[i, j] = float(v)
+            except ValueError:
+                values[i, j] = 0.0
+    return values
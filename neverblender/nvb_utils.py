@@ -1,13 +1,16 @@
 """TODO: DOC."""
 
-import mathutils
-import bpy
 import os
 import math
 import re
 import collections
 
-import bpy_extras.image_utils
+try:
+    import mathutils
+    import bpy
+    import bpy_extras.image_utils
+except ImportError:  # Not running inside blender, parsing only
+    pass
 
 from . import nvb_def
 
@@ -0,0 +1,400 @@
+"""Tests for reading and writing binary (compiled) mdl files."""
+
+import numpy
+
+from neverblender import nvb_def
+from neverblender import nvb_mdl
+from neverblender import nvb_node
+from neverblender import nvb_parse
+from neverblender import nvb_binary
+
+
+def test_small_rotations_read_back():
+    angles = [0.0005, 0.002, 0.01, 0.5, 3.0]
+    quats = nvb_binary.axisangle2quat([(0, 0, 1, a) for a in angles])
+    axisangles = nvb_binary.quat2axisangle(quats)
+    assert axisangles.dtype == numpy.float32
+    assert numpy.allclose(axisangles[:, :3], (0, 0, 1))
+    assert numpy.allclose(axisangles[:, 3], angles, rtol=1e-5)
+
+
+def test_identity_has_unit_axis():
+    quats = numpy.array([(0, 0, 0, 1), (0, 0, 0, -1)], numpy.float32)
+    assert nvb_binary.quat2axisangle(quats)[0].tolist() == [0, 0, 1, 0]
+    axis = nvb_binary.quat2axisangle(quats)[1, :3]
+    assert numpy.allclose(axis, (0, 0, 1))
+
+
+def test_rotation_axis_is_normalized():
+    quats = nvb_binary.axisangle2quat([(1, 2, 2, 0.3), (0, -3, 0, 2.5)])
+    assert numpy.allclose(nvb_binary.quat2axisangle(quats),
+                          [(1/3, 2/3, 2/3, 0.3), (0, -1, 0, 2.5)], atol=1e-6)
+
+
+MDL = """newmodel c_test
+setsupermodel c_test a_ba
+classification character
+setanimationscale 1.0
+beginmodelgeom c_test
+node dummy c_test
+  parent NULL
+endnode
+node trimesh body
+  parent c_test
+  position 0.0 0.1 0.2
+  orientation 0.0 0.0 1.0 0.5
+  ambient 0.2 0.2 0.2
+  diffuse 0.8 0.8 0.8
+  shininess 26
+  bitmap tex_body
+  verts 4
+    0.0 0.0 0.0
+    1.0 0.0 0.0
+    1.0 1.0 0.0
+    0.0 1.0 0.0
+  normals 4
+    0 0 1
+    0 0 1
+    0 0 1
+    0 0 1
+  colors 4
+    1 1 1
+    0.5 0.5 0.5
+    1 0 0
+    0 1 0
+  tverts 5
+    0.0 0.0 0
+    1.0 0.0 0
+    1.0 1.0 0
+    0.0 1.0 0
+    0.5 0.5 0
+  faces 2
+    0 1 2  1  0 1 2  0
+    0 2 3  2  4 2 3  1
+endnode
+node skin skinmesh
+  parent c_test
+  verts 3
+    0 0 0
+    1 0 0
+    0 1 0
+  faces 1
+    0 1 2 1 0 0 0 0
+  weights 3
+    body 1.0
+    body 0.5 c_test 0.5
+    c_test 1.0
+endnode
+node danglymesh dangly
+  parent body
+  period 2.5
+  tightness 3.0
+  displacement 0.1
+  verts 3
+    0 0 0
+    1 0 0
+    0 1 0
+  faces 1
+    0 1 2 1 0 0 0 0
+  constraints 3
+    0.0
+    128.0
+    255.0
+endnode
+node light lamp
+  parent c_test
+  radius 14.0
+  multiplier 1.0
+  color 1.0 0.9 0.8
+  ambientonly 0
+  ndynamictype 1
+  lensflares 1
+  flareradius 10.0
+  texturenames zd
+    fxpa_flare
+    fxpa_flare2
+  flaresizes zd
+    1.5
+    2.0
+  flarepositions zd
+    1.0
+    0.5
+  flarecolorshifts zd
+    0.0 0.0 0.0
+    0.1 0.2 0.3
+endnode
+node emitter spray
+  parent c_test
+  xsize 20
+  ysize 30
+  update Fountain
+  birthrate 10
+  colorstart 1.0 0.5 0.0
+  texture fx_tex
+  loop 1
+endnode
+node aabb wok
+  parent c_test
+  verts 3
+    0 0 0
+    1 0 0
+    0 1 0
+  faces 1
+    0 1 2 1 0 0 0 3
+  aabb 0 0 0 1 1 0 0
+endnode
+endmodelgeom c_test
+newanim walk c_test
+  length 1.5
+  transtime 0.25
+  animroot c_test
+  event 0.5 hit
+  node dummy c_test
+    parent null
+  endnode
+  node trimesh body
+    parent c_test
+    positionkey 3
+      0.0 0.0 0.1 0.2
+      0.5 1.0 1.1 1.2
+      1.5 2.0 2.1 2.2
+    orientationkey 5
+      0.0 0.0 0.0 1.0 0.0
+      0.5 0.0 0.0 1.0 0.0005
+      0.75 0.0 0.0 1.0 0.002
+      1.0 0.0 1.0 0.0 0.01
+      1.5 1.0 0.0 0.0 2.5
+  endnode
+  node light lamp
+    parent c_test
+    colorkey 2
+      0.0 1.0 0.9 0.8
+      1.5 0.0 0.5 1.0
+  endnode
+  node emitter spray
+    parent c_test
+    birthratekey 2
+      0.0 10
+      1.0 20
+  endnode
+doneanim walk c_test
+newanim run c_test
+  length 0.5
+  transtime 0.1
+  animroot body
+  node dummy c_test
+    parent null
+  endnode
+  node animmesh body
+    parent c_test
+    sampleperiod 0.25
+    animverts 8
+      0 0 0
+      1 0 0
+      1 1 0
+      0 1 0
+      0 0 1
+      1 0 1
+      1 1 1
+      0 1 1
+    animtverts 10
+      0.0 0.0 0
+      1.0 0.0 0
+      1.0 1.0 0
+      0.0 1.0 0
+      0.5 0.5 0
+      0.1 0.0 0
+      1.0 0.1 0
+      1.0 0.9 0
+      0.1 1.0 0
+      0.4 0.4 0
+  endnode
+doneanim run c_test
+donemodel c_test
+"""
+
+PWK = """node dummy c_test_pwk
+  parent c_test
+endnode
+node trimesh c_test_wg
+  parent c_test_pwk
+  position 1 2 3
+  verts 3
+    0 0 0
+    1 0 0
+    0 1 0
+  faces 1
+    0 1 2 1 0 0 0 7
+endnode
+node dummy c_test_pwk_use01
+  parent c_test_pwk
+  position 1 0 0
+endnode
+node dummy c_test_pwk_use02
+  parent c_test_pwk
+  position 0 1 0
+endnode
+"""
+
+
+def compile_and_read(ascii_data):
+    """Return the model read from ascii and from the compiled binary."""
+    options = nvb_def.ImportOptions()
+    ascii_mdl = nvb_mdl.Mdl()
+    ascii_mdl.read_ascii_mdl(ascii_data, options)
+    binary_mdl = nvb_mdl.Mdl()
+    binary_mdl.read_binary_mdl(nvb_mdl.Mdl.compile_ascii(ascii_data),
+                               options)
+    return ascii_mdl, binary_mdl
+
+
+def corners(node, values, column):
+    """Return per corner values of a mesh (vertices split by the writer)."""
+    return values[node.facedef[:, column:column+3]]
+
+
+def same_rotation(orientation1, orientation2):
+    quats = nvb_binary.axisangle2quat([orientation1, orientation2])
+    return numpy.isclose(abs(numpy.dot(quats[0], quats[1])), 1.0)
+
+
+def test_geometry_round_trip():
+    ascii_mdl, binary_mdl = compile_and_read(MDL.encode())
+    assert (binary_mdl.name, binary_mdl.supermodel,
+            binary_mdl.classification) == \
+        (ascii_mdl.name, ascii_mdl.supermodel, ascii_mdl.classification)
+    nodes = {n.name: n for n in binary_mdl.mdlnodes}
+    assert sorted(nodes) == sorted(n.name for n in ascii_mdl.mdlnodes)
+    for node in ascii_mdl.mdlnodes:
+        other = nodes[node.name]
+        assert type(other) is type(node)
+        assert other.parent.lower() == node.parent.lower()
+        assert numpy.allclose(other.position, node.position)
+        assert same_rotation(other.orientation, node.orientation)
+        if isinstance(node, nvb_node.Trimesh):
+            assert numpy.allclose(corners(other, other.verts, 0),
+                                  corners(node, node.verts, 0))
+            assert numpy.array_equal(other.facedef[:, 7],
+                                     node.facedef[:, 7])
+    body, other = ascii_mdl.mdlnodes[1], nodes['body']
+    assert numpy.allclose(corners(other, other.tverts[0], 4),
+                          corners(body, body.tverts[0], 4))
+    assert numpy.allclose(corners(other, other.normals, 0),
+                          corners(body, body.normals, 0))
+    assert numpy.allclose(corners(other, other.colors, 0),
+                          corners(body, body.colors, 0), atol=1 / 255)
+    assert other.material.textures[0] == 'tex_body'
+    assert numpy.allclose(other.material.diffuse, body.material.diffuse)
+
+
+def test_skin_dangly_aabb_round_trip():
+    ascii_mdl, binary_mdl = compile_and_read(MDL.encode())
+    nodes = {n.name: n for n in binary_mdl.mdlnodes}
+    for node in ascii_mdl.mdlnodes:
+        other = nodes[node.name]
+        if isinstance(node, nvb_node.Skinmesh):
+            def weights(n):
+                return [sorted((b, round(w, 4)) for b, w in n.weights[i])
+                        for i in n.facedef[:, 0:3].ravel().tolist()]
+            assert weights(other) == weights(node)
+        elif isinstance(node, nvb_node.Danglymesh):
+            assert (other.period, other.tightness, other.displacement) == \
+                (node.period, node.tightness, node.displacement)
+            assert numpy.allclose(
+                corners(other, numpy.array(other.constraints), 0),
+                corners(node, numpy.array(node.constraints), 0))
+        elif isinstance(node, nvb_node.Aabb):
+            assert numpy.allclose(other.aabb_tree, node.aabb_tree)
+
+
+def test_light_emitter_round_trip():
+    ascii_mdl, binary_mdl = compile_and_read(MDL.encode())
+    nodes = {n.name: n for n in binary_mdl.mdlnodes}
+    lamp, other = [n for n in ascii_mdl.mdlnodes if n.name == 'lamp'][0], \
+        nodes['lamp']
+    for attr in ['radius', 'multiplier', 'color', 'ambientonly',
+                 'ndynamictype', 'lensflares', 'flareradius', 'flareSizes',
+                 'flarePositions', 'flareCShifts']:
+        assert numpy.allclose(getattr(other, attr), getattr(lamp, attr)), \
+            attr
+    assert other.flareTextures == lamp.flareTextures
+    spray, other = [n for n in ascii_mdl.mdlnodes if n.name == 'spray'][0], \
+        nodes['spray']
+    assert (other.xsize, other.ysize) == (spray.xsize, spray.ysize)
+    values = dict(other.blender_data)
+    for data_path, value in spray.blender_data:
+        if isinstance(value, str):
+            assert values[data_path] == value, data_path
+        else:
+            assert numpy.allclose(values[data_path], value), data_path
+
+
+def test_animation_round_trip():
+    ascii_mdl, binary_mdl = compile_and_read(MDL.encode())
+    assert [a.name for a in binary_mdl.animations] == ['walk', 'run']
+    anim, other = ascii_mdl.animations[0], binary_mdl.animations[0]
+    assert numpy.isclose(other.length, anim.length)
+    assert numpy.isclose(other.transtime, anim.transtime)
+    assert other.animroot == anim.animroot
+    assert other.events == anim.events
+    nodes = {n.name: n for n in other.nodes}
+    for node in anim.nodes:
+        for key_data, other_data in [
+                (node.object_data, nodes[node.name].object_data),
+                (node.emitter_data, nodes[node.name].emitter_data)]:
+            assert sorted(other_data) == sorted(key_data), node.name
+            for key_name, (keys, _, _) in key_data.items():
+                # Axis and angle are compared directly, small rotations
+                # have to keep their angle
+                assert numpy.allclose(other_data[key_name][0], keys,
+                                      rtol=1e-4, atol=1e-6), key_name
+
+
+def test_animmesh_round_trip():
+    ascii_mdl, binary_mdl = compile_and_read(MDL.encode())
+    body = ascii_mdl.mdlnodes[1]
+    other_body = [n for n in binary_mdl.mdlnodes if n.name == 'body'][0]
+    node = ascii_mdl.animations[1].nodes[1]
+    other = [n for n in binary_mdl.animations[1].nodes
+             if n.name == 'body'][0]
+    assert other.shapedata and other.uvdata
+    assert numpy.isclose(other.sampleperiod, node.sampleperiod)
+    for attr, size, other_size, column in [
+            ('animverts', len(body.verts), len(other_body.verts), 0),
+            ('animtverts', len(body.tverts[0]), len(other_body.verts), 4)]:
+        sets = getattr(node, attr).reshape(2, size, -1)
+        other_sets = getattr(other, attr).reshape(2, other_size, -1)
+        for values, other_values in zip(sets, other_sets):
+            assert numpy.allclose(corners(other_body, other_values, 0),
+                                  corners(body, values, column)), attr
+
+
+def test_walkmesh_round_trip():
+    nodes = []
+    nvb_mdl.Mdl.read_ascii_geom(nvb_parse.Tokenizer(PWK), nodes)
+    reader = nvb_binary.WalkmeshReader(
+        nvb_mdl.Mdl.compile_ascii_wkm(PWK, 'pwk'))
+    binary_nodes = []
+    reader.read_nodes(binary_nodes, 'c_test', 'pwk')
+    mesh, other = nodes[1], binary_nodes[0]
+    assert other.name == mesh.name
+    assert numpy.allclose(other.verts + other.position,
+                          mesh.verts + mesh.position)
+    assert numpy.array_equal(other.facedef[:, [0, 1, 2, 7]],
+                             mesh.facedef[:, [0, 1, 2, 7]])
+    uses = {n.name: n.position for n in binary_nodes[1:]}
+    assert numpy.allclose(uses['c_test_pwk_use01'], (1, 0, 0))
+    assert numpy.allclose(uses['c_test_pwk_use02'], (0, 1, 0))
+
+
+def test_area_walkmesh_round_trip():
+    ascii_mdl = nvb_mdl.Mdl()
+    ascii_mdl.read_ascii_mdl(MDL, nvb_def.ImportOptions())
+    aabb = [n for n in ascii_mdl.mdlnodes if isinstance(n, nvb_node.Aabb)]
+    reader = nvb_binary.WalkmeshReader(
+        nvb_mdl.Mdl.compile_ascii_wkm(MDL, 'wok'))
+    nodes = []
+    reader.read_nodes(nodes, 'c_test', 'wok')
+    assert numpy.allclose(nodes[0].verts + nodes[0].position,
+                          aabb[0].verts + aabb[0].position)
+    assert numpy.allclose(nodes[0].aabb_tree, aabb[0].aabb_tree)
@@ -0,0 +1,96 @@
+"""Tests for the on-disk cache of read models."""
+
+import os
+import stat
+
+import numpy
+
+from neverblender import nvb_def
+from neverblender import nvb_mdl
+from neverblender import nvb_cache
+from neverblender import nvb_animnode
+
+MDL = """newmodel test
+setsupermodel test NULL
+classification character
+beginmodelgeom test
+node dummy test
+  parent NULL
+endnode
+node trimesh plane
+  parent test
+  position 0 0 1
+  bitmap plane_tex
+  verts 3
+    0 0 0
+    1 0 0
+    1 1 0
+  faces 1
+    0 1 2 1 0 1 2 0
+  tverts 3
+    0 0 0
+    1 0 0
+    1 1 0
+endnode
+endmodelgeom test
+newanim idle test
+  length 1.0
+  node dummy plane
+    parent test
+    positionkey
+      0.0 0 0 1
+      1.0 0 0 2
+  endnode
+doneanim idle test
+donemodel test
+"""
+
+
+def read(filepath, cache):
+    options = nvb_def.ImportOptions()
+    options.cache = cache
+    mdl = nvb_mdl.Mdl()
+    mdl.read_mdl(filepath, options)
+    return mdl
+
+
+def test_cached_model_matches(tmp_path):
+    filepath = str(tmp_path / 'test.mdl')
+    with open(filepath, 'w') as f:
+        f.write(MDL)
+    cache = nvb_cache.Cache(str(tmp_path / 'cache'))
+    original = read(filepath, cache)
+    cached = read(filepath, cache)
+    assert os.path.isfile(cache.get_entry(filepath, 'mdl'))
+    assert cached.name == original.name
+    assert [n.name for n in cached.mdlnodes] == \
+        [n.name for n in original.mdlnodes]
+    plane = cached.mdlnodes[1]
+    assert numpy.array_equal(plane.verts, original.mdlnodes[1].verts)
+    assert numpy.array_equal(plane.facedef, original.mdlnodes[1].facedef)
+    assert plane.material.textures == original.mdlnodes[1].material.textures
+    node = cached.animations[0].nodes[0]
+    assert list(node.object_data) == \
+        list(original.animations[0].nodes[0].object_data)
+    assert node.emitter_data is nvb_animnode.Animnode.empty_key_data
+
+
+def test_private_directory(tmp_path):
+    directory = str(tmp_path / 'cache')
+    os.makedirs(directory, mode=0o777)
+    os.chmod(directory, 0o777)
+    nvb_cache.make_private_directory(directory)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+
+def test_pickles_are_not_loaded(tmp_path):
+    filepath = str(tmp_path / 'test.mdl')
+    with open(filepath, 'w') as f:
+        f.write(MDL)
+    cache = nvb_cache.Cache(str(tmp_path / 'cache'))
+    read(filepath, cache)
+    entry = cache.get_entry(filepath, 'mdl')
+    with open(entry, 'wb') as f:
+        numpy.save(f, numpy.array([None, 'x'], dtype=object))
+    assert cache.load(filepath) is None
+    assert not os.path.exists(entry)
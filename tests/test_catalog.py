@@ -0,0 +1,45 @@
+"""Tests for the catalogue of model directories."""
+
+import os
+
+from neverblender import nvb_catalog
+
+MDL = """newmodel test
+setsupermodel test base
+classification character
+beginmodelgeom test
+node dummy test
+  parent NULL
+endnode
+endmodelgeom test
+donemodel test
+"""
+
+
+def write_model(directory):
+    with open(os.path.join(directory, 'test.mdl'), 'w') as f:
+        f.write(MDL)
+
+
+def test_update_directory(tmp_path):
+    directory = str(tmp_path)
+    write_model(directory)
+    catalog = nvb_catalog.Catalog.update_directory(directory)
+    with catalog:
+        assert catalog.find_models(supermodel='base') == \
+            [os.path.join(directory, 'test.mdl')]
+    assert os.path.isfile(os.path.join(directory, 'nvb_catalog.sqlite'))
+
+
+def test_unwritable_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'user'))
+    directory = str(tmp_path / 'models')
+    os.mkdir(directory)
+    write_model(directory)
+    # The database can't be created where a directory of that name exists
+    os.mkdir(os.path.join(directory, 'nvb_catalog.sqlite'))
+    catalog = nvb_catalog.Catalog.update_directory(directory)
+    with catalog:
+        assert catalog.find_models(name='test') == \
+            [os.path.join(directory, 'test.mdl')]
+    assert os.listdir(str(tmp_path / 'user' / 'neverblender' / 'catalogs'))
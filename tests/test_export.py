@@ -0,0 +1,109 @@
+"""Tests for the export helpers."""
+
+import os
+
+import numpy
+import pytest
+
+from neverblender import nvb_def
+from neverblender import nvb_mdl
+from neverblender import nvb_export
+
+LINES = ['newmodel test', 'setsupermodel test NULL', 'beginmodelgeom test',
+         'node dummy test', '  parent NULL', 'endnode', 'node trimesh plane',
+         '  parent test', '  verts 3', '    0 0 0', '    1 0 0', '    0 1 0',
+         '  faces 1', '    0 1 2 1 0 0 0 0', 'endnode',
+         'endmodelgeom test', 'donemodel test']
+
+
+class KeyframePoints():
+    """Keyframe points of a stub fcurve."""
+
+    def __init__(self, points):
+        """TODO: DOC."""
+        self.points = points
+
+    def __len__(self):
+        """TODO: DOC."""
+        return len(self.points)
+
+    def foreach_get(self, attr, buf):
+        """TODO: DOC."""
+        assert attr == 'co'
+        buf[:] = numpy.ravel(self.points)
+
+
+class FCurve():
+    """Stub fcurve, evaluates to the negated frame."""
+
+    def __init__(self, points, modifiers=()):
+        """TODO: DOC."""
+        self.keyframe_points = KeyframePoints(points)
+        self.modifiers = list(modifiers)
+        self.evaluated = []
+
+    def as_pointer(self):
+        """TODO: DOC."""
+        return id(self)
+
+    def evaluate(self, frame):
+        """TODO: DOC."""
+        self.evaluated.append(frame)
+        return -frame
+
+
+def test_compiled_from_streamed_lines(tmp_path):
+    filepath = str(tmp_path / 'test.mdl')
+    assert nvb_export.write_compiled(filepath, lambda l: l.extend(LINES),
+                                     nvb_mdl.Mdl.compile_ascii)
+    with open(filepath, 'rb') as f:
+        assert f.read() == nvb_mdl.Mdl.compile_ascii('\n'.join(LINES))
+    assert os.listdir(str(tmp_path)) == ['test.mdl']
+
+
+def test_nothing_compiled_without_lines(tmp_path):
+    filepath = str(tmp_path / 'test.pwk')
+    assert not nvb_export.write_compiled(filepath, lambda l: None,
+                                         nvb_mdl.Mdl.compile_ascii)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_no_files_left_if_compiling_fails(tmp_path):
+    def compile_data(data):
+        raise nvb_def.MalformedMdlFile('Unable to find geometry')
+
+    filepath = str(tmp_path / 'test.mdl')
+    with pytest.raises(nvb_def.MalformedMdlFile):
+        nvb_export.write_compiled(filepath, lambda l: l.extend(LINES),
+                                  compile_data)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_keyframe_bounds_are_inclusive():
+    index = nvb_export.KeyframeIndex()
+    fcu1 = FCurve([(20.0, 1.0), (10.0, 2.0), (15.0, 3.0), (30.0, 4.0)])
+    fcu2 = FCurve([(5.0, 1.0), (15.0, 2.0), (25.0, 3.0)])
+    frames = index.get_frames([fcu1, None, fcu2], 10.0, 25.0)
+    assert frames.tolist() == [10.0, 15.0, 20.0, 25.0]
+    assert index.get_frames([fcu1], 10.5, 14.5).tolist() == []
+    assert index.get_frames([None], 0.0, 100.0).tolist() == []
+
+
+def test_only_frames_between_keys_are_evaluated():
+    index = nvb_export.KeyframeIndex()
+    fcu = FCurve([(20.0, 1.0), (10.0, 2.0), (30.0, 3.0)])
+    values = index.get_values(fcu, numpy.array([0.0, 10.0, 15.0, 20.0,
+                                                30.0, 40.0]))
+    assert values.tolist() == [-0.0, 2.0, -15.0, 1.0, 3.0, -40.0]
+    assert fcu.evaluated == [0.0, 15.0, 40.0]
+
+
+def test_fcurves_with_modifiers_are_evaluated():
+    index = nvb_export.KeyframeIndex()
+    fcu = FCurve([(10.0, 2.0), (20.0, 1.0)], modifiers=['CYCLES'])
+    values = index.get_values(fcu, numpy.array([10.0, 15.0, 20.0]))
+    assert values.tolist() == [-10.0, -15.0, -20.0]
+    assert fcu.evaluated == [10.0, 15.0, 20.0]
+    fcu = FCurve([])
+    assert index.get_values(fcu, numpy.array([5.0])).tolist() == [-5.0]
+    assert fcu.evaluated == [5.0]
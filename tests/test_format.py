@@ -0,0 +1,91 @@
+"""Tests for the vectorized formatting of exported rows."""
+
+import numpy
+import pytest
+
+from neverblender import nvb_format
+
+# Formats used by the exporters
+FLOAT_FORMATS = ['    {: 8.5f} {: 8.5f} {: 8.5f}',
+                 '    {: 8.5f} {: 8.5f} {: 8.5f} {: 3.1f}',
+                 '    {: 5.3f} {: 5.3f}  0',
+                 '    {: 5.1f}',
+                 '{:5.3f}',
+                 '    {:3.2f} {:3.2f} {:3.2f}',
+                 '      {:> 6.3f} {:> 6.5f} {:> 6.5f} {:> 6.5f}',
+                 '      {: 6.3f} {: 6.3f} {: 6.3f}',
+                 '      {: 6.3f} {: 6.3f}  0',
+                 ' {:1.0f}',
+                 ' {: >3.2f}',
+                 ' {:>4.2f}']
+AABB_FORMAT = '    {: 5.2f} {: 5.2f} {: 5.2f}  ' + \
+              '{: 5.2f} {: 5.2f} {: 5.2f} {: 3d}'
+FACE_FORMAT = '    {:3d} {:3d} {:3d}  {:2d}  {:3d} {:3d} {:3d}  {:1d}'
+
+
+def reference(fmt, rows):
+    """Format every row with str.format."""
+    fields, _ = nvb_format.parse_format(fmt)
+    return [fmt.format(*[int(v) if f[4] == 'd' else float(v)
+                         for v, f in zip(row, fields)])
+            for row in numpy.asarray(rows).tolist()]
+
+
+def float_column(rng, precision, size):
+    """Random values with ties, signed zeros and special values."""
+    column = rng.normal(0.0, 10.0 ** rng.uniform(-4, 6), size)
+    column[:size // 4] = column[:size // 4].astype(numpy.float32)
+    # Exact ties at the last printed digit
+    scale = 2 * 10 ** precision
+    column[size // 4:size // 2] = \
+        numpy.round(column[size // 4:size // 2] * scale) / scale
+    column[0:3] = [-0.0, 0.0, -1e-9]
+    column[3:6] = [numpy.nan, numpy.inf, -numpy.inf]
+    column[6:8] = [1e25, -1e25]
+    column[8:10] = [0.5, -2.5]
+    rng.shuffle(column)
+    return column
+
+
+@pytest.mark.parametrize('fmt', FLOAT_FORMATS + [AABB_FORMAT])
+@pytest.mark.parametrize('chunk_size', [7, 65536])
+def test_rows_match_str_format(fmt, chunk_size):
+    rng = numpy.random.RandomState(len(fmt))
+    fields, _ = nvb_format.parse_format(fmt)
+    columns = []
+    for _, _, _, precision, ftype in fields:
+        if ftype == 'd':
+            columns.append(rng.randint(-5000, 5000, 200).astype(float))
+        else:
+            columns.append(float_column(rng, precision, 200))
+    rows = numpy.column_stack(columns)
+    assert nvb_format.format_rows(fmt, rows, chunk_size) == \
+        reference(fmt, rows)
+
+
+def test_integer_rows_match_str_format():
+    rng = numpy.random.RandomState(0)
+    rows = rng.randint(-50, 100000, (500, 8))
+    rows[0] = 0
+    assert nvb_format.format_rows(FACE_FORMAT, rows, 64) == \
+        reference(FACE_FORMAT, rows)
+    faces = rows.tolist()
+    assert nvb_format.format_rows(FACE_FORMAT, faces) == \
+        reference(FACE_FORMAT, faces)
+
+
+def test_fallback_rows():
+    assert nvb_format.parse_format(' {:s}') is None
+    assert nvb_format.format_rows(' {:s}', [['a'], ['bc']]) == [' a', ' bc']
+    assert nvb_format.format_rows('{: 5.2f}', []) == []
+    ragged = [[1.0, 2.0], [3.0]]
+    assert nvb_format.format_rows('{:4.1f}', ragged) == [' 1.0', ' 3.0']
+    mixed = [[1.5, 'x'], [-0.25, 'y']]
+    assert nvb_format.format_rows('{: 5.2f} {}', mixed) == \
+        [' 1.50 x', '-0.25 y']
+
+
+def test_values_match_str_format():
+    values = [0.5, 1.25, -0.0, 0.0005, 12345.6785]
+    assert nvb_format.format_values('{:5.3f}', values) == \
+        ['{:5.3f}'.format(v) for v in values]
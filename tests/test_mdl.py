@@ -0,0 +1,82 @@
+"""Tests for reading ascii mdl files."""
+
+import pickle
+
+import numpy
+
+from neverblender import nvb_def
+from neverblender import nvb_mdl
+from neverblender import nvb_node
+from neverblender import nvb_parse
+from neverblender import nvb_animnode
+
+MDL = """newmodel test
+setsupermodel test NULL
+beginmodelgeom test
+node dummy test
+  parent NULL
+endnode
+node trimesh plane
+  parent test
+  verts 3
+    0 0 0
+    1 0 0
+    1 1 0
+  faces 1
+    0 1 2 1 0 0 0 0
+endnode
+node light lamp
+  parent plane
+  radius 3.0
+endmodelgeom test
+donemodel test
+"""
+
+
+def read(lazy, tmp_path):
+    filepath = str(tmp_path / 'test.mdl')
+    with open(filepath, 'w') as f:
+        f.write(MDL)
+    options = nvb_def.ImportOptions()
+    options.lazy_nodes = lazy
+    mdl = nvb_mdl.Mdl()
+    mdl.read_mdl(filepath, options)
+    return mdl
+
+
+def test_lazy_nodes_table_only(tmp_path):
+    full = read(False, tmp_path)
+    lazy = read(True, tmp_path)
+    assert not lazy.mdlnodes
+    assert [(s.nodeidx, s.nodetype, s.name, s.parent)
+            for s in lazy.node_table] == \
+        [(n.nodeidx, n.nodetype, n.name, n.parent) for n in full.mdlnodes]
+    with nvb_parse.map_file(lazy.filepath) as data:
+        nodes = list(lazy.load_nodes(data))
+    assert [type(n) for n in nodes] == [type(n) for n in full.mdlnodes]
+    assert numpy.array_equal(nodes[1].verts, full.mdlnodes[1].verts)
+    assert nodes[2].radius == 3.0  # Missing endnode
+
+
+def test_degenerated_uvs_keep_dtype():
+    node = nvb_node.Trimesh()
+    node.tverts = [numpy.array([(0, 0), (0.0005, 0), (1, 1)], numpy.float32)]
+    node.facedef = numpy.array([(0, 1, 2, 1, 0, 1, 2, 0),
+                                (0, 1, 2, 1, 0, 2, 2, 0)], numpy.int32)
+    node.fix_degenerated_uvs()
+    assert node.tverts[0].dtype == numpy.float32
+    assert len(node.tverts[0]) == 6
+    assert node.facedef[:, 4:7].tolist() == [[3, 4, 5], [3, 4, 5]]
+
+
+def test_animation_nodes_share_empty_keys():
+    empty = nvb_animnode.Animnode.empty_key_data
+    node = nvb_animnode.Animnode()
+    assert node.object_data is empty and node.emitter_data is empty
+    node.load_ascii_line('positionkey', ['positionkey'], '0 1 2 3\n', 1)
+    assert type(node.object_data) is dict and 'position' in node.object_data
+    assert empty == {} and node.material_data is empty
+    copied = pickle.loads(pickle.dumps(node))
+    assert copied.material_data is empty
+    assert numpy.array_equal(copied.object_data['position'][0],
+                             node.object_data['position'][0])
@@ -0,0 +1,123 @@
+"""Tests for the ascii mdl tokenizer."""
+
+from neverblender import nvb_mdl
+from neverblender import nvb_parse
+
+LIGHT = """node light flare01
+  parent model01
+  lensflares 2
+  texturenames zd
+    1flare
+    fxpa_flare2
+  flaresizes 2
+    3.0
+    1.5
+  flarepositions zd
+    1.0
+    -0.5
+  flarecolorshifts zd
+    0 0 0
+    0 0 0
+  radius 14.0
+endnode
+"""
+
+
+def tokenize(data):
+    return [(label, line, block, count)
+            for label, line, block, count in nvb_parse.Tokenizer(data)]
+
+
+def test_digit_prefixed_names_are_labels():
+    records = tokenize('radius 2.0\n1flare\n  3.0\nshadow 1\n')
+    assert [(r[0], r[3]) for r in records] == \
+        [('radius', 0), ('1flare', 1), ('shadow', 0)]
+
+
+def test_name_lists():
+    records = tokenize(LIGHT)
+    names = [r for r in records if r[0] == 'texturenames'][0]
+    assert names[2].split() == ['1flare', 'fxpa_flare2'] and names[3] == 2
+    # Unsized lists still end at the first non-numeric line
+    positions = [r for r in records if r[0] == 'flarepositions'][0]
+    assert positions[3] == 2
+
+
+def test_name_lists_bytes():
+    labels = [r[0] for r in tokenize(LIGHT)]
+    assert [r[0] for r in tokenize(LIGHT.encode())] == labels
+
+
+def test_stray_numbers_are_skipped():
+    records = tokenize('position 0 0 0\n1.0 2.0\n-1.#QNAN0\n1e-05\nradius 2\n')
+    assert [r[0] for r in records] == ['position', 'radius']
+
+
+def test_light_reads_digit_prefixed_flare_texture():
+    for data in (LIGHT, LIGHT.encode()):
+        nodes = []
+        nvb_mdl.Mdl.read_ascii_geom(nvb_parse.Tokenizer(data), nodes)
+        light = nodes[0]
+        assert light.flareTextures == ['1flare', 'fxpa_flare2']
+        assert light.flareSizes == [3.0, 1.5]
+        assert light.flarePositions == [1.0, -0.5]
+        assert light.radius == 14.0
+
+
+def test_name_list_ends_at_endnode():
+    data = 'node light l\n  texturenames zd\n    flare\nendnode\n' \
+           'node dummy d\nendnode\n'
+    nodes = []
+    nvb_mdl.Mdl.read_ascii_geom(nvb_parse.Tokenizer(data), nodes)
+    assert len(nodes) == 2 and nodes[0].flareTextures == ['flare']
+
+
+def read_keys(data, label='positionkey', dim=4):
+    """Return the count and array of the first key list in data."""
+    for value in (data, data.encode()):
+        records = [r for r in tokenize(value) if r[0] == label]
+        block, count = records[0][2], records[0][3]
+        yield count, nvb_parse.read_array(block, count, dim)
+
+
+def test_key_list_at_end_of_data():
+    for count, keys in read_keys('positionkey\n  0 1 2 3\n  1 4 5 6'):
+        assert count == 2 and keys.shape == (2, 4)
+        assert keys[1].tolist() == [1.0, 4.0, 5.0, 6.0]
+    for count, keys in read_keys('positionkey'):
+        assert count == 0 and keys.shape == (0, 4)
+    # The tokenized range ends in the middle of the data
+    data = 'positionkey\n  0 1 2 3\n  1 4 5 6\n  2 7 8 9\n'
+    end = data.index('\n  2')
+    records = list(nvb_parse.Tokenizer(data, 0, end))
+    assert records[0][3] == 2
+    assert nvb_parse.read_array(records[0][2], 2, 4).shape == (2, 4)
+
+
+def test_key_list_with_empty_rows():
+    data = 'positionkey\n\n  0 1 2 3\n\n  1 4 5 6\n   \nendnode\n'
+    for count, keys in read_keys(data):
+        assert count == 2 and keys.shape == (2, 4)
+        assert keys[:, 0].tolist() == [0.0, 1.0]
+    for count, keys in read_keys('positionkey\n\n  \nendnode\n'):
+        assert count == 0 and keys.shape == (0, 4)
+
+
+def test_key_list_ends_at_comment_row():
+    data = 'positionkey\n  0 1 2 3 # first\n# comment\n  1 4 5 6\n' \
+           'orientationkey\n  0 0 0 1 0\nendnode\n'
+    for count, keys in read_keys(data):
+        assert count == 1 and keys.tolist() == [[0.0, 1.0, 2.0, 3.0]]
+    for count, keys in read_keys(data, 'orientationkey', 5):
+        assert count == 1 and keys.shape == (1, 5)
+
+
+def test_key_list_followed_by_endnode():
+    data = 'node dummy d\n  positionkey\n    0 1 2 3\n    1 4 5 6\nendnode'
+    for count, keys in read_keys(data):
+        assert count == 2 and keys.shape == (2, 4)
+    for value in (data, data.encode()):
+        assert [r[0] for r in tokenize(value)] == \
+            ['node', 'positionkey', 'endnode']
+    for count, keys in read_keys('positionkey\nendnode\n'):
+        assert count == 0 and keys.shape == (0, 4)